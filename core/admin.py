@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import FriendRequest, Friendship, FriendGroup, Expense, ExpenseShare
+from .models import FriendRequest, Friendship, FriendGroup, Expense, ExpenseShare, Job
 # Register your models here.
 admin.site.register(ExpenseShare)
-admin.site.register(Expense)
\ No newline at end of file
+admin.site.register(Expense)
+admin.site.register(Job)
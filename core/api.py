@@ -0,0 +1,411 @@
+"""
+JSON API for balances, expenses and settlements.
+
+Reads are served straight from .values() querysets: no model instances, no
+serializer fields and no templates on the way out. List endpoints take
+?fields=a,b to return only some fields and are cursor-paginated. Every GET
+carries an ETag built from the fragment cache version counters of the users
+and groups the response depends on, so a matching If-None-Match gets a 304
+without touching the data. Writes go through the same functions in
+core.expenses as the HTML views.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Case, DecimalField, F, Q, When
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from . import compaction, expenses, fragment_cache, group_ledger, ledger, money, settlement, simplify, vectorized
+from . import friends as friend_graph
+from .models import Expense, ExpenseShare, FriendGroup, GroupSplit, TransactionHistory
+
+
+class NewestFirstPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+CENTS = Decimal('0.01')
+
+
+def _plain(value):
+    # Amounts computed in SQL come back from SQLite without their two decimal places
+    return str(value.quantize(CENTS)) if isinstance(value, Decimal) else value
+
+
+class ValuesViewSet(viewsets.GenericViewSet):
+    """
+    Base for read endpoints backed by .values(). Subclasses set ``fields``
+    (output name -> ORM lookup) and implement get_queryset().
+    """
+    fields = {}
+    pagination_class = NewestFirstPagination
+
+    def etag_scope(self):
+        return {'users': [self.request.user.id]}
+
+    def selected_fields(self):
+        requested = self.request.query_params.get('fields')
+        if not requested:
+            return list(self.fields)
+        names = [name for name in requested.split(',') if name]
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        return names
+
+    def rows(self, queryset, names):
+        # The paginator needs its ordering fields even when they are not requested
+        extra = [field.lstrip('-') for field in self.paginator.ordering] if self.paginator else []
+        fetch = list(dict.fromkeys(names + extra))
+        plain = [name for name in fetch if self.fields.get(name, name) == name]
+        aliased = {name: F(self.fields[name]) for name in fetch if self.fields.get(name, name) != name}
+        return queryset.values(*plain, **aliased)
+
+    def represent(self, rows, names):
+        return [{name: _plain(row[name]) for name in names} for row in rows]
+
+    def etag(self):
+        tag = fragment_cache.version_tag(**self.etag_scope())
+        key = f'{self.request.user.id}|{self.request.get_full_path()}|{tag}'
+        return '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+    def conditional(self, build):
+        # The tag is read before the data so a concurrent write can only make
+        # it older than the payload, never newer
+        etag = self.etag()
+        if etag in parse_etags(self.request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = build()
+        response['ETag'] = etag
+        return response
+
+    def build_list(self):
+        names = self.selected_fields()
+        rows = self.rows(self.get_queryset(), names)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.represent(rows, names))
+        return self.get_paginated_response(self.represent(page, names))
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.build_list)
+
+
+class GroupScopedMixin:
+    """Resolves ``group_id`` from the URL; non-members get a 404."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.group = get_object_or_404(FriendGroup, id=kwargs['group_id'], members=request.user)
+
+    def etag_scope(self):
+        return {'groups': [self.group.id]}
+
+
+EXPENSE_FIELDS = {
+    'id': 'id',
+    'description': 'description',
+    'amount': 'amount',
+    'payer_id': 'payer_id',
+    'payer_name': 'payer__username',
+    'group_id': 'group_id',
+    'created_at': 'created_at',
+}
+
+
+class ExpenseInputSerializer(serializers.Serializer):
+    description = serializers.CharField(max_length=255)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    friends = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class GroupExpenseInputSerializer(serializers.Serializer):
+    description = serializers.CharField(max_length=255)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    paid = serializers.DictField(child=serializers.DecimalField(max_digits=10, decimal_places=2), allow_empty=False)
+    split_type = serializers.ChoiceField(choices=money.SPLIT_TYPES, default=money.EQUAL)
+    split = serializers.DictField(child=serializers.CharField(), required=False, default=dict)
+
+
+class HypotheticalExpenseSerializer(GroupExpenseInputSerializer):
+    description = serializers.CharField(max_length=255, required=False)
+    # Split between these members only; everyone in the group by default
+    members = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+
+    def validate_members(self, members):
+        return list(dict.fromkeys(members))
+
+
+class PreviewInputSerializer(serializers.Serializer):
+    expenses = HypotheticalExpenseSerializer(many=True, allow_empty=False, max_length=100)
+    strategy = serializers.ChoiceField(choices=simplify.STRATEGIES, required=False)
+
+
+class SettlementInputSerializer(serializers.Serializer):
+    share = serializers.IntegerField(required=False)
+    shares = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    with_user = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if len(attrs) != 1:
+            raise ValidationError("Give exactly one of 'share', 'shares' or 'with_user'.")
+        return attrs
+
+
+class ExpenseViewSet(ValuesViewSet):
+    """Every expense the user paid for or has a share in."""
+    fields = EXPENSE_FIELDS
+
+    def get_queryset(self):
+        user = self.request.user
+        return Expense.objects.filter(
+            Q(payer=user) | Q(id__in=ExpenseShare.objects.filter(user=user).values('expense_id'))
+        )
+
+    def retrieve(self, request, pk=None):
+        def build():
+            names = self.selected_fields()
+            expense = self.rows(self.get_queryset().filter(id=pk), names).first()
+            if expense is None:
+                return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+            data = self.represent([expense], names)[0]
+            data['shares'] = [
+                {key: _plain(value) for key, value in share.items()}
+                for share in ExpenseShare.objects.filter(expense_id=pk).order_by('id').values(
+                    'user_id', 'amount', 'settled', username=F('user__username'))
+            ]
+            return Response(data)
+        return self.conditional(build)
+
+    def create(self, request):
+        data = ExpenseInputSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        friend_ids = list(dict.fromkeys(data.validated_data['friends']))
+        not_friends = set(friend_ids) - friend_graph.friend_ids(request.user)
+        if not_friends:
+            raise ValidationError({'friends': f"Not your friends: {sorted(not_friends)}"})
+
+        expense = expenses.create_personal_expense(
+            request.user, data.validated_data['description'], money.to_paise(data.validated_data['amount']), friend_ids
+        )
+        names = list(self.fields)
+        row = self.rows(Expense.objects.filter(id=expense.id), names).get()
+        return Response(self.represent([row], names)[0], status=status.HTTP_201_CREATED)
+
+
+def _group_split(values, member_ids, group_member_ids=None):
+    """
+    (total, contributions, owed) in paise for validated group expense input,
+    split between ``member_ids`` (by default the whole group).
+    """
+    group_member_ids = group_member_ids or member_ids
+    strangers = sorted(
+        (set(values['paid']) | set(values['split'])) - {str(member_id) for member_id in group_member_ids}
+    ) + sorted(map(str, set(member_ids) - set(group_member_ids)))
+    if strangers:
+        raise ValidationError({'paid': f"Not members of this group: {', '.join(strangers)}"})
+
+    total = money.to_paise(values['amount'])
+    contributions = {
+        int(member_id): money.to_paise(paid)
+        for member_id, paid in values['paid'].items() if paid > 0
+    }
+    split_values = [values['split'].get(str(member_id), '0') for member_id in member_ids]
+    owed = money.split(total, values['split_type'], split_values, n=len(member_ids))
+    return total, contributions, owed
+
+
+class GroupExpenseViewSet(GroupScopedMixin, ValuesViewSet):
+    fields = EXPENSE_FIELDS
+
+    def get_queryset(self):
+        return Expense.objects.filter(group=self.group)
+
+    def create(self, request, group_id=None):
+        data = GroupExpenseInputSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        values = data.validated_data
+        member_ids = list(self.group.members.order_by('id').values_list('id', flat=True))
+        try:
+            total, contributions, owed = _group_split(values, member_ids)
+            expense = expenses.create_group_expense(
+                self.group, values['description'], total, member_ids, contributions, owed
+            )
+        except expenses.SplitError as e:
+            raise ValidationError({'non_field_errors': [str(e)]})
+
+        names = list(self.fields)
+        row = self.rows(Expense.objects.filter(id=expense.id), names).get()
+        return Response(self.represent([row], names)[0], status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def preview(self, request, group_id=None):
+        """
+        The balances and suggested splits if the given expenses were added,
+        without adding them. The group is read once; the expenses are applied
+        to an in-memory copy of its balances.
+        """
+        data = PreviewInputSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        what_if = group_ledger.GroupLedger.load(self.group)
+        try:
+            for values in data.validated_data['expenses']:
+                member_ids = values.get('members') or what_if.member_ids
+                total, contributions, owed = _group_split(values, member_ids, what_if.member_ids)
+                what_if.apply_expense(total, contributions, owed, member_ids)
+        except expenses.SplitError as e:
+            raise ValidationError({'non_field_errors': [str(e)]})
+
+        return Response({
+            'balances': [{'user_id': uid, 'net': _plain(money.from_paise(net))} for uid, net in what_if.nets().items()],
+            'splits': [
+                {'from_user_id': debtor, 'to_user_id': creditor, 'amount': _plain(money.from_paise(amount))}
+                for debtor, creditor, amount in what_if.transfers(data.validated_data.get('strategy'))
+            ],
+        })
+
+
+class BalanceViewSet(ValuesViewSet):
+    """Ledger totals plus the open balance with each counterparty."""
+    fields = {
+        'counterparty_id': 'counterparty_id',
+        'counterparty_name': 'counterparty__username',
+        'owes': 'owes',
+        'owed': 'owed',
+        'net': 'net',
+    }
+    pagination_class = None
+
+    def get_queryset(self):
+        return ledger.pair_nets(self.request.user).order_by('counterparty_id')
+
+    def build_list(self):
+        names = self.selected_fields()
+        owes, owed = ledger.get_totals(self.request.user)
+        settled_paid, settled_received = compaction.settled_totals(self.request.user)
+        return Response({
+            'owes': _plain(owes),
+            'owed': _plain(owed),
+            'net': _plain(owed - owes),
+            'settled_paid': _plain(settled_paid),
+            'settled_received': _plain(settled_received),
+            'counterparties': self.represent(self.rows(self.get_queryset(), names), names),
+        })
+
+
+class BalanceShareViewSet(ValuesViewSet):
+    """The open shares behind the balance with one counterparty, newest first."""
+    fields = {
+        'id': 'id',
+        'expense_id': 'expense_id',
+        'description': 'expense__description',
+        'group_id': 'expense__group_id',
+        'payer_id': 'expense__payer_id',
+        'amount': 'amount',
+        # Positive when the counterparty owes the current user
+        'net': 'net',
+        'created_at': 'expense__created_at',
+    }
+
+    def get_queryset(self):
+        user = self.request.user
+        return settlement.open_shares(user, with_user=self.kwargs['counterparty_id']).annotate(
+            net=Case(When(user=user, then=F('amount')), default=-F('amount'),
+                     output_field=DecimalField(max_digits=10, decimal_places=2))
+        )
+
+
+class SplitViewSet(GroupScopedMixin, ValuesViewSet):
+    fields = {
+        'id': 'id',
+        'from_user_id': 'from_user_id',
+        'from_name': 'from_user__username',
+        'to_user_id': 'to_user_id',
+        'to_name': 'to_user__username',
+        'amount': 'amount',
+        'settled': 'settled',
+        'created_at': 'created_at',
+    }
+
+    def get_queryset(self):
+        return GroupSplit.objects.filter(group=self.group)
+
+
+class GroupReportViewSet(GroupScopedMixin, ValuesViewSet):
+    """Per-member nets, totals and open debts of a group, folded from its whole share history."""
+    pagination_class = None
+
+    def build_list(self):
+        report = vectorized.group_report(self.group)
+        amounts = ('net', 'lent', 'borrowed', 'open')
+        return Response({
+            'engine': report['engine'],
+            'members': [
+                {name: _plain(money.from_paise(value)) if name in amounts else value for name, value in member.items()}
+                for member in report['members']
+            ],
+            'debts': [
+                {'from_user_id': debtor, 'to_user_id': creditor, 'amount': _plain(money.from_paise(amount))}
+                for debtor, creditor, amount in report['debts']
+            ],
+        })
+
+
+class SettlementViewSet(ValuesViewSet):
+    fields = {
+        'id': 'id',
+        'amount': 'amount',
+        'description': 'description',
+        'group_id': 'group_id',
+        'related_user_id': 'related_user_id',
+        'related_name': 'related_user__username',
+        'created_at': 'created_at',
+        'settled_at': 'settled_at',
+    }
+
+    def get_queryset(self):
+        return TransactionHistory.objects.filter(user=self.request.user, transaction_type='settlement')
+
+    def create(self, request):
+        """
+        Settle one share ({"share": id}), several ({"shares": [ids]}) or
+        everything open with another user ({"with_user": id}) in one batch.
+        An Idempotency-Key header makes retries return the first result.
+        """
+        data = SettlementInputSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        data = data.validated_data
+        key = request.headers.get('Idempotency-Key')
+        user = request.user
+
+        if 'share' in data:
+            share = get_object_or_404(ExpenseShare.objects.select_related('expense'), id=data['share'])
+            if user.id not in (share.user_id, share.expense.payer_id):
+                raise PermissionDenied("You can't settle this expense")
+            result = settlement.settle(user, share_ids=[share.id], idempotency_key=key)
+            body = {'share': share.id, 'amount': _plain(abs(share.amount)), 'settled': True}
+        elif 'shares' in data:
+            share_ids = set(data['shares'])
+            allowed = ExpenseShare.objects.filter(Q(user=user) | Q(expense__payer=user), id__in=share_ids)
+            if allowed.count() != len(share_ids):
+                raise PermissionDenied("You can't settle some of these expenses")
+            result = settlement.settle(user, share_ids=share_ids, idempotency_key=key)
+            body = result
+        else:
+            other = get_object_or_404(User, id=data['with_user'])
+            result = settlement.settle(user, with_user=other, idempotency_key=key)
+            body = result
+
+        created = result['shares'] and not result['replayed']
+        return Response(body, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from . import search, tasks  # noqa: F401 (registers the background tasks)
+        post_save.connect(search.user_saved, sender=User, dispatch_uid='core.search.user_saved')
+        post_delete.connect(search.user_deleted, sender=User, dispatch_uid='core.search.user_deleted')
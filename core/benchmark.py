@@ -0,0 +1,94 @@
+"""
+Benchmark suite for the views and the algorithms behind them.
+
+measure() times split calculation, dashboard balance assembly and history
+paging directly, and the read-heavy pages through the test client, as the
+busiest user in their busiest group. 'manage.py run_benchmarks' seeds a
+throwaway database at each of SIZES, collects the measurements into a JSON
+report and compare()s it against a stored baseline, failing on regressions.
+"""
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from . import expenses, group_balances, money, pagination, simplify, vectorized, views
+from .models import Expense, ExpenseShare, FriendGroup, TransactionHistory
+
+SIZES = {
+    'small': {'users': 200, 'groups': 20, 'expenses': 2000},
+    'medium': {'users': 2000, 'groups': 200, 'expenses': 50000},
+    'large': {'users': 20000, 'groups': 2000, 'expenses': 1000000},
+}
+
+
+def timed(fn, repeat):
+    """Run ``fn`` once to warm up, then ``repeat`` times; return the median and max in ms."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(statistics.median(samples), 3), 'max_ms': round(max(samples), 3)}
+
+
+def busiest():
+    """The user with the most open shares and the group of theirs with the most expenses."""
+    user_id = ExpenseShare.objects.filter(settled=False).values('user_id').annotate(
+        n=Count('id')).order_by('-n').values_list('user_id', flat=True).first()
+    if user_id is None:
+        return None, None
+    user = User.objects.get(id=user_id)
+    group_id = Expense.objects.filter(group__members=user).values('group_id').annotate(
+        n=Count('id')).order_by('-n').values_list('group_id', flat=True).first()
+    return user, FriendGroup.objects.filter(id=group_id).first()
+
+
+def measure(repeat=5):
+    user, group = busiest()
+    if user is None:
+        return {}
+    client = Client()
+    client.force_login(user)
+    nets = [money.to_paise(net, limit=None) for net in group_balances.get_nets(group).values()] if group else []
+
+    cases = {
+        'simplify_greedy': lambda: simplify.simplify(nets, simplify.GREEDY),
+        'simplify_heap': lambda: simplify.simplify(nets, simplify.HEAP),
+        'dashboard_balances': lambda: async_to_sync(views.dashboard_balances)(user),
+        'history_page': lambda: pagination.keyset_page(TransactionHistory.objects.filter(user=user)),
+        'view_dashboard': lambda: client.get(reverse('dashboard')),
+        'view_transaction_history': lambda: client.get(reverse('transaction_history')),
+        'view_friends_list': lambda: client.get(reverse('friends_list')),
+    }
+    if group is not None:
+        cases['split_calculation'] = lambda: expenses.recalculate_group_splits(group)
+        cases['view_group_detail'] = lambda: client.get(reverse('group_detail', args=[group.id]))
+        cases['group_report_python'] = lambda: vectorized.group_report(group, use_numpy=False)
+        if vectorized.np is not None:
+            cases['group_report_numpy'] = lambda: vectorized.group_report(group, use_numpy=True)
+    return {name: timed(fn, repeat) for name, fn in cases.items()}
+
+
+def compare(results, baseline, tolerance=0.25, min_ms=1.0):
+    """
+    Return (size, name, baseline_ms, current_ms) for every measurement whose
+    median grew by more than ``tolerance`` (a fraction) and by at least
+    ``min_ms``, so sub-millisecond noise never fails a run. Measurements
+    missing from either side are skipped.
+    """
+    regressions = []
+    for size, current in results.items():
+        for name, result in current.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            was, now = before['median_ms'], result['median_ms']
+            if now > was * (1 + tolerance) and now - was >= min_ms:
+                regressions.append((size, name, was, now))
+    return regressions
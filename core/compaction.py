@@ -0,0 +1,164 @@
+"""
+Compaction of settled activity.
+
+compact() moves old expenses whose shares are all settled (the payer's own
+share aside), together with those shares, into the Archived* tables, and
+does the same for old TransactionHistory rows. What the moved rows
+contributed is rolled into checkpoint rows first:
+
+* GroupCheckpoint holds each member's group net from archived expenses, so
+  a member's GroupBalance is the checkpoint plus their live shares.
+* UserCheckpoint holds the settled amounts a user paid and received and how
+  many history rows were archived, so lifetime totals are the checkpoint
+  plus the recent live rows.
+
+Open shares never move, so the user ledger is unaffected. Each batch runs in
+its own transaction; compaction can run alongside traffic and be stopped at
+any point.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fragment_cache, group_balances
+from .ledger import ZERO, merge_deltas, share_entries, to_decimal
+from .models import (
+    ArchivedExpense, ArchivedExpenseShare, ArchivedTransactionHistory, Expense, ExpenseShare, GroupCheckpoint,
+    TransactionHistory, UserCheckpoint,
+)
+
+HISTORY_FIELDS = ('id', 'user_id', 'transaction_type', 'amount', 'group_id', 'related_user_id', 'description',
+                  'created_at', 'settled_at')
+
+
+def settled_flows(rows):
+    """Fold settled (user_id, payer_id, amount) share rows into {user_id: [paid, received]}."""
+    # What a user owed on a settled share they paid, what they were owed they received
+    flows = defaultdict(lambda: [ZERO, ZERO])
+    for user_id, payer_id, amount in rows:
+        for uid, _, owes, owed in share_entries(user_id, payer_id, to_decimal(amount)):
+            flows[uid][0] += owes
+            flows[uid][1] += owed
+    return flows
+
+
+def settled_totals(user):
+    """Return (settled_paid, settled_received) over the user's whole history."""
+    checkpoint = UserCheckpoint.objects.filter(user=user).values_list('settled_paid', 'settled_received').first()
+    paid, received = checkpoint or (ZERO, ZERO)
+    recent = ExpenseShare.objects.filter(
+        models.Q(user=user) | models.Q(expense__payer=user), settled=True
+    ).values_list('user_id', 'expense__payer_id', 'amount')
+    recent_paid, recent_received = settled_flows(recent).get(user.id, (ZERO, ZERO))
+    return paid + recent_paid, received + recent_received
+
+
+def compactable_expenses(before):
+    open_shares = ExpenseShare.objects.filter(settled=False).exclude(user_id=F('expense__payer_id'))
+    return Expense.objects.filter(created_at__lt=before).exclude(id__in=open_shares.values('expense_id'))
+
+
+def _checkpoint(model, key_fields, value_fields, deltas, now):
+    deltas = {key: values for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+    lookup = {f'{field}__in': {key[i] for key in deltas} for i, field in enumerate(key_fields)}
+    existing = {
+        tuple(getattr(row, field) for field in key_fields): row
+        for row in model.objects.select_for_update().filter(**lookup)
+    }
+    merge_deltas(model, deltas, key_fields, value_fields, existing)
+    model.objects.filter(**lookup).update(as_of=now)
+
+
+def compact_expenses(before, batch_size=500, log=None):
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(compactable_expenses(before).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return archived
+            now = timezone.now()
+            expenses = list(Expense.objects.filter(id__in=ids).values(
+                'id', 'payer_id', 'amount', 'description', 'created_at', 'group_id'))
+            shares = list(ExpenseShare.objects.filter(expense_id__in=ids).values(
+                'id', 'expense_id', 'user_id', 'amount', 'settled', 'expense__group_id', 'expense__payer_id'))
+
+            nets = group_balances.compute_nets(
+                (s['expense__group_id'], s['user_id'], s['expense__payer_id'], s['amount'], s['settled']) for s in shares
+            )
+            _checkpoint(GroupCheckpoint, ('group_id', 'user_id'), ('net',),
+                        {key: (net,) for key, net in nets.items()}, now)
+            flows = settled_flows(
+                (s['user_id'], s['expense__payer_id'], s['amount']) for s in shares if s['settled']
+            )
+            _checkpoint(UserCheckpoint, ('user_id',), ('settled_paid', 'settled_received'),
+                        {(uid,): tuple(flow) for uid, flow in flows.items()}, now)
+
+            ArchivedExpense.objects.bulk_create(ArchivedExpense(**expense) for expense in expenses)
+            ArchivedExpenseShare.objects.bulk_create(
+                ArchivedExpenseShare(id=s['id'], expense_id=s['expense_id'], user_id=s['user_id'],
+                                     amount=s['amount'], settled=s['settled'])
+                for s in shares
+            )
+            Expense.objects.filter(id__in=ids).delete()
+            fragment_cache.invalidate(
+                users={s['user_id'] for s in shares},
+                groups={e['group_id'] for e in expenses if e['group_id']},
+            )
+        archived += len(ids)
+        if log:
+            log(f"{archived} expenses archived")
+
+
+def compact_history(before, batch_size=500, log=None):
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(TransactionHistory.objects.filter(created_at__lt=before).order_by('id').values(
+                *HISTORY_FIELDS)[:batch_size])
+            if not rows:
+                return archived
+            counts = defaultdict(int)
+            for row in rows:
+                counts[(row['user_id'],)] += 1
+            _checkpoint(UserCheckpoint, ('user_id',), ('archived_history',),
+                        {key: (count,) for key, count in counts.items()}, timezone.now())
+
+            ArchivedTransactionHistory.objects.bulk_create(ArchivedTransactionHistory(**row) for row in rows)
+            TransactionHistory.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        archived += len(rows)
+        if log:
+            log(f"{archived} history rows archived")
+
+
+def forget_archived_shares(ids):
+    """
+    Take the archived shares in ``ids`` out of the checkpoints (and so out of
+    the group balances built on them) before they are deleted.
+    """
+    shares = list(ArchivedExpenseShare.objects.filter(id__in=ids).values_list(
+        'expense__group_id', 'user_id', 'expense__payer_id', 'amount', 'settled'))
+    now = timezone.now()
+    nets = group_balances.compute_nets(shares, sign=-1)
+    _checkpoint(GroupCheckpoint, ('group_id', 'user_id'), ('net',), {key: (net,) for key, net in nets.items()}, now)
+    group_balances.apply_deltas(nets)
+    flows = settled_flows((user_id, payer_id, amount) for _, user_id, payer_id, amount, settled in shares if settled)
+    _checkpoint(UserCheckpoint, ('user_id',), ('settled_paid', 'settled_received'),
+                {(uid,): (-paid, -received) for uid, (paid, received) in flows.items()}, now)
+    fragment_cache.invalidate(users={row[1] for row in shares} | {row[2] for row in shares},
+                              groups={row[0] for row in shares if row[0]})
+
+
+def compact(before=None, batch_size=500, log=None):
+    """Archive settled activity older than ``before`` (default: COMPACTION_AFTER_DAYS ago)."""
+    if before is None:
+        before = timezone.now() - timedelta(days=settings.COMPACTION_AFTER_DAYS)
+    return {
+        'expenses': compact_expenses(before, batch_size, log),
+        'history': compact_history(before, batch_size, log),
+    }
@@ -0,0 +1,92 @@
+"""
+Read replica routing.
+
+Writes always go to the primary ('default'). Reads go to the primary too,
+except inside views marked with @replica_reads (the read-only dashboard,
+history, search and friends pages), which read from one of
+DATABASE_REPLICAS. A successful POST (or other unsafe request) sets a short
+lived cookie that keeps that browser on the primary for
+DATABASE_STICKY_SECONDS, so users always see their own writes even while
+the replicas lag behind.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'use_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_db = contextvars.ContextVar('read_db', default=None)
+
+
+def replica_reads(view):
+    """Let ``view`` read from a replica; it must not write."""
+    view.replica_reads = True
+    return view
+
+
+def reading_from_replica():
+    return _read_db.get() is not None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_db.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS or db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # None means everything goes to the primary
+        request.read_db = None
+        if (getattr(view_func, 'replica_reads', False) and request.method in SAFE_METHODS
+                and STICKY_COOKIE not in request.COOKIES):
+            request.read_db = random.choice(settings.DATABASE_REPLICAS)
+            _read_db.set(request.read_db)
+
+    def _stick(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=settings.DATABASE_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _read_db.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_db.reset(token)
+        return self._stick(request, response)
+
+    async def __acall__(self, request):
+        token = _read_db.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_db.reset(token)
+        return self._stick(request, response)
@@ -0,0 +1,260 @@
+"""
+Split logic shared by the expense views, the JSON API and the bulk importer.
+
+Amounts are handled as integer paise (see core.money) so the shares of an
+expense always add up to it exactly. The build_* helpers return unsaved
+ExpenseShare / TransactionHistory rows for an Expense so callers can write
+them with bulk_create in whatever batch size suits them; the create_*
+functions do the complete write, ledger and cache bookkeeping included
+(settling lives in core.settlement). The heavier group and account operations at the bottom run as
+background jobs (see core/tasks.py).
+"""
+from django.conf import settings
+from django.db import models, transaction
+
+from . import compaction, fragment_cache, group_balances, jobs, ledger, money, purge, simplify
+from .models import (
+    ArchivedExpense, ArchivedExpenseShare, ArchivedTransactionHistory, Expense, ExpenseShare, FriendGroup, GroupBalance,
+    GroupCheckpoint, GroupSplit, TransactionHistory,
+)
+from .money import SplitError
+
+
+def build_personal_rows(expense, friend_ids):
+    """Equal split of ``expense`` between its payer and ``friend_ids``."""
+    total = money.to_paise(expense.amount)
+    if total <= 0 or not friend_ids:
+        raise SplitError("Invalid amount or no friends selected.")
+
+    payer_id = expense.payer_id
+    # Slot 0 is the payer, the friends follow in order
+    owed = money.split_equal(total, len(friend_ids) + 1)
+
+    history = [TransactionHistory(
+        user_id=payer_id,
+        transaction_type='expense',
+        amount=expense.amount,
+        description=expense.description,
+        group_id=expense.group_id
+    )]
+    history.extend(
+        TransactionHistory(
+            user_id=friend_id,
+            transaction_type='expense',
+            amount=money.from_paise(friend_owed),
+            description=f"Share of {expense.description}",
+            group_id=expense.group_id,
+            related_user_id=payer_id
+        )
+        for friend_id, friend_owed in zip(friend_ids, owed[1:])
+    )
+
+    # Payer's share: total paid - their fair share
+    shares = [ExpenseShare(expense=expense, user_id=payer_id, amount=money.from_paise(total - owed[0]))]
+    # Friends' shares: 0 paid - their fair share
+    shares.extend(
+        ExpenseShare(expense=expense, user_id=friend_id, amount=money.from_paise(-friend_owed))
+        for friend_id, friend_owed in zip(friend_ids, owed[1:])
+    )
+    return shares, history
+
+
+def group_payer(contributions, total):
+    """
+    Validate ``contributions`` ({user_id: paise paid}) against the expense
+    total in paise and return the main payer (who paid the most).
+    """
+    if not contributions:
+        raise SplitError("Nobody paid for this expense")
+    if sum(contributions.values()) != total:
+        raise SplitError("Total contributions don't match expense amount")
+    return max(contributions.items(), key=lambda x: x[1])[0]
+
+
+def build_group_rows(expense, member_ids, contributions, owed=None):
+    """
+    Split a group ``expense`` where members paid ``contributions``
+    ({user_id: paise}). ``owed`` lists what each member owes in paise, in
+    ``member_ids`` order; it defaults to an equal split.
+    """
+    total = money.to_paise(expense.amount)
+    if owed is None:
+        owed = money.split_equal(total, len(member_ids))
+    main_payer_id = expense.payer_id
+
+    # Main expense history record for the payer
+    history = [TransactionHistory(
+        user_id=main_payer_id,
+        transaction_type='expense',
+        amount=expense.amount,
+        group_id=expense.group_id,
+        description=expense.description
+    )]
+
+    # Shares showing net balance for each member, plus a history record
+    # for each participant
+    shares = []
+    for member_id, member_owed in zip(member_ids, owed):
+        shares.append(ExpenseShare(
+            expense=expense,
+            user_id=member_id,
+            amount=money.from_paise(contributions.get(member_id, 0) - member_owed)
+        ))
+        if member_id != main_payer_id:
+            history.append(TransactionHistory(
+                user_id=member_id,
+                transaction_type='expense',
+                amount=money.from_paise(-member_owed),
+                group_id=expense.group_id,
+                description=f"Share of {expense.description}",
+                related_user_id=main_payer_id
+            ))
+    return shares, history
+
+
+def ledger_rows(shares, payer_id):
+    return [(share.user_id, payer_id, share.amount) for share in shares]
+
+
+@transaction.atomic
+def create_personal_expense(payer, description, amount, friend_ids):
+    """Create an expense of ``amount`` paise paid by ``payer`` and split equally with ``friend_ids``."""
+    expense = Expense.objects.create(description=description, amount=money.from_paise(amount), payer=payer)
+    expense.friends.set(friend_ids)
+
+    shares, history = build_personal_rows(expense, friend_ids)
+    ExpenseShare.objects.bulk_create(shares)
+    TransactionHistory.objects.bulk_create(history)
+
+    ledger.apply_shares(ledger_rows(shares, payer.id))
+    fragment_cache.invalidate(users=[payer.id, *friend_ids])
+    return expense
+
+
+@transaction.atomic
+def create_group_expense(group, description, total, member_ids, contributions, owed):
+    """
+    Create a group expense of ``total`` paise. ``contributions`` and ``owed``
+    are as for build_group_rows; the member who paid the most is the payer.
+    """
+    payer_id = group_payer(contributions, total)
+    expense = Expense.objects.create(
+        group=group,
+        description=description,
+        amount=money.from_paise(total),
+        payer_id=payer_id
+    )
+
+    shares, history = build_group_rows(expense, member_ids, contributions, owed)
+    ExpenseShare.objects.bulk_create(shares)
+    TransactionHistory.objects.bulk_create(history)
+
+    ledger.apply_shares(ledger_rows(shares, payer_id))
+    group_balances.apply_shares(group_balances.rows_for(expense, shares))
+    fragment_cache.invalidate(users=member_ids, groups=[group.id])
+    jobs.schedule_split_recalculation(group.id)
+    return expense
+
+
+def recalculate_group_splits(group, strategy=None):
+    """
+    Replace ``group``'s splits with the transfers that settle its members'
+    net balances. Returns the number of transfers, or None when the group
+    has no expenses.
+    """
+    members = list(group.members.order_by('id'))
+    member_ids = [member.id for member in members]
+
+    # The running balances already hold each member's net, so this reads N
+    # rows however many expenses the group has
+    nets = group_balances.get_nets(group)
+    if not nets or not members:
+        return None
+
+    net_balance = dict.fromkeys(member_ids, 0)
+    for user_id, net in nets.items():
+        if user_id in net_balance:
+            net_balance[user_id] = money.to_paise(net, limit=None)
+
+    # Settle the net balances with the configured strategy
+    if strategy not in simplify.STRATEGIES:
+        strategy = settings.SPLIT_STRATEGY
+    transfers = simplify.simplify(
+        [net_balance[uid] for uid in member_ids],
+        strategy=strategy,
+        time_budget=settings.SPLIT_TIME_BUDGET,
+    )
+    new_splits = [
+        GroupSplit(
+            group=group,
+            from_user=members[from_slot],
+            to_user=members[to_slot],
+            amount=money.from_paise(amount)
+        )
+        for from_slot, to_slot, amount in transfers
+    ]
+
+    # Replace the old splits atomically so readers never see a half-written set
+    with transaction.atomic():
+        GroupSplit.objects.filter(group=group).delete()
+        GroupSplit.objects.bulk_create(new_splits)
+        fragment_cache.invalidate(groups=[group.id])
+    return len(new_splits)
+
+
+def _remove_shares(ids, group_balances_too=True):
+    """Take the shares in ``ids`` out of the ledger (and group balances) before they are deleted."""
+    chunk = ExpenseShare.objects.filter(id__in=ids)
+    rows = list(ledger.unsettled_share_rows(chunk))
+    ledger.apply_shares(rows, sign=-1)
+    groups = set()
+    if group_balances_too:
+        group_rows = list(group_balances.share_rows(chunk))
+        group_balances.apply_shares(group_rows, sign=-1)
+        groups = {row[0] for row in group_rows}
+    fragment_cache.invalidate(users={uid for user_id, payer_id, _ in rows for uid in (user_id, payer_id)},
+                              groups=groups)
+
+
+def clear_user_transactions(user, progress=None, report=None):
+    """
+    Delete every expense ``user`` paid for and every share they hold, archived
+    ones included; returns the number of live expenses deleted.
+    """
+    paid = Expense.objects.filter(payer=user)
+    deleted = purge.purge([
+        purge.Step('shares', ExpenseShare.objects.filter(models.Q(user=user) | models.Q(expense__payer=user)),
+                   before=_remove_shares),
+        purge.Step('expense_friends', Expense.friends.through.objects.filter(expense__payer=user)),
+        purge.Step('expenses', paid),
+        purge.Step('archived_shares',
+                   ArchivedExpenseShare.objects.filter(models.Q(user=user) | models.Q(expense__payer=user)),
+                   before=compaction.forget_archived_shares),
+        purge.Step('archived_expenses', ArchivedExpense.objects.filter(payer=user)),
+    ], progress=progress, report=report)
+    fragment_cache.invalidate(users=[user.id])
+    return deleted.get('expenses', 0)
+
+
+def delete_group(group, progress=None, report=None):
+    """
+    Delete ``group`` and everything in it, children first. The delete view
+    has already set deleted_at, which hides the group while this runs.
+    """
+    member_ids = list(group.members.order_by('id').values_list('id', flat=True))
+    purge.purge([
+        purge.Step('shares', ExpenseShare.objects.filter(expense__group=group),
+                   before=lambda ids: _remove_shares(ids, group_balances_too=False)),
+        purge.Step('expense_friends', Expense.friends.through.objects.filter(expense__group=group)),
+        purge.Step('expenses', Expense.objects.filter(group=group)),
+        purge.Step('archived_shares', ArchivedExpenseShare.objects.filter(expense__group=group)),
+        purge.Step('archived_expenses', ArchivedExpense.objects.filter(group=group)),
+        purge.Step('history', TransactionHistory.objects.filter(group=group)),
+        purge.Step('archived_history', ArchivedTransactionHistory.objects.filter(group=group)),
+        purge.Step('splits', GroupSplit.objects.filter(group=group)),
+        purge.Step('balances', GroupBalance.objects.filter(group=group)),
+        purge.Step('checkpoints', GroupCheckpoint.objects.filter(group=group)),
+        purge.Step('members', FriendGroup.members.through.objects.filter(friendgroup=group)),
+        purge.Step('group', FriendGroup.all_objects.filter(id=group.id)),
+    ], progress=progress, report=report)
+    fragment_cache.invalidate(users=member_ids, groups=[group.id])
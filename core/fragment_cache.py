@@ -0,0 +1,161 @@
+"""
+Versioned fragment caching.
+
+Rendered page fragments are stored in Django's cache under keys that embed
+the current version counter of every user and group they depend on. Writes
+never delete fragments; they call invalidate(), which bumps the counters once
+the transaction commits, so every fragment rendered from the old state
+becomes unreachable and the cache's LRU eviction reclaims the space.
+
+Counters that go missing (evicted or a cold cache) restart from a time-based
+value, so a fresh counter can never collide with a version still referenced
+by an old fragment.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import db_router
+
+# Fragments are rendered without a request; forms get this placeholder,
+# swapped for the real CSRF token when the fragment is served.
+CSRF_PLACEHOLDER = '__fragment_csrf_token__'
+# Likewise the idempotency key of settle forms is fresh for every page served,
+# never one stored with the fragment and replayed from another render
+SETTLE_KEY_PLACEHOLDER = '__fragment_settle_key__'
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _count(outcome):
+    with _lock:
+        _stats[outcome] += 1
+
+
+def stats():
+    with _lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+
+def reset_stats():
+    with _lock:
+        _stats.update(hits=0, misses=0)
+
+
+def _version_key(kind, obj_id):
+    return f'ver:{kind}:{obj_id}'
+
+
+def _bump(kind, ids):
+    for obj_id in ids:
+        key = _version_key(kind, obj_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate(users=(), groups=()):
+    """Bump the versions of ``users`` and ``groups`` after the current transaction commits."""
+    users, groups = set(users), set(groups)
+
+    def bump():
+        _bump('user', users)
+        _bump('group', groups)
+
+    transaction.on_commit(bump)
+
+
+def _tag_keys(users, groups):
+    return [_version_key('user', uid) for uid in users] + [_version_key('group', gid) for gid in groups]
+
+
+def _missing_versions(keys, found):
+    return {key: time.time_ns() for key in keys if key not in found}
+
+
+def _format_tag(keys, found):
+    return ':'.join(f'{key[4:]}={found[key]}' for key in keys)
+
+
+def version_tag(users=(), groups=()):
+    """A string that changes whenever any of ``users`` or ``groups`` is invalidated."""
+    keys = _tag_keys(users, groups)
+    if not keys:
+        return ''
+    found = cache.get_many(keys)
+    missing = _missing_versions(keys, found)
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return _format_tag(keys, found)
+
+
+async def aversion_tag(users=(), groups=()):
+    keys = _tag_keys(users, groups)
+    if not keys:
+        return ''
+    found = await cache.aget_many(keys)
+    missing = _missing_versions(keys, found)
+    if missing:
+        await cache.aset_many(missing, None)
+        found.update(missing)
+    return _format_tag(keys, found)
+
+
+def _render(template, context):
+    _count('misses')
+    return render_to_string(template, dict(context, csrf_token=CSRF_PLACEHOLDER, settle_key=SETTLE_KEY_PLACEHOLDER))
+
+
+def _timeout():
+    # A replica may still be behind the version we keyed on; keep what it
+    # rendered only until the replicas have caught up
+    if db_router.reading_from_replica():
+        return settings.DATABASE_STICKY_SECONDS
+    return settings.FRAGMENT_CACHE_TIMEOUT
+
+
+def _serve(request, html):
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, get_token(request))
+    if SETTLE_KEY_PLACEHOLDER in html:
+        html = html.replace(SETTLE_KEY_PLACEHOLDER, uuid.uuid4().hex)
+    return mark_safe(html)
+
+
+def render(request, name, template, get_context, users=(), groups=()):
+    """
+    Return the HTML of ``template`` for the current versions of ``users``
+    and ``groups``, rendering it with ``get_context()`` only on a miss.
+    """
+    key = f'frag:{name}:{version_tag(users, groups)}'
+    html = cache.get(key)
+    if html is None:
+        html = _render(template, get_context())
+        cache.set(key, html, _timeout())
+    else:
+        _count('hits')
+    return _serve(request, html)
+
+
+async def arender(request, name, template, get_context, users=(), groups=()):
+    """render() for async views; ``get_context`` is a coroutine function."""
+    key = f'frag:{name}:{await aversion_tag(users, groups)}'
+    html = await cache.aget(key)
+    if html is None:
+        html = _render(template, await get_context())
+        await cache.aset(key, html, _timeout())
+    else:
+        _count('hits')
+    return _serve(request, html)
@@ -0,0 +1,75 @@
+"""
+Friend graph lookups.
+
+Friendship stores each pair once as (user1, user2). friend_ids() reads both
+directions in a single UNION query, each half served by an index, and caches
+the result on the user object for the rest of the request and in Django's
+cache across requests. Anything that creates or removes a Friendship must
+call invalidate() for both users. The a* functions are the same lookups
+for async views.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .models import Friendship
+
+CACHE_ATTR = '_friend_ids_cache'
+
+
+def _cache_key(user_id):
+    return f'friends:{user_id}'
+
+
+def _friend_ids_query(user_id):
+    forward = Friendship.objects.filter(user1_id=user_id).values_list('user2_id', flat=True)
+    backward = Friendship.objects.filter(user2_id=user_id).values_list('user1_id', flat=True)
+    return forward.union(backward)
+
+
+def friend_ids(user):
+    """Return a frozenset of the ids of ``user``'s friends."""
+    ids = getattr(user, CACHE_ATTR, None)
+    if ids is None:
+        ids = cache.get(_cache_key(user.id))
+        if ids is None:
+            ids = frozenset(_friend_ids_query(user.id))
+            cache.set(_cache_key(user.id), ids, settings.FRIENDS_CACHE_TIMEOUT)
+        setattr(user, CACHE_ATTR, ids)
+    return ids
+
+
+async def afriend_ids(user):
+    ids = getattr(user, CACHE_ATTR, None)
+    if ids is None:
+        ids = await cache.aget(_cache_key(user.id))
+        if ids is None:
+            ids = frozenset([friend_id async for friend_id in _friend_ids_query(user.id)])
+            await cache.aset(_cache_key(user.id), ids, settings.FRIENDS_CACHE_TIMEOUT)
+        setattr(user, CACHE_ATTR, ids)
+    return ids
+
+
+def _friends_query(ids):
+    return User.objects.filter(id__in=ids).order_by('username')
+
+
+def get_friends(user):
+    """Return ``user``'s friends as a User queryset (one query)."""
+    return _friends_query(friend_ids(user))
+
+
+async def aget_friends(user):
+    """Return ``user``'s friends as a list."""
+    return [friend async for friend in _friends_query(await afriend_ids(user))]
+
+
+def are_friends(user, other_id):
+    return other_id in friend_ids(user)
+
+
+def invalidate(*users):
+    cache.delete_many([_cache_key(user.id) for user in users])
+    for user in users:
+        if hasattr(user, CACHE_ATTR):
+            delattr(user, CACHE_ATTR)
@@ -0,0 +1,104 @@
+"""
+Running net balance of every member of every group.
+
+GroupBalance.net is what a member has paid minus what they owe across the
+group's expenses, adjusted for settlements: an unsettled share counts for
+its member, and once settled it moves to the expense's payer (the debtor has
+paid the payer back). calculate_group_split reads these N rows instead of
+summing the group's whole history. Every write that adds, settles or removes
+a group ExpenseShare must call apply_shares() or settle() in its transaction;
+verify() and rebuild() compare against / recompute from ExpenseShare plus
+the GroupCheckpoint rows left behind by compaction (see core/compaction.py).
+"""
+from collections import defaultdict
+
+from .ledger import ZERO, merge_deltas, to_decimal
+from .models import ExpenseShare, GroupBalance, GroupCheckpoint
+
+
+def share_rows(queryset=None):
+    """(group_id, user_id, payer_id, amount, settled) for the group shares in ``queryset``."""
+    if queryset is None:
+        queryset = ExpenseShare.objects.all()
+    return queryset.filter(expense__group__isnull=False).values_list(
+        'expense__group_id', 'user_id', 'expense__payer_id', 'amount', 'settled'
+    )
+
+
+def rows_for(expense, shares):
+    return [(expense.group_id, share.user_id, expense.payer_id, share.amount, share.settled) for share in shares]
+
+
+def compute_nets(rows, sign=1):
+    """Fold share rows into {(group_id, user_id): net}."""
+    nets = defaultdict(lambda: ZERO)
+    for group_id, user_id, payer_id, amount, settled in rows:
+        if group_id is None:
+            continue
+        nets[(group_id, payer_id if settled else user_id)] += sign * to_decimal(amount)
+    return nets
+
+
+def apply_deltas(deltas):
+    deltas = {key: net for key, net in deltas.items() if net}
+    if not deltas:
+        return
+    existing = {
+        (row.group_id, row.user_id): row
+        for row in GroupBalance.objects.select_for_update().filter(
+            group_id__in={gid for gid, _ in deltas}, user_id__in={uid for _, uid in deltas}
+        )
+    }
+    merge_deltas(GroupBalance, {key: (net,) for key, net in deltas.items()}, ('group_id', 'user_id'), ('net',), existing)
+
+
+def apply_shares(rows, sign=1):
+    """Add (sign=1) or remove (sign=-1) group shares; a fixed number of queries."""
+    apply_deltas(compute_nets(rows, sign))
+
+
+def settle(rows):
+    """Move shares that were just settled, as (group_id, user_id, payer_id, amount), from their member to the payer."""
+    deltas = defaultdict(lambda: ZERO)
+    for group_id, user_id, payer_id, amount in rows:
+        if group_id is None:
+            continue
+        amount = to_decimal(amount)
+        deltas[(group_id, user_id)] -= amount
+        deltas[(group_id, payer_id)] += amount
+    apply_deltas(deltas)
+
+
+def get_nets(group):
+    """Return {user_id: net} for the members of ``group`` that have a balance row."""
+    return dict(GroupBalance.objects.filter(group=group).values_list('user_id', 'net'))
+
+
+def expected_nets():
+    """Recompute every member's net from checkpoints and the live shares."""
+    nets = compute_nets(share_rows().iterator(chunk_size=2000))
+    for gid, uid, net in GroupCheckpoint.objects.values_list('group_id', 'user_id', 'net'):
+        nets[(gid, uid)] += net
+    return nets
+
+
+def rebuild():
+    nets = expected_nets()
+    GroupBalance.objects.all().delete()
+    GroupBalance.objects.bulk_create(
+        (GroupBalance(group_id=gid, user_id=uid, net=net) for (gid, uid), net in nets.items()),
+        batch_size=1000,
+    )
+    return len(nets)
+
+
+def verify():
+    """Return (key, stored, expected) for every member balance that disagrees with expected_nets()."""
+    expected = expected_nets()
+    stored = {(gid, uid): net for gid, uid, net in GroupBalance.objects.values_list('group_id', 'user_id', 'net')}
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        want, have = expected.get(key, ZERO), stored.get(key, ZERO)
+        if to_decimal(want) != to_decimal(have):
+            mismatches.append((key, have, want))
+    return mismatches
@@ -0,0 +1,69 @@
+"""
+In-memory group ledger for what-if previews.
+
+GroupLedger holds every member's net balance in paise in an array('q')
+indexed by member slot, the same layout the simplify strategies work on. It
+is loaded with two queries (the members and their GroupBalance rows); after
+that, applying hypothetical expenses and working out the transfers that
+would settle the group are pure Python over a few machine integers, with no
+ORM objects and no further database access. Nothing is ever written back.
+"""
+from array import array
+
+from django.conf import settings
+
+from . import expenses, group_balances, money, simplify
+from .money import SplitError
+
+
+class GroupLedger:
+    def __init__(self, member_ids, nets):
+        self.member_ids = list(member_ids)
+        self.slots = {member_id: slot for slot, member_id in enumerate(self.member_ids)}
+        self.balances = array('q', nets)
+
+    @classmethod
+    def load(cls, group):
+        member_ids = list(group.members.order_by('id').values_list('id', flat=True))
+        nets = group_balances.get_nets(group)
+        return cls(member_ids, [money.to_paise(nets.get(member_id, 0), limit=None) for member_id in member_ids])
+
+    def _slot(self, member_id):
+        try:
+            return self.slots[member_id]
+        except KeyError:
+            raise SplitError(f"User {member_id} is not a member of this group")
+
+    def apply_expense(self, total, contributions, owed, member_ids=None):
+        """
+        Apply an expense of ``total`` paise as create_group_expense would:
+        members gain what they paid (``contributions``, {user_id: paise}) and
+        lose what they owe (``owed``, in ``member_ids`` order, all members by
+        default).
+        """
+        member_ids = self.member_ids if member_ids is None else member_ids
+        expenses.group_payer(contributions, total)
+        if len(owed) != len(member_ids) or sum(owed) != total:
+            raise SplitError("Split amounts don't add up to the expense amount")
+        # Look every slot up first so a bad id leaves the balances untouched
+        paid = [(self._slot(member_id), amount) for member_id, amount in contributions.items()]
+        owing = [(self._slot(member_id), amount) for member_id, amount in zip(member_ids, owed)]
+        balances = self.balances
+        for slot, amount in paid:
+            balances[slot] += amount
+        for slot, amount in owing:
+            balances[slot] -= amount
+
+    def nets(self):
+        return dict(zip(self.member_ids, self.balances))
+
+    def transfers(self, strategy=None):
+        """(from_user_id, to_user_id, paise) transfers settling the balances, as recalculate_group_splits picks them."""
+        if strategy not in simplify.STRATEGIES:
+            strategy = settings.SPLIT_STRATEGY
+        ids = self.member_ids
+        return [
+            (ids[debtor], ids[creditor], amount)
+            for debtor, creditor, amount in simplify.simplify(
+                self.balances, strategy=strategy, time_budget=settings.SPLIT_TIME_BUDGET)
+        ]
@@ -0,0 +1,266 @@
+"""
+Streaming bulk import of expenses from CSV or JSONL.
+
+Each row describes one expense:
+
+    description, amount, payer   -- payer is a username
+    group                        -- optional FriendGroup id
+    friends                      -- personal expenses: usernames to split with
+                                    (';'-separated in CSV, a list in JSONL)
+    paid                         -- group expenses: who paid how much
+                                    ('alice:60;bob:40' in CSV, an object in JSONL);
+                                    defaults to the payer paying in full
+
+Rows are read lazily, validated a chunk at a time and written with chunked
+bulk_create, one transaction per chunk, using the same split rules as the
+add_expense / add_group_expense views. Memory use depends on the chunk size,
+not on the size of the file.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import expenses, fragment_cache, group_balances, jobs, ledger, money
+from .models import Expense, ExpenseShare, FriendGroup, TransactionHistory
+
+FORMATS = ('csv', 'jsonl')
+MAX_AMOUNT = Decimal('99999999.99')
+CENT = Decimal('0.01')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self, max_errors=100):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def guess_format(filename):
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ImportFormatError(f"Can't tell the format of {filename!r}; use .csv or .jsonl")
+
+
+def _split_list(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in (value or '').split(';') if v.strip()]
+
+
+def _split_paid(value):
+    if isinstance(value, dict):
+        return {str(k).strip(): v for k, v in value.items()}
+    paid = {}
+    for item in _split_list(value):
+        username, _, amount = item.partition(':')
+        paid[username.strip()] = amount.strip()
+    return paid
+
+
+def read_rows(fileobj, fmt):
+    """Yield (line_number, row) pairs from a text file object without reading it all."""
+    if fmt == 'csv':
+        reader = csv.DictReader(fileobj)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(fileobj, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e
+            yield line_number, row
+    else:
+        raise ImportFormatError(f"Unknown import format: {fmt!r}")
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _parse_amount(value, allow_zero=False):
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError, ValueError):
+        raise expenses.SplitError(f"Invalid amount {value!r}")
+    if not amount.is_finite() or amount < 0 or (amount == 0 and not allow_zero) or amount > MAX_AMOUNT or amount != amount.quantize(CENT):
+        raise expenses.SplitError(f"Invalid amount {value!r}")
+    return amount
+
+
+class Importer:
+    def __init__(self, chunk_size=1000, actor=None, max_errors=100):
+        self.chunk_size = chunk_size
+        self.actor = actor
+        self.result = ImportResult(max_errors=max_errors)
+        # Lookups shared across chunks; bounded by the number of users and groups.
+        self.user_ids = {}
+        self.group_members = {}
+
+    def _resolve(self, rows):
+        usernames, group_ids = set(), set()
+        for _, row in rows:
+            if not isinstance(row, dict):
+                continue
+            usernames.add(str(row.get('payer') or '').strip())
+            usernames.update(_split_list(row.get('friends')))
+            usernames.update(_split_paid(row.get('paid')))
+            group = str(row.get('group') or '').strip()
+            if group.isdigit():
+                group_ids.add(int(group))
+
+        missing = usernames - self.user_ids.keys()
+        if missing:
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+
+        missing_groups = group_ids - self.group_members.keys()
+        if missing_groups:
+            for group_id in missing_groups:
+                self.group_members[group_id] = []
+            through = FriendGroup.members.through.objects.filter(friendgroup_id__in=missing_groups)
+            for group_id, user_id in through.order_by('user_id').values_list('friendgroup_id', 'user_id'):
+                self.group_members[group_id].append(user_id)
+
+    def _user_id(self, username):
+        try:
+            return self.user_ids[username]
+        except KeyError:
+            raise expenses.SplitError(f"Unknown user {username!r}")
+
+    def _build(self, row):
+        if not isinstance(row, dict):
+            raise expenses.SplitError(f"Malformed row: {row}")
+        description = str(row.get('description') or '').strip()
+        if not description:
+            raise expenses.SplitError("Description is required")
+        amount = _parse_amount(row.get('amount'))
+        payer = str(row.get('payer') or '').strip()
+        payer_id = self._user_id(payer)
+
+        group = str(row.get('group') or '').strip()
+        if group:
+            members = self.group_members.get(int(group)) if group.isdigit() else None
+            if not members:
+                raise expenses.SplitError(f"Unknown or empty group {group!r}")
+            paid = _split_paid(row.get('paid')) or {payer: amount}
+            contributions = {}
+            for username, value in paid.items():
+                user_id = self._user_id(username)
+                if user_id not in members:
+                    raise expenses.SplitError(f"{username!r} is not a member of group {group}")
+                value = _parse_amount(value, allow_zero=True)
+                if value > 0:
+                    contributions[user_id] = money.to_paise(value)
+            if self.actor is not None and self.actor.id not in members:
+                raise expenses.SplitError("You are not a member of this group")
+            payer_id = expenses.group_payer(contributions, money.to_paise(amount))
+            expense = Expense(group_id=int(group), description=description, amount=amount, payer_id=payer_id)
+            return expense, (members, contributions)
+
+        friend_ids = list(dict.fromkeys(self._user_id(name) for name in _split_list(row.get('friends'))))
+        friend_ids = [friend_id for friend_id in friend_ids if friend_id != payer_id]
+        if not friend_ids:
+            raise expenses.SplitError("Invalid amount or no friends selected.")
+        if self.actor is not None and self.actor.id != payer_id and self.actor.id not in friend_ids:
+            raise expenses.SplitError("You are not part of this expense")
+        return Expense(description=description, amount=amount, payer_id=payer_id), friend_ids
+
+    def _write(self, built):
+        with transaction.atomic():
+            Expense.objects.bulk_create([expense for expense, _ in built])
+
+            shares, history, friend_links, ledger_rows, group_rows = [], [], [], [], []
+            for expense, split in built:
+                if expense.group_id:
+                    members, contributions = split
+                    expense_shares, expense_history = expenses.build_group_rows(expense, members, contributions)
+                else:
+                    expense_shares, expense_history = expenses.build_personal_rows(expense, split)
+                    friend_links.extend(
+                        Expense.friends.through(expense_id=expense.id, user_id=friend_id) for friend_id in split
+                    )
+                shares.extend(expense_shares)
+                history.extend(expense_history)
+                ledger_rows.extend(expenses.ledger_rows(expense_shares, expense.payer_id))
+                group_rows.extend(group_balances.rows_for(expense, expense_shares))
+
+            ExpenseShare.objects.bulk_create(shares, batch_size=self.chunk_size)
+            TransactionHistory.objects.bulk_create(history, batch_size=self.chunk_size)
+            Expense.friends.through.objects.bulk_create(friend_links, batch_size=self.chunk_size)
+            ledger.apply_shares(ledger_rows)
+            group_balances.apply_shares(group_rows)
+            group_ids = {expense.group_id for expense, _ in built if expense.group_id}
+            fragment_cache.invalidate(users={share.user_id for share in shares}, groups=group_ids)
+            for group_id in group_ids:
+                jobs.schedule_split_recalculation(group_id)
+
+    def run(self, rows, progress=None):
+        last_line = 0
+        try:
+            for chunk in chunked(rows, self.chunk_size):
+                self._resolve(chunk)
+                built = []
+                for line_number, row in chunk:
+                    try:
+                        built.append(self._build(row))
+                    except expenses.SplitError as e:
+                        self.result.add_error(line_number, str(e))
+                if built:
+                    self._write(built)
+                self.result.rows += len(chunk)
+                self.result.imported += len(built)
+                self.result.elapsed = time.perf_counter() - self.result.started
+                last_line = chunk[-1][0]
+                if progress is not None:
+                    progress(self.result)
+        except UnicodeDecodeError:
+            # The text can't be read past this point; earlier chunks stay imported
+            self.result.add_error(last_line + 1, "File is not valid UTF-8; nothing from this line on was imported")
+        self.result.elapsed = time.perf_counter() - self.result.started
+        return self.result
+
+
+def import_file(fileobj, fmt, chunk_size=1000, actor=None, progress=None):
+    """Import a text-mode file object; returns an ImportResult."""
+    return Importer(chunk_size=chunk_size, actor=actor).run(read_rows(fileobj, fmt), progress=progress)
+
+
+def import_upload(upload, actor=None, chunk_size=1000):
+    """Import an UploadedFile, streaming it through a text wrapper."""
+    fmt = guess_format(upload.name)
+    text = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+    try:
+        return import_file(text, fmt, chunk_size=chunk_size, actor=actor)
+    finally:
+        text.detach()
@@ -0,0 +1,171 @@
+"""
+Background jobs.
+
+Work too slow for a request is stored as a Job row and run by
+'manage.py run_workers'. Tasks are plain functions registered with
+@task(kind) (see core/tasks.py); they receive the job payload as keyword
+arguments and whatever they return is saved as the job result.
+
+Jobs enqueued with a dedup_key are merged while they are pending: enqueueing
+again only moves the existing job's run_after (and replaces its payload),
+which debounces bursts of writes into a single run. A user enqueueing into a
+job nobody requested becomes its requester, so they can poll its status. A job that is already
+running no longer holds its key, so changes made while it runs schedule
+another run.
+
+Long tasks can call report_progress() as they go; the progress is shown by
+the job status view and, when a job whose worker died is run again,
+saved_progress() hands it back so the task can resume instead of starting
+over. Reporting progress also bumps the job's heartbeat: a running job is
+only taken for dead once its heartbeat is JOBS_STALE_AFTER seconds old, so
+a task that runs longer than that must report progress more often.
+"""
+import contextvars
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RECALCULATE_SPLITS = 'recalculate_splits'
+CLEAR_TRANSACTIONS = 'clear_transactions'
+DELETE_GROUP = 'delete_group'
+
+TASKS = {}
+
+_current = contextvars.ContextVar('current_job', default=None)
+
+
+def task(kind):
+    def register(fn):
+        TASKS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, user=None, dedup_key=None, delay=0):
+    """Queue a job to run ``delay`` seconds from now and return it."""
+    payload = payload or {}
+    run_after = timezone.now() + timedelta(seconds=delay)
+    if dedup_key is None:
+        return Job.objects.create(kind=kind, payload=payload, requested_by=user, run_after=run_after)
+
+    while True:
+        job = Job.objects.filter(dedup_key=dedup_key, status=Job.PENDING).first()
+        if job is not None:
+            # Debounce, but never hold a job back longer than JOBS_DEBOUNCE_MAX
+            job.run_after = min(run_after, job.created_at + timedelta(seconds=settings.JOBS_DEBOUNCE_MAX))
+            job.payload = payload
+            updates = {'run_after': job.run_after, 'payload': payload}
+            if user is not None and job.requested_by_id is None:
+                # A job queued by a write has no requester; whoever asks for it now can follow it
+                job.requested_by = updates['requested_by'] = user
+            if Job.objects.filter(id=job.id, status=Job.PENDING).update(**updates):
+                return job
+            # A worker claimed it in the meantime; queue a fresh one
+            continue
+        try:
+            with transaction.atomic():
+                return Job.objects.create(kind=kind, payload=payload, requested_by=user,
+                                          dedup_key=dedup_key, run_after=run_after)
+        except IntegrityError:
+            # Someone else created the pending job first; merge into theirs
+            continue
+
+
+def schedule_split_recalculation(group_id, user=None, strategy=None, delay=None):
+    payload = {'group_id': group_id}
+    if strategy:
+        payload['strategy'] = strategy
+    return enqueue(
+        RECALCULATE_SPLITS, payload, user=user, dedup_key=f'{RECALCULATE_SPLITS}:{group_id}',
+        delay=settings.SPLIT_RECALC_DELAY if delay is None else delay,
+    )
+
+
+def saved_progress():
+    """Progress the running job reported on an earlier attempt, or None."""
+    job = _current.get()
+    return job.progress if job is not None else None
+
+
+def report_progress(progress):
+    """Save ``progress`` on the running job; does nothing outside a job."""
+    job = _current.get()
+    if job is not None:
+        job.progress = progress
+        Job.objects.filter(id=job.id).update(progress=progress, heartbeat_at=timezone.now())
+
+
+def claim():
+    """Atomically take the next due job and mark it running, or return None."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'id')
+    for job_id in due.values_list('id', flat=True)[:10]:
+        # Several workers may race for the same row; only one update wins
+        if Job.objects.filter(id=job_id, status=Job.PENDING).update(
+                status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run(job):
+    token = _current.set(job)
+    try:
+        fn = TASKS.get(job.kind)
+        if fn is None:
+            raise LookupError(f"No task registered for {job.kind!r}")
+        job.result = fn(**job.payload)
+        job.status = Job.DONE
+    except Exception:
+        logger.exception("Job %s failed", job.id)
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    finally:
+        _current.reset(token)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def run_pending(limit=None):
+    """Run due jobs in this process until none are left; return how many ran."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def requeue_stale():
+    """
+    Put jobs whose worker died (no heartbeat for JOBS_STALE_AFTER seconds)
+    back in the queue, or fail them once they have used up JOBS_MAX_ATTEMPTS.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOBS_STALE_AFTER)
+    stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at=None, started_at__lt=cutoff)
+    requeued = 0
+    for job in Job.objects.filter(stale, status=Job.RUNNING):
+        if job.attempts < settings.JOBS_MAX_ATTEMPTS:
+            try:
+                with transaction.atomic():
+                    # Checked again in the UPDATE: the job may have reported progress since it was read
+                    requeued += Job.objects.filter(stale, id=job.id, status=Job.RUNNING).update(status=Job.PENDING)
+                continue
+            except IntegrityError:
+                error = "Superseded by a newer pending job"
+        else:
+            error = "Worker stopped responding"
+        Job.objects.filter(stale, id=job.id, status=Job.RUNNING).update(
+            status=Job.FAILED, error=error, finished_at=timezone.now())
+    return requeued
@@ -0,0 +1,180 @@
+"""
+Materialized balance ledger.
+
+UserBalance holds the dashboard totals for each user and PairBalance the same
+totals broken down per counterparty. Every write that creates, settles or
+removes an unsettled ExpenseShare has to push the change through
+apply_shares() inside its transaction so the tables never drift from the
+shares they summarize.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+from .models import ExpenseShare, PairBalance, UserBalance
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def to_decimal(amount):
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return amount.quantize(CENT)
+
+
+def share_entries(user_id, payer_id, amount):
+    # Mirrors how DashboardView classifies an unsettled share:
+    # a negative share is a debt from the participant to the payer, a
+    # positive share on a non-payer means the payer owes it back.
+    if user_id == payer_id or not amount:
+        return
+    if amount < 0:
+        yield user_id, payer_id, -amount, ZERO
+        yield payer_id, user_id, ZERO, -amount
+    else:
+        yield user_id, payer_id, ZERO, amount
+
+
+def compute_pairs(rows, sign=1):
+    """Fold (user_id, payer_id, amount) rows into {(user_id, counterparty_id): [owes, owed]}."""
+    pairs = defaultdict(lambda: [ZERO, ZERO])
+    for user_id, payer_id, amount in rows:
+        for uid, cid, owes, owed in share_entries(user_id, payer_id, to_decimal(amount)):
+            entry = pairs[(uid, cid)]
+            entry[0] += sign * owes
+            entry[1] += sign * owed
+    return pairs
+
+
+def compute_totals(pairs):
+    totals = defaultdict(lambda: [ZERO, ZERO])
+    for (uid, _), (owes, owed) in pairs.items():
+        totals[uid][0] += owes
+        totals[uid][1] += owed
+    return totals
+
+
+def merge_deltas(model, deltas, key_fields, value_fields, existing):
+    """Add ``deltas`` ({key: values}) onto the ``existing`` rows, creating missing ones."""
+    to_update, to_create = [], []
+    for key, values in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            to_create.append(model(**dict(zip(key_fields, key)), **dict(zip(value_fields, values))))
+        else:
+            for field, value in zip(value_fields, values):
+                setattr(row, field, getattr(row, field) + value)
+            to_update.append(row)
+    if to_update:
+        model.objects.bulk_update(to_update, list(value_fields))
+    if to_create:
+        model.objects.bulk_create(to_create)
+
+
+def _merge(model, deltas, key_fields, existing):
+    merge_deltas(model, deltas, key_fields, ('owes', 'owed'), existing)
+
+
+def apply_shares(rows, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) unsettled shares from the ledger.
+
+    rows is an iterable of (user_id, payer_id, amount). Runs a fixed number of
+    queries regardless of how many shares are passed; call it inside the
+    transaction that writes the shares.
+    """
+    pairs = compute_pairs(rows, sign)
+    if not pairs:
+        return
+    totals = compute_totals(pairs)
+
+    user_ids = {uid for uid, _ in pairs}
+    counterparty_ids = {cid for _, cid in pairs}
+    existing_pairs = {
+        (row.user_id, row.counterparty_id): row
+        for row in PairBalance.objects.select_for_update().filter(
+            user_id__in=user_ids, counterparty_id__in=counterparty_ids
+        )
+    }
+    _merge(PairBalance, pairs, ('user_id', 'counterparty_id'), existing_pairs)
+
+    existing_totals = {
+        (row.user_id,): row
+        for row in UserBalance.objects.select_for_update().filter(user_id__in=totals.keys())
+    }
+    _merge(UserBalance, {(uid,): v for uid, v in totals.items()}, ('user_id',), existing_totals)
+
+
+def unsettled_share_rows(queryset=None):
+    if queryset is None:
+        queryset = ExpenseShare.objects.all()
+    return queryset.filter(settled=False).values_list('user_id', 'expense__payer_id', 'amount')
+
+
+def _totals_query(user):
+    return UserBalance.objects.filter(user=user).values_list('owes', 'owed')
+
+
+def get_totals(user):
+    """Return (you_owe_total, you_are_owed_total) with a single indexed lookup."""
+    row = _totals_query(user).first()
+    return row if row is not None else (ZERO, ZERO)
+
+
+async def aget_totals(user):
+    row = await _totals_query(user).afirst()
+    return row if row is not None else (ZERO, ZERO)
+
+
+def pair_nets(user):
+    """
+    ``user``'s PairBalance rows with a ``net`` annotation: positive when the
+    counterparty owes ``user`` overall, negative when ``user`` owes them.
+    """
+    return PairBalance.objects.filter(user=user).exclude(owes=0, owed=0).annotate(
+        net=ExpressionWrapper(F('owed') - F('owes'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    ).select_related('counterparty').order_by('net', 'counterparty_id')
+
+
+def rebuild():
+    """Recompute the whole ledger from ExpenseShare."""
+    pairs = compute_pairs(unsettled_share_rows().iterator(chunk_size=2000))
+    totals = compute_totals(pairs)
+    PairBalance.objects.all().delete()
+    UserBalance.objects.all().delete()
+    PairBalance.objects.bulk_create(
+        (PairBalance(user_id=uid, counterparty_id=cid, owes=owes, owed=owed)
+         for (uid, cid), (owes, owed) in pairs.items()),
+        batch_size=1000,
+    )
+    UserBalance.objects.bulk_create(
+        (UserBalance(user_id=uid, owes=owes, owed=owed) for uid, (owes, owed) in totals.items()),
+        batch_size=1000,
+    )
+    return len(totals), len(pairs)
+
+
+def verify():
+    """Return a list of (kind, key, stored, expected) rows that disagree with ExpenseShare."""
+    pairs = compute_pairs(unsettled_share_rows().iterator(chunk_size=2000))
+    totals = compute_totals(pairs)
+    mismatches = []
+
+    def compare(kind, expected, stored):
+        for key in expected.keys() | stored.keys():
+            want = tuple(expected.get(key, (ZERO, ZERO)))
+            have = tuple(stored.get(key, (ZERO, ZERO)))
+            if want != have:
+                mismatches.append((kind, key, have, want))
+
+    compare('pair', pairs, {
+        (uid, cid): (owes, owed)
+        for uid, cid, owes, owed in PairBalance.objects.values_list('user_id', 'counterparty_id', 'owes', 'owed')
+    })
+    compare('user', totals, {
+        uid: (owes, owed)
+        for uid, owes, owed in UserBalance.objects.values_list('user_id', 'owes', 'owed')
+    })
+    return mismatches
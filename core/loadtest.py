@@ -0,0 +1,76 @@
+"""
+Closed-loop HTTP load generator.
+
+Each of ``concurrency`` threads keeps one keep-alive connection open and
+requests the given paths round-robin for ``duration`` seconds, recording the
+latency of every response. Only the standard library is used so the same
+harness can drive any server; at very high concurrency the client itself can
+become the bottleneck, so run it from a separate machine when in doubt.
+"""
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def _worker(host, port, paths, headers, deadline, latencies, errors, offset):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        if response.status >= 400:
+            errors.append(path)
+        else:
+            latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(base_url, paths, concurrency=100, duration=10.0, cookies=None):
+    """Return a summary dict: requests, errors, rps and latency percentiles in ms."""
+    parts = urlsplit(base_url)
+    headers = {'Connection': 'keep-alive'}
+    if cookies:
+        headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=_worker, daemon=True, args=(
+            parts.hostname, parts.port or 80, paths, headers, deadline, latencies, errors, n,
+        ))
+        for n in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(latencies)
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 2) if samples else None,
+        'max_ms': round(samples[-1] * 1000, 2) if samples else None,
+    }
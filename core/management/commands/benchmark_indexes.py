@@ -0,0 +1,141 @@
+import json
+import statistics
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.operations import AddIndex
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+
+from core import friends, ledger, seed, settlement
+from core.models import (
+    Expense, ExpenseShare, FriendGroup, FriendRequest, GroupBalance, GroupSplit, PairBalance, TransactionHistory,
+    UserBalance,
+)
+
+INDEX_MIGRATION = '0013_hot_path_indexes'
+
+
+def hot_queries(user, group_id):
+    """The queries the dashboard, group, balance and history pages run, keyed by a stable name."""
+    counterparty_id = PairBalance.objects.filter(user=user).exclude(owes=0, owed=0).values_list(
+        'counterparty_id', flat=True).first() or user.id
+    return {
+        'dashboard_pending_requests': FriendRequest.objects.filter(receiver=user, status='pending').select_related('sender'),
+        'dashboard_groups': FriendGroup.objects.filter(members=user).annotate(member_count=Count('members')),
+        'dashboard_pair_nets': ledger.pair_nets(user),
+        'dashboard_totals': UserBalance.objects.filter(user=user),
+        'friend_ids': friends._friend_ids_query(user.id),
+        'group_splits': GroupSplit.objects.filter(group_id=group_id).select_related('from_user', 'to_user'),
+        'group_expenses': Expense.objects.filter(group_id=group_id).select_related('payer'),
+        'group_balances': GroupBalance.objects.filter(group_id=group_id),
+        'balance_open_shares': settlement.open_shares(user, with_user=User(id=counterparty_id)).select_related(
+            'expense', 'expense__group', 'expense__payer').order_by('-expense__created_at', '-id')[:51],
+        'history_page': TransactionHistory.objects.filter(user=user).select_related(
+            'group', 'related_user').order_by('-created_at', '-id')[:51],
+    }
+
+
+def measured_indexes(migration_name):
+    """(model, index) for every index ``migration_name`` adds to core."""
+    migration = MigrationLoader(connection).get_migration('core', migration_name)
+    return [(apps.get_model('core', operation.model_name), operation.index)
+            for operation in migration.operations if isinstance(operation, AddIndex)]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with synthetic data and record EXPLAIN plans and "
+        "latencies of the hot queries and views with and without the hot path indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--groups', type=int, default=200)
+        parser.add_argument('--expenses', type=int, default=50000)
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the median is reported.")
+        parser.add_argument('--migration', default=INDEX_MIGRATION,
+                            help="core migration whose indexes are dropped for the 'before' run.")
+        parser.add_argument('--output', default='bench_indexes.json')
+
+    def measure(self, user, group_id, repeat):
+        # Both runs start from a cold cache, so cached fragments don't flatter the second
+        cache.clear()
+        client = Client()
+        client.force_login(user)
+        results = {'queries': {}, 'views': {}}
+        for name, queryset in hot_queries(user, group_id).items():
+            results['queries'][name] = {
+                'plan': queryset.explain(),
+                'ms': timed(lambda: list(queryset.all()), repeat),
+            }
+        views = {
+            'dashboard': reverse('dashboard'),
+            'group_detail': reverse('group_detail', args=[group_id]),
+            'transaction_history': reverse('transaction_history'),
+            'friends_list': reverse('friends_list'),
+        }
+        for name, url in views.items():
+            results['views'][name] = {'ms': timed(lambda: client.get(url), repeat)}
+        return results
+
+    def handle(self, *args, **options):
+        # A private cache, so clearing it leaves the one the servers share alone
+        with override_settings(CACHES=settings.TEST_CACHES):
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                started = time.perf_counter()
+                seed.seed(users=options['users'], groups=options['groups'], expenses=options['expenses'],
+                          log=lambda message: self.stdout.write(f"  seeded {message}"))
+                self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+                # Measure the busiest user in the busiest group they belong to
+                user_id = ExpenseShare.objects.filter(settled=False).values('user_id').annotate(
+                    n=Count('id')).order_by('-n').values_list('user_id', flat=True).first()
+                user = User.objects.get(id=user_id)
+                group_id = Expense.objects.filter(group__members=user).values('group_id').annotate(
+                    n=Count('id')).order_by('-n').values_list('group_id', flat=True).first()
+
+                # Only the indexes under test are dropped; the rest of the schema stays current
+                indexes = measured_indexes(options['migration'])
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.remove_index(model, index)
+                before = self.measure(user, group_id, options['repeat'])
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.add_index(model, index)
+                after = self.measure(user, group_id, options['repeat'])
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        report = {'options': {k: options[k] for k in ('users', 'groups', 'expenses', 'repeat', 'migration')}}
+        for kind, label in (('queries', 'query'), ('views', 'view')):
+            report[kind] = {name: {'before': before[kind][name], 'after': after[kind][name]} for name in before[kind]}
+            for name, result in report[kind].items():
+                self.stdout.write(f"{label:5} {name:30} {result['before']['ms']:>9.3f} ms -> {result['after']['ms']:>9.3f} ms")
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import compaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Move fully settled expenses and transaction history older than the cutoff into the archive tables, "
+        "rolling their totals into balance checkpoints. Safe to run from cron while the site is up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.COMPACTION_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        counts = compaction.compact(before, options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {counts['expenses']} expenses and {counts['history']} history rows older than {before:%Y-%m-%d}."
+        ))
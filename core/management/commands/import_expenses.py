@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+
+
+class Command(BaseCommand):
+    help = "Stream expenses from a CSV or JSONL file into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import.")
+        parser.add_argument('--format', choices=importer.FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows per validation/write transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options['format'] or importer.guess_format(options['path'])
+        except importer.ImportFormatError as e:
+            raise CommandError(str(e))
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{result.rows} rows read, {result.imported} imported, {result.rows_per_second:.0f} rows/s")
+
+        with open(options['path'], encoding='utf-8', newline='') as f:
+            result = importer.import_file(f, fmt, chunk_size=options['chunk_size'], progress=progress)
+
+        for line, message in result.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} of {result.rows} rows in {result.elapsed:.2f}s "
+            f"({result.rows_per_second:.0f} rows/s), {result.error_count} rejected."
+        ))
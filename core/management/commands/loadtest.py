@@ -0,0 +1,124 @@
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.urls import reverse
+
+from core import loadtest
+from core.models import Expense, ExpenseShare
+
+SERVERS = {
+    # name: (executable, argv builder)
+    'wsgi': ('gunicorn', lambda port, workers: [
+        'gunicorn', 'splitwise.wsgi:application', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--threads', '8', '--log-level', 'warning',
+    ]),
+    'asgi': ('uvicorn', lambda port, workers: [
+        'uvicorn', 'splitwise.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers), '--log-level', 'warning', '--no-access-log',
+    ]),
+}
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f"Server on port {port} did not start within {timeout}s")
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app under gunicorn (WSGI) and uvicorn (ASGI) in turn, drive the read-heavy pages at "
+        "high concurrency and compare requests per second and p99 latency. Runs against the configured "
+        "database, so point it at a seeded copy rather than real data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--user', help="Username to browse as; defaults to the user with the most open shares.")
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=20.0, help="Seconds per server.")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', default='loadtest.json')
+
+    def pick_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user_id = ExpenseShare.objects.filter(settled=False).values('user_id').annotate(
+            n=Count('id')).order_by('-n').values_list('user_id', flat=True).first()
+        if user_id is None:
+            raise CommandError("No expenses found; seed the database first.")
+        return User.objects.get(id=user_id)
+
+    def session_cookie(self, user):
+        # Same session a real login would create, without going through the form
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return {settings.SESSION_COOKIE_NAME: session.session_key}
+
+    def handle(self, *args, **options):
+        for name in options['servers']:
+            executable = SERVERS[name][0]
+            if shutil.which(executable) is None:
+                raise CommandError(f"'{executable}' is not installed (pip install {executable}).")
+
+        user = self.pick_user(options['user'])
+        group_id = Expense.objects.filter(group__members=user).values_list('group_id', flat=True).first()
+        paths = [
+            reverse('dashboard'),
+            reverse('transaction_history'),
+            reverse('friends_list'),
+            reverse('search_users') + '?q=' + user.username[:3],
+        ]
+        if group_id:
+            paths.append(reverse('group_detail', args=[group_id]))
+        cookies = self.session_cookie(user)
+
+        report = {
+            'options': {k: options[k] for k in ('concurrency', 'duration', 'workers')},
+            'user': user.username,
+            'paths': paths,
+            'results': {},
+        }
+        for name in options['servers']:
+            argv = SERVERS[name][1](options['port'], options['workers'])
+            self.stdout.write(f"Starting {name}: {' '.join(argv)}")
+            server = subprocess.Popen(argv, stdout=sys.stdout, stderr=sys.stderr)
+            try:
+                wait_for_port(options['port'])
+                # Warm up caches and connections before measuring
+                loadtest.run(f"http://127.0.0.1:{options['port']}", paths, concurrency=4, duration=2, cookies=cookies)
+                result = loadtest.run(
+                    f"http://127.0.0.1:{options['port']}", paths,
+                    concurrency=options['concurrency'], duration=options['duration'], cookies=cookies,
+                )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            report['results'][name] = result
+            self.stdout.write(
+                f"{name:5} {result['rps']:>9.1f} req/s  p50 {result['p50_ms']} ms  "
+                f"p99 {result['p99_ms']} ms  errors {result['errors']}"
+            )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
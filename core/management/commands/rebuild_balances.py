@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import group_balances, ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the UserBalance/PairBalance ledger and the GroupBalance running totals from ExpenseShare, "
+        "or verify them with --verify."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Only compare the stored balances with ExpenseShare; exit non-zero on drift.",
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = ledger.verify()
+            for kind, key, stored, expected in mismatches:
+                self.stdout.write(f"{kind} {key}: stored (owes, owed)={stored}, expected={expected}")
+            group_mismatches = group_balances.verify()
+            for (group_id, user_id), stored, expected in group_mismatches:
+                self.stdout.write(f"group {group_id} member {user_id}: stored net={stored}, expected={expected}")
+            drift = len(mismatches) + len(group_mismatches)
+            if drift:
+                raise CommandError(f"{drift} balance rows out of sync; run rebuild_balances to fix.")
+            self.stdout.write(self.style.SUCCESS("Ledger and group balances match ExpenseShare."))
+            return
+
+        with transaction.atomic():
+            users, pairs = ledger.rebuild()
+            members = group_balances.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt balances for {users} users, {pairs} user pairs and {members} group members."
+        ))
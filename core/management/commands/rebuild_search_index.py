@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the user search index from auth_user (needed after bulk user imports)."
+
+    def handle(self, *args, **options):
+        indexed = search.get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} users."))
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from core import benchmark, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database at each data size, time the views and core algorithms, write the "
+        "results as JSON and fail if any median regressed against the baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=list(benchmark.SIZES), default=['small', 'medium'])
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement after one warm-up.")
+        parser.add_argument('--output', default='bench.json')
+        parser.add_argument('--baseline', default='bench_baseline.json')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed slowdown as a fraction of the baseline median.")
+        parser.add_argument('--min-ms', type=float, default=1.0, help="Ignore slowdowns smaller than this.")
+        parser.add_argument('--update-baseline', action='store_true', help="Save these results as the new baseline.")
+
+    def handle(self, *args, **options):
+        results = {}
+        # A private cache, so clearing it leaves the one the servers share alone
+        with override_settings(CACHES=settings.TEST_CACHES):
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                for size in options['sizes']:
+                    call_command('flush', interactive=False, verbosity=0)
+                    cache.clear()
+                    started = time.perf_counter()
+                    seed.seed(friend_graph=seed.POWER_LAW, **benchmark.SIZES[size])
+                    self.stdout.write(f"{size}: seeded in {time.perf_counter() - started:.1f}s")
+                    results[size] = benchmark.measure(options['repeat'])
+                    for name, result in results[size].items():
+                        self.stdout.write(f"  {name:28} {result['median_ms']:>10.3f} ms")
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        report = {'options': {k: options[k] for k in ('sizes', 'repeat')}, 'results': results}
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Report written to {options['output']}")
+
+        if options['update_baseline']:
+            with open(options['baseline'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(f"No baseline at {options['baseline']}; run with --update-baseline to create one.")
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)['results']
+        regressions = benchmark.compare(results, baseline, options['tolerance'], options['min_ms'])
+        for size, name, was, now in regressions:
+            self.stdout.write(self.style.ERROR(f"{size} {name}: {was:.3f} ms -> {now:.3f} ms"))
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmarks regressed beyond {options['tolerance']:.0%}.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
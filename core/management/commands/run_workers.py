@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+
+def work(stop, poll_interval):
+    django.setup()
+    from core import jobs
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    last_sweep = 0
+    while not stop.is_set():
+        close_old_connections()
+        if time.monotonic() - last_sweep > settings.JOBS_STALE_AFTER / 10:
+            jobs.requeue_stale()
+            last_sweep = time.monotonic()
+        job = jobs.claim()
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        jobs.run(job)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (split recalculation, clearing transactions, deleting groups) in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 2)
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to sleep when the queue is empty (default: JOBS_POLL_INTERVAL).")
+        parser.add_argument('--once', action='store_true',
+                            help="Run every job that is due in this process, then exit.")
+
+    def handle(self, *args, **options):
+        from core import jobs
+
+        if options['once']:
+            jobs.requeue_stale()
+            self.stdout.write(f"Ran {jobs.run_pending()} job(s).")
+            return
+
+        if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+            self.stderr.write(self.style.WARNING(
+                "LocMemCache is per process: pages cached by the web server will not see invalidations "
+                "made by these workers. Configure a shared cache backend."
+            ))
+
+        poll_interval = options['poll_interval'] or settings.JOBS_POLL_INTERVAL
+        # Children must not inherit the parent's database connections
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(target=work, args=(stop, poll_interval), name=f'worker-{n}')
+            for n in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} worker(s); Ctrl+C to stop.")
+
+        def shutdown(signum, frame):
+            stop.set()
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write("Workers stopped.")
@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with synthetic benchmark data: users on a power-law friend graph, "
+        "groups of varying size and as many expenses and shares as asked for. Use a copy, not real data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--friends-per-user', type=int, default=10)
+        parser.add_argument('--groups', type=int, default=1000)
+        parser.add_argument('--group-size', type=int, nargs=2, default=[3, 30], metavar=('MIN', 'MAX'))
+        parser.add_argument('--expenses', type=int, default=1000000)
+        parser.add_argument('--settled-ratio', type=float, default=0.6)
+        parser.add_argument('--uniform', action='store_true', help="Give every user about the same number of friends.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        prefix = f"{seed.USERNAME_PREFIX}{options['seed']}_"
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Data for seed {options['seed']} already exists; pick another --seed.")
+
+        started = time.perf_counter()
+        user_ids, group_ids = seed.seed(
+            users=options['users'], friends_per_user=options['friends_per_user'], groups=options['groups'],
+            group_size=tuple(options['group_size']), expenses=options['expenses'],
+            settled_ratio=options['settled_ratio'], friend_graph=seed.UNIFORM if options['uniform'] else seed.POWER_LAW,
+            batch_size=options['batch_size'], seed=options['seed'],
+            log=lambda message: self.stdout.write(f"  seeded {message}"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(user_ids)} users, {len(group_ids)} groups and {options['expenses']} expenses "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,240 @@
+"""
+Per-view request instrumentation.
+
+MetricsMiddleware times every request and attributes it to the URL name it
+resolved to: wall time, number of queries, time spent in the database, time
+spent rendering templates and the Python time left over. Each is kept as a
+histogram in process memory and served in Prometheus text format by the
+admin-only /metrics/ view, so with several worker processes every process
+reports its own numbers (scrape each, or aggregate by instance).
+
+Queries are counted by an execute wrapper installed on every database
+connection and templates are timed by wrapping the template backend's
+render(); both do nothing outside an instrumented request. Setting
+METRICS_PROFILE_SAMPLE_RATE runs cProfile on that fraction of requests and
+keeps the profile of those slower than METRICS_PROFILE_SLOW_MS in
+METRICS_PROFILE_DIR. Only one request per process is profiled at a time,
+and for async views only the event loop thread is profiled.
+"""
+import contextvars
+import cProfile
+import functools
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from . import fragment_cache
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (buckets, help)
+METRICS = {
+    'request_duration_seconds': (TIME_BUCKETS, "Time to build the response."),
+    'db_duration_seconds': (TIME_BUCKETS, "Time spent executing SQL."),
+    'template_duration_seconds': (TIME_BUCKETS, "Time spent rendering templates, excluding SQL run while rendering."),
+    'python_duration_seconds': (TIME_BUCKETS, "Response time not spent in SQL or templates."),
+    'db_queries': (QUERY_BUCKETS, "Number of SQL queries."),
+}
+
+UNRESOLVED = '<unresolved>'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_lock = threading.Lock()
+_views = {}
+_profiling = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+
+
+def _execute(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def _wrap_connection(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context=None, request=None):
+        stats = _current.get()
+        # Fragments rendered inside a template are part of the outer render
+        if stats is None or stats.rendering:
+            return render(self, context, request)
+        stats.rendering = True
+        start, db_before = time.perf_counter(), stats.db_time
+        try:
+            return render(self, context, request)
+        finally:
+            stats.rendering = False
+            stats.template_time += time.perf_counter() - start - (stats.db_time - db_before)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def install():
+    connection_created.connect(_wrap_connection, dispatch_uid='core.metrics.wrap_connection')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+    if not getattr(Template.render, 'instrumented', False):
+        Template.render = _timed_render(Template.render)
+
+
+def record(view, duration, stats):
+    values = {
+        'request_duration_seconds': duration,
+        'db_duration_seconds': stats.db_time,
+        'template_duration_seconds': stats.template_time,
+        'python_duration_seconds': max(0.0, duration - stats.db_time - stats.template_time),
+        'db_queries': stats.queries,
+    }
+    with _lock:
+        histograms = _views.get(view)
+        if histograms is None:
+            histograms = _views[view] = {name: Histogram(buckets) for name, (buckets, _) in METRICS.items()}
+        for name, value in values.items():
+            histograms[name].observe(value)
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return str(value) if isinstance(value, int) else repr(round(value, 6))
+
+
+def render():
+    """Return every histogram, plus the fragment cache counters, as Prometheus text."""
+    with _lock:
+        snapshot = {
+            view: {name: (list(h.counts), h.sum, h.count) for name, h in histograms.items()}
+            for view, histograms in _views.items()
+        }
+    lines = []
+    for name, (buckets, help_text) in METRICS.items():
+        metric = f'splitwise_{name}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for view in sorted(snapshot):
+            counts, total, count = snapshot[view][name]
+            label = f'view="{_label(view)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label}}} {_number(total)}')
+            lines.append(f'{metric}_count{{{label}}} {count}')
+
+    cache_stats = fragment_cache.stats()
+    for outcome in ('hits', 'misses'):
+        metric = f'splitwise_fragment_cache_{outcome}_total'
+        lines += [f'# TYPE {metric} counter', f"{metric} {cache_stats[outcome]}"]
+    return '\n'.join(lines) + '\n'
+
+
+def _start_profile():
+    rate = settings.METRICS_PROFILE_SAMPLE_RATE
+    if not rate or random.random() >= rate or not _profiling.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _finish_profile(profiler, view, duration):
+    profiler.disable()
+    try:
+        if duration * 1000 >= settings.METRICS_PROFILE_SLOW_MS:
+            os.makedirs(settings.METRICS_PROFILE_DIR, exist_ok=True)
+            filename = f"{view.replace(':', '_').strip('<>')}-{int(time.time() * 1000)}.prof"
+            profiler.dump_stats(os.path.join(settings.METRICS_PROFILE_DIR, filename))
+    finally:
+        _profiling.release()
+
+
+class MetricsMiddleware:
+    """Record per-view timings; keep it first in MIDDLEWARE so it sees every query."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _begin(self):
+        stats = RequestStats()
+        return stats, _current.set(stats), _start_profile(), time.perf_counter()
+
+    def _end(self, request, stats, token, profiler, start):
+        duration = time.perf_counter() - start
+        _current.reset(token)
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNRESOLVED
+        if profiler is not None:
+            _finish_profile(profiler, view, duration)
+        record(view, duration, stats)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, profiler, start = self._begin()
+        try:
+            return self.get_response(request)
+        finally:
+            self._end(request, stats, token, profiler, start)
+
+    async def __acall__(self, request):
+        stats, token, profiler, start = self._begin()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._end(request, stats, token, profiler, start)
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from core.ledger import compute_pairs, compute_totals
+
+
+def backfill_balances(apps, schema_editor):
+    ExpenseShare = apps.get_model('core', 'ExpenseShare')
+    UserBalance = apps.get_model('core', 'UserBalance')
+    PairBalance = apps.get_model('core', 'PairBalance')
+
+    rows = ExpenseShare.objects.filter(settled=False).values_list('user_id', 'expense__payer_id', 'amount')
+    pairs = compute_pairs(rows.iterator())
+    PairBalance.objects.bulk_create(
+        [PairBalance(user_id=uid, counterparty_id=cid, owes=owes, owed=owed) for (uid, cid), (owes, owed) in pairs.items()],
+        batch_size=1000,
+    )
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=uid, owes=owes, owed=owed) for uid, (owes, owed) in compute_totals(pairs).items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_transactionhistory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owes', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PairBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owes', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('counterparty', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pair_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'counterparty')},
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_balance_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='history_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_transactionhistory_keyset_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'created_at'], name='expense_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['payer', 'group'], name='expense_payer_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('settled', False)), fields=['user', 'expense'], name='share_user_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(condition=models.Q(('settled', False)), fields=['expense', 'user'], name='share_expense_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['receiver', 'status'], name='friendreq_receiver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['sender', 'status'], name='friendreq_sender_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupsplit',
+            index=models.Index(fields=['group', 'from_user', 'to_user'], name='split_group_from_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupsplit',
+            index=models.Index(fields=['group', 'to_user'], name='split_group_to_idx'),
+        ),
+    ]
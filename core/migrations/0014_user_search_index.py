@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # The FTS5 index only exists on SQLite; other databases use the ORM
+    # search backend and need nothing here.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_user_search USING fts5("
+        "username, first_name, last_name, email, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO core_user_search (rowid, username, first_name, last_name, email) "
+        "SELECT id, username, first_name, last_name, email FROM auth_user"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_user_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_hot_path_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from core.group_balances import compute_nets
+
+
+def backfill_group_balances(apps, schema_editor):
+    ExpenseShare = apps.get_model('core', 'ExpenseShare')
+    GroupBalance = apps.get_model('core', 'GroupBalance')
+
+    rows = ExpenseShare.objects.filter(expense__group__isnull=False).values_list(
+        'expense__group_id', 'user_id', 'expense__payer_id', 'amount', 'settled'
+    )
+    GroupBalance.objects.bulk_create(
+        [GroupBalance(group_id=gid, user_id=uid, net=net) for (gid, uid), net in compute_nets(rows.iterator()).items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='core.friendgroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_group_balances, migrations.RunPython.noop),
+    ]
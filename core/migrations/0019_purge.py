@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_settlement_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendgroup',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='progress',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def _create(schema_editor, fields):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    columns = ', '.join(fields)
+    schema_editor.execute("DROP TABLE IF EXISTS core_user_search")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE core_user_search USING fts5({columns}, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(f"INSERT INTO core_user_search (rowid, {columns}) SELECT id, {columns} FROM auth_user")
+
+
+def drop_email(apps, schema_editor):
+    # Email addresses are not searchable, so they don't belong in the index
+    _create(schema_editor, ('username', 'first_name', 'last_name'))
+
+
+def restore_email(apps, schema_editor):
+    _create(schema_editor, ('username', 'first_name', 'last_name', 'email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_purge'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_email, restore_email),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def _index_name(field):
+    return f'auth_user_{field}_upper_idx'
+
+
+def create_prefix_indexes(apps, schema_editor):
+    # istartswith compiles to UPPER(col::text) LIKE UPPER('prefix%') on
+    # PostgreSQL; these expression indexes let that use an index scan.
+    # SQLite searches through the FTS5 table instead.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {_index_name(field)} ON auth_user (UPPER({field}::text) text_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {_index_name(field)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
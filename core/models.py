@@ -17,6 +17,11 @@ class FriendRequest(models.Model):
     
     class Meta:
         unique_together = ('sender', 'receiver')
+        indexes = [
+            # Pending requests on the dashboard, accepted requests for the friend list
+            models.Index(fields=['receiver', 'status'], name='friendreq_receiver_status_idx'),
+            models.Index(fields=['sender', 'status'], name='friendreq_sender_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} -> {self.receiver.username} {{self.status}}"
@@ -34,10 +39,20 @@ class Friendship(models.Model):
         return f"{self.user1.username} & {self.user2.username} are friends"
     
     
+class LiveGroupManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class FriendGroup(models.Model):
     name = models.CharField(max_length=255)
     members = models.ManyToManyField(User, related_name='friend_groups')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the group is deleted; the rows go later, in the background (see core/purge.py)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveGroupManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -50,8 +65,13 @@ class Expense(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     group = models.ForeignKey('FriendGroup',on_delete=models.CASCADE, null=True, blank=True)
     friends = models.ManyToManyField(User, related_name='expenses_shared')
-    
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'created_at'], name='expense_group_created_idx'),
+            models.Index(fields=['payer', 'group'], name='expense_payer_group_idx'),
+        ]
+
     def __str__(self):
         return f"{self.description} - {self.amount} by {self.payer}"
     
@@ -61,8 +81,15 @@ class ExpenseShare(models.Model):
     user = models.ForeignKey(User, related_name='expense_shares', on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     settled = models.BooleanField(default=False)
-    
-    
+
+    class Meta:
+        indexes = [
+            # Open shares are all the dashboard and settlements ever look at,
+            # and they stay a small slice of the table as history grows
+            models.Index(fields=['user', 'expense'], name='share_user_open_idx', condition=models.Q(settled=False)),
+            models.Index(fields=['expense', 'user'], name='share_expense_open_idx', condition=models.Q(settled=False)),
+        ]
+
 
 class GroupSplit(models.Model):
     group = models.ForeignKey(FriendGroup, on_delete=models.CASCADE, related_name='splits')
@@ -73,6 +100,12 @@ class GroupSplit(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     settled = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'from_user', 'to_user'], name='split_group_from_idx'),
+            models.Index(fields=['group', 'to_user'], name='split_group_to_idx'),
+        ]
+
     def __str__(self):
         return f"{self.from_user} owes {self.to_user} ₹{self.amount} in {self.group.name}"
     
@@ -92,9 +125,169 @@ class TransactionHistory(models.Model):
     description = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     settled_at = models.DateTimeField(null=True, blank=True)
-    
-    
+
+    class Meta:
+        indexes = [
+            # Keyset pagination and export of a user's history, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='history_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.transaction_type} - {self.amount} - {self.created_at}"
-    
-    
\ No newline at end of file
+
+
+class UserBalance(models.Model):
+    user = models.OneToOneField(User, related_name='balance', on_delete=models.CASCADE)
+    owes = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.user.username} owes ₹{self.owes}, is owed ₹{self.owed}"
+
+
+class PairBalance(models.Model):
+    user = models.ForeignKey(User, related_name='pair_balances', on_delete=models.CASCADE)
+    counterparty = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    owes = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('user', 'counterparty')
+
+    def __str__(self):
+        return f"{self.user.username} / {self.counterparty.username}: owes ₹{self.owes}, is owed ₹{self.owed}"
+
+
+class GroupBalance(models.Model):
+    """A member's running net balance in a group: positive means the group owes them."""
+    group = models.ForeignKey(FriendGroup, related_name='balances', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    net = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in {self.group.name}: ₹{self.net}"
+
+
+class GroupCheckpoint(models.Model):
+    """A member's net from archived expenses of a group; GroupBalance is this plus the live shares."""
+    group = models.ForeignKey(FriendGroup, related_name='checkpoints', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    net = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    as_of = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+
+class UserCheckpoint(models.Model):
+    """Settled activity of a user rolled up from archived expenses and history."""
+    user = models.OneToOneField(User, related_name='checkpoint', on_delete=models.CASCADE)
+    settled_paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    settled_received = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    archived_history = models.PositiveIntegerField(default=0)
+    as_of = models.DateTimeField(null=True, blank=True)
+
+
+class ArchivedExpense(models.Model):
+    """A fully settled Expense moved out of the live tables; keeps its original id."""
+    id = models.BigIntegerField(primary_key=True)
+    payer = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+    group = models.ForeignKey(FriendGroup, null=True, blank=True, related_name='+', on_delete=models.CASCADE)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'created_at'], name='archexpense_group_created_idx'),
+        ]
+
+
+class ArchivedExpenseShare(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, related_name='shares', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    settled = models.BooleanField(default=False)
+
+
+class ArchivedTransactionHistory(models.Model):
+    """TransactionHistory rows older than the compaction cutoff; same columns and ids."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    transaction_type = models.CharField(max_length=10, choices=TransactionHistory.TRANSACTION_TYPES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    group = models.ForeignKey(FriendGroup, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    related_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='archhistory_user_created_idx'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, run by 'manage.py run_workers' (see core/jobs.py)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    # Pending jobs with the same key are merged into one
+    dedup_key = models.CharField(max_length=100, null=True, blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    run_after = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Bumped when the job is claimed and whenever it reports progress; a running job whose heartbeat goes stale is requeued
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    # Saved by long tasks as they go, and handed back to them if the job is retried
+    progress = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=models.Q(status='pending'),
+                                    name='job_pending_dedup_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+class SettlementRequest(models.Model):
+    """
+    A settlement batch submitted with an idempotency key (see core/settlement.py);
+    retrying with the same key returns the stored result instead of settling again.
+    """
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=100)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['actor', 'key'], name='settlement_request_actor_key_uniq'),
+        ]
@@ -0,0 +1,109 @@
+"""
+Money helpers working in integer paise.
+
+Amounts enter as Decimal/str from forms and the database, are converted once
+with to_paise(), split with plain int arithmetic and converted back with
+from_paise() only when building model rows. Every split returns parts that
+add up to the total exactly; leftover paise are handed out deterministically
+(largest remainder first, then lowest slot).
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+EQUAL = 'equal'
+EXACT = 'exact'
+PERCENT = 'percent'
+SHARES = 'shares'
+SPLIT_TYPES = (EQUAL, EXACT, PERCENT, SHARES)
+
+# The largest amount an Expense or ExpenseShare column holds (max_digits=10)
+MAX_PAISE = 10 ** 10 - 1
+
+
+class SplitError(ValueError):
+    pass
+
+
+def to_paise(value, limit=MAX_PAISE):
+    """
+    Convert a rupee amount (Decimal, str, int) to integer paise, rounding half
+    up. Amounts beyond ``limit`` paise either way are rejected; pass
+    limit=None for totals summed over many rows.
+    """
+    try:
+        amount = value if isinstance(value, Decimal) else Decimal(str(value).strip())
+        if not amount.is_finite():
+            raise ValueError
+        paise = int((amount * 100).to_integral_value(ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, TypeError, OverflowError):
+        raise SplitError(f"Invalid amount {value!r}")
+    if limit is not None and abs(paise) > limit:
+        raise SplitError(f"Amount {value!r} is too large")
+    return paise
+
+
+def from_paise(paise):
+    return Decimal(paise).scaleb(-2)
+
+
+def split_equal(total, n):
+    if n <= 0:
+        raise SplitError("Nobody to split with")
+    base, extra = divmod(abs(total), n)
+    sign = -1 if total < 0 else 1
+    return [sign * (base + 1)] * extra + [sign * base] * (n - extra)
+
+
+def allocate(total, weights):
+    """Split ``total`` paise in proportion to non-negative integer ``weights``."""
+    weight_sum = sum(weights)
+    if weight_sum <= 0 or any(w < 0 for w in weights):
+        raise SplitError("Split weights must be non-negative and not all zero")
+
+    sign = -1 if total < 0 else 1
+    total = abs(total)
+    parts, remainders = [], []
+    for w in weights:
+        part, remainder = divmod(total * w, weight_sum)
+        parts.append(part)
+        remainders.append(remainder)
+
+    leftover = total - sum(parts)
+    for slot in sorted(range(len(weights)), key=lambda i: (-remainders[i], i))[:leftover]:
+        parts[slot] += 1
+    return [sign * p for p in parts]
+
+
+def split(total, split_type=EQUAL, values=None, n=None):
+    """
+    Return how many paise of ``total`` each slot owes.
+
+    equal    -- ``n`` equal parts
+    exact    -- ``values`` are rupee amounts that must add up to the total
+    percent  -- ``values`` are percentages (up to two decimals) adding up to 100
+    shares   -- ``values`` are non-negative integer share counts
+    """
+    if split_type == EQUAL:
+        return split_equal(total, n if n is not None else len(values))
+    if not values:
+        raise SplitError("Nobody to split with")
+    if split_type == EXACT:
+        parts = [to_paise(v) for v in values]
+        if any(part < 0 for part in parts):
+            raise SplitError("Split amounts can't be negative")
+        if sum(parts) != total:
+            raise SplitError("Split amounts don't add up to the expense amount")
+        return parts
+    if split_type == PERCENT:
+        basis_points = [to_paise(v) for v in values]
+        if any(points < 0 for points in basis_points):
+            raise SplitError("Percentages can't be negative")
+        if sum(basis_points) != 10000:
+            raise SplitError("Percentages must add up to 100")
+        return allocate(total, basis_points)
+    if split_type == SHARES:
+        try:
+            weights = [int(v) for v in values]
+        except (TypeError, ValueError):
+            raise SplitError("Shares must be whole numbers")
+        return allocate(total, weights)
+    raise SplitError(f"Unknown split type {split_type!r}")
@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the last row seen instead of an
+OFFSET, so fetching page 1000 costs the same indexed range scan as page 1.
+Cursors are opaque url-safe strings.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(created_at, pk):
+    raw = json.dumps([created_at.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, pk), or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, pk = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _page_query(queryset, cursor, page_size, field):
+    queryset = queryset.order_by(f'-{field}', '-id')
+    position = decode_cursor(cursor)
+    if position is not None:
+        value, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+    # One extra row tells us whether there is a next page
+    return queryset[:page_size + 1]
+
+
+def _page_result(rows, page_size, field):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return rows, next_cursor
+
+
+def keyset_page(queryset, cursor=None, page_size=PAGE_SIZE, field='created_at', older=None):
+    """
+    Return (rows, next_cursor) for ``queryset`` ordered newest first by
+    (``field``, id). ``next_cursor`` is None on the last page.
+
+    ``older`` is an optional second queryset (an archive) whose rows all
+    sort after ``queryset``'s; paging continues into it once ``queryset``
+    runs out, with the same cursors.
+    """
+    rows = list(_page_query(queryset, cursor, page_size, field))
+    if older is not None and len(rows) <= page_size:
+        rows += _page_query(older, cursor, page_size - len(rows), field)
+    return _page_result(rows, page_size, field)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=PAGE_SIZE, field='created_at', older=None):
+    rows = [row async for row in _page_query(queryset, cursor, page_size, field)]
+    if older is not None and len(rows) <= page_size:
+        rows += [row async for row in _page_query(older, cursor, page_size - len(rows), field)]
+    return _page_result(rows, page_size, field)
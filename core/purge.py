@@ -0,0 +1,68 @@
+"""
+Bulk deletion.
+
+QuerySet.delete() makes Django's collector load every dependent share,
+history row and split into memory to emulate the cascades, and holds its
+locks until the last one is gone. purge() instead works through a list of
+steps, children before parents, deleting each step's rows in id-ordered
+chunks of at most PURGE_CHUNK_SIZE with a plain DELETE, one short
+transaction per chunk. The chunk's rows are locked with select_for_update()
+before anything else happens to them, so a concurrent settlement (or a
+second worker on the same purge) waits instead of working from the same
+rows. A step may hook into each chunk before it goes, to take the rows out
+of the balance tables in the same transaction.
+
+Progress ({'step', 'after', 'deleted'}) is reported after every chunk. Pass
+it back in to pick up where an interrupted purge stopped: the step it
+stopped in continues after the last id it deleted, and every other step
+runs again from the start. The steps only ever match rows that are still
+there, so going over them twice is harmless.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+
+class Step:
+    def __init__(self, name, queryset, before=None):
+        self.name = name
+        self.queryset = queryset
+        self.before = before
+
+
+def delete_ids(model, ids):
+    """DELETE the ``model`` rows with these primary keys, without collecting or cascading."""
+    if not ids:
+        return 0
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} IN ({placeholders})",
+            list(ids),
+        )
+        return cursor.rowcount
+
+
+def purge(steps, chunk_size=None, progress=None, report=None):
+    """Delete the rows of every step in order; returns {step name: rows deleted}."""
+    chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    progress = progress or {'step': None, 'after': 0, 'deleted': {}}
+    # Earlier steps run again: rows that reference the parents may have been
+    # added since they finished, and a step with nothing left costs one query
+    for step in steps:
+        after = progress['after'] if step.name == progress['step'] else 0
+        deleted = progress['deleted'].get(step.name, 0)
+        while True:
+            with transaction.atomic():
+                ids = list(step.queryset.select_for_update(of=('self',)).filter(pk__gt=after).order_by('pk')
+                           .values_list('pk', flat=True)[:chunk_size])
+                if not ids:
+                    break
+                if step.before:
+                    step.before(ids)
+                deleted += delete_ids(step.queryset.model, ids)
+            after = ids[-1]
+            progress = {'step': step.name, 'after': after, 'deleted': {**progress['deleted'], step.name: deleted}}
+            if report:
+                report(progress)
+    return progress['deleted']
@@ -0,0 +1,141 @@
+"""
+User search.
+
+Searches username and first/last name with prefix matching. Email addresses
+are deliberately not searchable, so search can't be used to find out who
+has an account under an address. The backend is pluggable through
+settings.SEARCH_BACKEND (a dotted path); when unset, SQLite databases use
+the FTS5 index kept in core_user_search and any other database falls back
+to istartswith lookups. On PostgreSQL those run as UPPER(col) LIKE
+'PREFIX%', which the UPPER(col) text_pattern_ops expression indexes from
+migration 0022 serve; elsewhere they scan auth_user. The FTS5 index is kept
+current by the User post_save/post_delete receivers connected in
+CoreConfig.ready(); run 'manage.py rebuild_search_index' after bulk loads.
+"""
+import re
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+PAGE_SIZE = 20
+SEARCH_FIELDS = ('username', 'first_name', 'last_name')
+COLUMNS = ', '.join(SEARCH_FIELDS)
+FTS_TABLE = 'core_user_search'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return _TOKEN_RE.findall(query.lower())[:8]
+
+
+class DatabaseSearchBackend:
+    """Prefix match with plain ORM lookups; works on every database, indexed on PostgreSQL."""
+
+    def search(self, query, offset=0, limit=PAGE_SIZE):
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+        queryset = User.objects.all()
+        for token in tokens:
+            condition = Q()
+            for field in SEARCH_FIELDS:
+                condition |= Q(**{f'{field}__istartswith': token})
+            queryset = queryset.filter(condition)
+        total = queryset.count()
+        ids = list(queryset.order_by('username').values_list('id', flat=True)[offset:offset + limit])
+        return ids, total
+
+    def index(self, user):
+        pass
+
+    def remove(self, user_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class SQLiteFTSBackend:
+    """FTS5 full-text index with prefix queries, ranked by bm25."""
+
+    def _match(self, tokens):
+        return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+    def search(self, query, offset=0, limit=PAGE_SIZE):
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+        match = self._match(tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            total = cursor.fetchone()[0]
+            if not total or offset >= total:
+                return [], total
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+                [match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+    def index(self, user):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [user.id])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, {COLUMNS}) VALUES (%s, %s, %s, %s)',
+                [user.id] + [getattr(user, field) or '' for field in SEARCH_FIELDS],
+            )
+
+    def remove(self, user_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [user_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, {COLUMNS}) SELECT id, {COLUMNS} FROM auth_user'
+            )
+            return cursor.rowcount
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return DatabaseSearchBackend()
+
+
+def search_users(query, page=1, page_size=PAGE_SIZE):
+    """Return (users, total) for one page of results, best matches first."""
+    page = max(page, 1)
+    ids, total = get_backend().search(query, offset=(page - 1) * page_size, limit=page_size)
+    users = User.objects.in_bulk(ids)
+    return [users[i] for i in ids if i in users], total
+
+
+async def asearch_users(query, page=1, page_size=PAGE_SIZE):
+    # The backends run raw SQL, which Django only offers synchronously
+    page = max(page, 1)
+    ids, total = await sync_to_async(get_backend().search)(query, offset=(page - 1) * page_size, limit=page_size)
+    users = await User.objects.ain_bulk(ids)
+    return [users[i] for i in ids if i in users], total
+
+
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; skip reindexing for those
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    get_backend().index(instance)
+
+
+def user_deleted(sender, instance, **kwargs):
+    get_backend().remove(instance.id)
@@ -0,0 +1,156 @@
+"""
+Synthetic data for benchmarks.
+
+seed() fills the database with users, friendships, groups, expenses, shares,
+history and splits using bulk_create only, so a few hundred thousand rows
+take seconds rather than minutes. The same ``seed`` value always produces
+the same data.
+
+The friend graph is either uniform (every user gets about
+``friends_per_user`` random friends) or power law, grown by preferential
+attachment so that a few users have hundreds of friends and most have a
+handful, as in real social graphs. Personal expenses are only ever shared
+with the payer's friends, as the app requires.
+"""
+import random
+
+from django.contrib.auth.models import User
+
+from . import group_balances, ledger, money, search
+from .models import (
+    Expense, ExpenseShare, FriendGroup, FriendRequest, Friendship, GroupSplit, TransactionHistory,
+)
+
+USERNAME_PREFIX = 'bench_user_'
+
+UNIFORM = 'uniform'
+POWER_LAW = 'power_law'
+
+
+def _batched(n, size):
+    for start in range(0, n, size):
+        yield start, min(size, n - start)
+
+
+def _uniform_pairs(rng, user_ids, friends_per_user):
+    pairs = set()
+    for uid in user_ids:
+        for other in rng.sample(user_ids, min(friends_per_user, len(user_ids) - 1)):
+            if other != uid:
+                pairs.add((min(uid, other), max(uid, other)))
+    return pairs
+
+
+def _power_law_pairs(rng, user_ids, friends_per_user):
+    # Each new user befriends m existing users picked in proportion to how
+    # many friends they already have; the average degree comes out near 2m
+    m = max(1, friends_per_user // 2)
+    pairs = set()
+    # Every user appears here once per friendship, so a uniform pick from it is degree-weighted
+    endpoints = []
+    core = user_ids[:m + 1]
+    for i, a in enumerate(core):
+        for b in core[i + 1:]:
+            pairs.add((a, b))
+            endpoints += [a, b]
+    for uid in user_ids[m + 1:]:
+        chosen = set()
+        while len(chosen) < m:
+            chosen.add(rng.choice(endpoints))
+        for other in chosen:
+            pairs.add((min(uid, other), max(uid, other)))
+            endpoints += [uid, other]
+    return pairs
+
+
+def seed(users=1000, friends_per_user=8, groups=100, group_size=(3, 12), expenses=20000,
+         group_expense_ratio=0.7, settled_ratio=0.6, friend_graph=UNIFORM, batch_size=2000, seed=0, log=None):
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    user_objs = User.objects.bulk_create(
+        (User(username=f'{USERNAME_PREFIX}{seed}_{i}', password='!') for i in range(users)),
+        batch_size=batch_size,
+    )
+    user_ids = [u.id for u in user_objs]
+    log(f"{len(user_ids)} users")
+
+    build_pairs = _power_law_pairs if friend_graph == POWER_LAW else _uniform_pairs
+    pairs = build_pairs(rng, user_ids, friends_per_user)
+    Friendship.objects.bulk_create((Friendship(user1_id=a, user2_id=b) for a, b in pairs), batch_size=batch_size)
+    FriendRequest.objects.bulk_create(
+        (FriendRequest(sender_id=a, receiver_id=b, status='accepted') for a, b in pairs), batch_size=batch_size
+    )
+    FriendRequest.objects.bulk_create(
+        (FriendRequest(sender_id=b, receiver_id=a) for a, b in rng.sample(sorted(pairs), len(pairs) // 10)),
+        batch_size=batch_size,
+    )
+    log(f"{len(pairs)} friendships")
+    friends_of = {uid: [] for uid in user_ids}
+    for a, b in sorted(pairs):
+        friends_of[a].append(b)
+        friends_of[b].append(a)
+
+    group_objs = FriendGroup.objects.bulk_create(FriendGroup(name=f'Group {i}') for i in range(groups))
+    group_members = {}
+    through = []
+    for group in group_objs:
+        members = rng.sample(user_ids, min(rng.randint(*group_size), len(user_ids)))
+        group_members[group.id] = members
+        through.extend(FriendGroup.members.through(friendgroup_id=group.id, user_id=uid) for uid in members)
+    FriendGroup.members.through.objects.bulk_create(through, batch_size=batch_size)
+    log(f"{len(group_objs)} groups")
+
+    group_ids = list(group_members)
+    for start, count in _batched(expenses, batch_size):
+        specs = []
+        for _ in range(count):
+            amount = rng.randint(100, 500000)
+            if group_ids and rng.random() < group_expense_ratio:
+                group_id = rng.choice(group_ids)
+                members = group_members[group_id]
+                payer = rng.choice(members)
+                specs.append((Expense(group_id=group_id, payer_id=payer, amount=money.from_paise(amount),
+                                      description=f'Expense {start}'), members))
+            else:
+                payer = rng.choice(user_ids)
+                friends_of_payer = friends_of[payer]
+                others = rng.sample(friends_of_payer, min(rng.randint(1, 3), len(friends_of_payer)))
+                specs.append((Expense(payer_id=payer, amount=money.from_paise(amount),
+                                      description=f'Expense {start}'), [payer] + others))
+        Expense.objects.bulk_create([expense for expense, _ in specs])
+
+        shares, history, friend_links = [], [], []
+        for expense, members in specs:
+            total = money.to_paise(expense.amount)
+            owed = money.split_equal(total, len(members))
+            settled = rng.random() < settled_ratio
+            for uid, member_owed in zip(members, owed):
+                paid = total if uid == expense.payer_id else 0
+                shares.append(ExpenseShare(expense_id=expense.id, user_id=uid,
+                                           amount=money.from_paise(paid - member_owed), settled=settled))
+                history.append(TransactionHistory(
+                    user_id=uid, transaction_type='expense', group_id=expense.group_id,
+                    amount=expense.amount if paid else money.from_paise(-member_owed),
+                    related_user_id=None if paid else expense.payer_id, description=expense.description,
+                ))
+                if expense.group_id is None and uid != expense.payer_id:
+                    friend_links.append(Expense.friends.through(expense_id=expense.id, user_id=uid))
+        ExpenseShare.objects.bulk_create(shares, batch_size=batch_size)
+        TransactionHistory.objects.bulk_create(history, batch_size=batch_size)
+        Expense.friends.through.objects.bulk_create(friend_links, batch_size=batch_size)
+        log(f"{start + count} expenses")
+
+    splits = []
+    for group_id, members in group_members.items():
+        for _ in range(len(members) // 2):
+            a, b = rng.sample(members, 2)
+            splits.append(GroupSplit(group_id=group_id, from_user_id=a, to_user_id=b,
+                                     amount=money.from_paise(rng.randint(100, 100000))))
+    GroupSplit.objects.bulk_create(splits, batch_size=batch_size)
+
+    ledger.rebuild()
+    group_balances.rebuild()
+    search.get_backend().rebuild()
+    log("ledger, group balances and search index rebuilt")
+    return user_ids, group_ids
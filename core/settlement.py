@@ -0,0 +1,93 @@
+"""
+Settling shares.
+
+settle() settles any number of shares in one transaction and a fixed number
+of queries, whether it is one "Settle Up" click or everything open between
+two friends: the open shares are locked in id order (so concurrent batches
+neither deadlock nor settle a share twice), flipped with a single UPDATE,
+taken out of the ledger and group balances, and recorded with one
+bulk_create of history rows. Groups touched get their suggested splits
+recalculated in the background rather than patched here.
+
+With an idempotency key the result is stored against (actor, key), and a
+retry with the same key returns it without settling anything again.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import fragment_cache, group_balances, jobs, ledger, money
+from .models import ExpenseShare, SettlementRequest, TransactionHistory
+
+
+def open_shares(actor, share_ids=None, with_user=None):
+    """Unsettled shares ``actor`` may settle: those in ``share_ids``, or every one between them and ``with_user``."""
+    shares = ExpenseShare.objects.filter(settled=False).exclude(user_id=F('expense__payer_id'))
+    if with_user is not None:
+        return shares.filter(Q(user=actor, expense__payer=with_user) | Q(user=with_user, expense__payer=actor))
+    return shares.filter(Q(user=actor) | Q(expense__payer=actor), id__in=share_ids)
+
+
+def history_rows(user_id, payer_id, group_id, amount, description, now):
+    # A negative share was owed by its user to the payer, a positive one the other way round
+    debtor, creditor = (user_id, payer_id) if amount < 0 else (payer_id, user_id)
+    amount = abs(amount)
+    return [
+        TransactionHistory(user_id=debtor, transaction_type='settlement', amount=-amount, group_id=group_id,
+                           related_user_id=creditor, description=f"Settled: {description}", settled_at=now),
+        TransactionHistory(user_id=creditor, transaction_type='settlement', amount=amount, group_id=group_id,
+                           related_user_id=debtor, description=f"Received settlement for {description}", settled_at=now),
+    ]
+
+
+def _settle(shares):
+    rows = list(shares.select_for_update(of=('self',)).order_by('id').values_list(
+        'id', 'user_id', 'expense__payer_id', 'expense__group_id', 'amount', 'expense__description'))
+    if not rows:
+        return {'shares': [], 'amount': '0.00'}
+
+    ids = [row[0] for row in rows]
+    ExpenseShare.objects.filter(id__in=ids).update(settled=True)
+    ledger.apply_shares([(user_id, payer_id, amount) for _, user_id, payer_id, _, amount, _ in rows], sign=-1)
+    group_balances.settle([(group_id, user_id, payer_id, amount) for _, user_id, payer_id, group_id, amount, _ in rows])
+
+    now = timezone.now()
+    TransactionHistory.objects.bulk_create([
+        history
+        for _, user_id, payer_id, group_id, amount, description in rows
+        for history in history_rows(user_id, payer_id, group_id, amount, description, now)
+    ])
+
+    groups = {row[3] for row in rows if row[3]}
+    for group_id in groups:
+        jobs.schedule_split_recalculation(group_id)
+    fragment_cache.invalidate(users={row[1] for row in rows} | {row[2] for row in rows}, groups=groups)
+
+    total = sum(money.to_paise(abs(row[4])) for row in rows)
+    return {'shares': ids, 'amount': str(money.from_paise(total))}
+
+
+def settle(actor, share_ids=None, with_user=None, idempotency_key=None):
+    """
+    Settle the given shares, or every open share between ``actor`` and
+    ``with_user``. Returns {'shares': ids settled now, 'amount': total as a
+    string, 'replayed': whether this was answered from an earlier call}.
+    Shares that are already settled, or that ``actor`` is not part of, are
+    left alone.
+    """
+    if (share_ids is None) == (with_user is None):
+        raise ValueError("Pass either share_ids or with_user")
+    with transaction.atomic():
+        if idempotency_key:
+            try:
+                with transaction.atomic():
+                    request = SettlementRequest.objects.create(actor=actor, key=idempotency_key)
+            except IntegrityError:
+                # Retried (or sent twice at once; the unique key makes the second wait for the first)
+                stored = SettlementRequest.objects.get(actor=actor, key=idempotency_key).result
+                return dict(stored, replayed=True)
+        result = _settle(open_shares(actor, share_ids, with_user))
+        if idempotency_key:
+            request.result = result
+            request.save(update_fields=['result'])
+    return dict(result, replayed=False)
@@ -0,0 +1,170 @@
+"""
+Debt-simplification engine.
+
+Works on plain integer balances (paise) indexed by member slot: a positive
+balance is owed to that member, a negative one is owed by them. Strategies
+return a list of (from_slot, to_slot, amount) transfers and never touch the
+ORM, so they can be reused by views, jobs and previews alike.
+"""
+import heapq
+import time
+
+GREEDY = 'greedy'
+HEAP = 'heap'
+OPTIMAL = 'optimal'
+STRATEGIES = (GREEDY, HEAP, OPTIMAL)
+
+# 2**20 subset states is the most the exact solver will attempt.
+MAX_OPTIMAL_MEMBERS = 20
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def _check(deadline):
+    if deadline is not None and time.perf_counter() > deadline:
+        raise BudgetExceeded
+
+
+def greedy(balances, deadline=None):
+    """Two-pointer matcher: largest debtor pays largest creditor, in sorted order."""
+    owes = sorted(((i, -b) for i, b in enumerate(balances) if b < 0), key=lambda x: x[1], reverse=True)
+    gets = sorted(((i, b) for i, b in enumerate(balances) if b > 0), key=lambda x: x[1], reverse=True)
+
+    transfers = []
+    i = j = 0
+    while i < len(owes) and j < len(gets):
+        owe_id, owe_amt = owes[i]
+        get_id, get_amt = gets[j]
+        transfer = min(owe_amt, get_amt)
+        transfers.append((owe_id, get_id, transfer))
+
+        owes[i] = (owe_id, owe_amt - transfer)
+        gets[j] = (get_id, get_amt - transfer)
+        if owes[i][1] == 0:
+            i += 1
+        if gets[j][1] == 0:
+            j += 1
+    return transfers
+
+
+def heap_greedy(balances, deadline=None):
+    """Re-rank after every transfer so the current largest debtor always meets the largest creditor."""
+    owes = [(b, i) for i, b in enumerate(balances) if b < 0]
+    gets = [(-b, i) for i, b in enumerate(balances) if b > 0]
+    heapq.heapify(owes)
+    heapq.heapify(gets)
+
+    transfers = []
+    while owes and gets:
+        _check(deadline)
+        owe_amt, owe_id = heapq.heappop(owes)
+        get_amt, get_id = heapq.heappop(gets)
+        transfer = min(-owe_amt, -get_amt)
+        transfers.append((owe_id, get_id, transfer))
+
+        if owe_amt + transfer < 0:
+            heapq.heappush(owes, (owe_amt + transfer, owe_id))
+        if get_amt + transfer < 0:
+            heapq.heappush(gets, (get_amt + transfer, get_id))
+    return transfers
+
+
+def optimal(balances, deadline=None):
+    """
+    Exact minimum number of transfers.
+
+    A set of k members whose balances sum to zero can always be settled with
+    k - 1 transfers, so the minimum is (non-zero members) - (maximum number of
+    disjoint zero-sum subsets). That maximum is found with a DP over subsets.
+    """
+    if sum(balances) != 0:
+        raise BudgetExceeded
+
+    transfers = []
+    slots = [i for i, b in enumerate(balances) if b != 0]
+
+    # Opposite pairs are always their own group in some optimal partition.
+    by_amount = {}
+    remaining = []
+    for slot in slots:
+        partner = by_amount.get(-balances[slot])
+        if partner:
+            other = partner.pop()
+            if balances[slot] < 0:
+                transfers.append((slot, other, -balances[slot]))
+            else:
+                transfers.append((other, slot, balances[slot]))
+        else:
+            by_amount.setdefault(balances[slot], []).append(slot)
+    for group in by_amount.values():
+        remaining.extend(group)
+    remaining.sort()
+
+    n = len(remaining)
+    if n > MAX_OPTIMAL_MEMBERS:
+        raise BudgetExceeded
+    if n == 0:
+        return transfers
+
+    values = [balances[slot] for slot in remaining]
+    size = 1 << n
+    subset_sum = [0] * size
+    best = [0] * size
+    for mask in range(1, size):
+        if not mask & 0xFFF:
+            _check(deadline)
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + values[low.bit_length() - 1]
+        top = 0
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] > top:
+                top = best[mask ^ bit]
+            bits ^= bit
+        best[mask] = top + (subset_sum[mask] == 0)
+
+    # Walk back from the full set; every zero-sum prefix closes a group.
+    mask = size - 1
+    group = []
+    while mask:
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] + (subset_sum[mask] == 0) == best[mask]:
+                break
+            bits ^= bit
+        group.append(bit.bit_length() - 1)
+        mask ^= bit
+        if subset_sum[mask] == 0:
+            members = [remaining[k] for k in group]
+            sub = greedy([balances[slot] for slot in members])
+            transfers.extend((members[a], members[b], amount) for a, b, amount in sub)
+            group = []
+    return transfers
+
+
+_STRATEGY_FUNCS = {
+    GREEDY: greedy,
+    HEAP: heap_greedy,
+    OPTIMAL: optimal,
+}
+
+
+def simplify(balances, strategy=GREEDY, time_budget=None):
+    """
+    Return transfers settling ``balances`` using ``strategy``.
+
+    ``time_budget`` is in seconds. When a strategy runs out of budget, or
+    cannot handle the input (too many members for the exact solver, balances
+    that do not net to zero), the plain greedy result is returned instead.
+    """
+    if strategy not in _STRATEGY_FUNCS:
+        raise ValueError(f"Unknown split strategy: {strategy!r}")
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+    try:
+        return _STRATEGY_FUNCS[strategy](list(balances), deadline)
+    except BudgetExceeded:
+        return greedy(balances)
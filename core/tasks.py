@@ -0,0 +1,37 @@
+"""
+Background tasks run by the job workers (see core/jobs.py).
+
+Each task looks its objects up again by id: by the time a worker gets to a
+job the group or user may be gone, in which case there is nothing to do.
+The purges report their progress and resume from it when retried.
+"""
+from django.contrib.auth.models import User
+
+from . import expenses, jobs
+from .models import FriendGroup
+
+
+@jobs.task(jobs.RECALCULATE_SPLITS)
+def recalculate_splits(group_id, strategy=None):
+    group = FriendGroup.objects.filter(id=group_id).first()
+    if group is None:
+        return None
+    return {'transfers': expenses.recalculate_group_splits(group, strategy)}
+
+
+@jobs.task(jobs.CLEAR_TRANSACTIONS)
+def clear_transactions(user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return None
+    return {'expenses': expenses.clear_user_transactions(
+        user, progress=jobs.saved_progress(), report=jobs.report_progress)}
+
+
+@jobs.task(jobs.DELETE_GROUP)
+def delete_group(group_id):
+    group = FriendGroup.all_objects.filter(id=group_id).first()
+    if group is None:
+        return None
+    expenses.delete_group(group, progress=jobs.saved_progress(), report=jobs.report_progress)
+    return {'group': group_id}
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class SplitwiseTestRunner(DiscoverRunner):
+    """Runs the suite against TEST_CACHES, so clearing the cache never touches the one the servers share."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=settings.TEST_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1346 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    benchmark, compaction, db_router, expenses, fragment_cache, friends, group_balances, importer, jobs, loadtest, ledger, metrics,
+    money, search, seed, settlement, simplify, vectorized,
+)
+from .models import (
+    ArchivedExpense, ArchivedExpenseShare, ArchivedTransactionHistory, Expense, ExpenseShare, FriendGroup, FriendRequest, Friendship, GroupBalance,
+    GroupCheckpoint, GroupSplit, Job, PairBalance, TransactionHistory, UserBalance,
+)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SplitwiseTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+        self.carol = User.objects.create_user(username='carol', password='pass')
+        self.client.login(username='alice', password='pass')
+
+    def make_group(self, *members):
+        group = FriendGroup.objects.create(name='Trip')
+        group.members.add(*members)
+        return group
+
+    def add_group_expense(self, group, amount, **paid):
+        data = {'description': 'Expense', 'amount': str(amount)}
+        data.update({f'paid_{getattr(self, name).id}': str(value) for name, value in paid.items()})
+        return self.client.post(reverse('add_group_expense', args=[group.id]), data)
+
+
+class BalanceLedgerTests(SplitwiseTestCase):
+    def totals(self, user):
+        return tuple(ledger.get_totals(user))
+
+    def test_add_expense_updates_ledger(self):
+        self.client.post(reverse('add_expense'), {
+            'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id, self.carol.id],
+        })
+        self.assertEqual(self.totals(self.alice), (Decimal('0'), Decimal('60.00')))
+        self.assertEqual(self.totals(self.bob), (Decimal('30.00'), Decimal('0')))
+        pair = PairBalance.objects.get(user=self.bob, counterparty=self.alice)
+        self.assertEqual((pair.owes, pair.owed), (Decimal('30.00'), Decimal('0')))
+        self.assertEqual(ledger.verify(), [])
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['you_are_owed_total'], Decimal('60.00'))
+
+    def test_group_expense_and_settle(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.client.post(reverse('add_group_expense', args=[group.id]), {
+            'description': 'Hotel', 'amount': '300',
+            f'paid_{self.alice.id}': '200', f'paid_{self.bob.id}': '100',
+        })
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(self.totals(self.carol), (Decimal('100.00'), Decimal('0')))
+
+        share = ExpenseShare.objects.get(user=self.carol)
+        self.client.post(reverse('settle_expense', args=[share.id]))
+        self.client.post(reverse('settle_expense', args=[share.id]))
+        self.assertEqual(self.totals(self.carol), (Decimal('0'), Decimal('0')))
+        self.assertEqual(ledger.verify(), [])
+
+    def test_clear_all_transactions(self):
+        self.client.post(reverse('add_expense'), {
+            'description': 'Taxi', 'amount': '10', 'friends': [self.bob.id, self.carol.id],
+        })
+        self.client.post(reverse('clear_all_transactions'))
+        jobs.run_pending()
+        self.assertEqual(self.totals(self.alice), (Decimal('0'), Decimal('0')))
+        self.assertEqual(ledger.verify(), [])
+
+    def test_rebuild_command(self):
+        self.client.post(reverse('add_expense'), {
+            'description': 'Lunch', 'amount': '20', 'friends': [self.bob.id],
+        })
+        UserBalance.objects.filter(user=self.bob).update(owes=Decimal('99'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True, stdout=StringIO())
+
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(self.totals(self.bob), (Decimal('10.00'), Decimal('0')))
+
+
+class PairBalanceTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(55):
+            expenses.create_personal_expense(self.alice, 'Coffee', 1000, [self.bob.id])
+        expenses.create_personal_expense(self.bob, 'Taxi', 3000, [self.alice.id])
+        expenses.create_personal_expense(self.carol, 'Lunch', 2000, [self.alice.id])
+
+    def test_dashboard_lists_one_row_per_counterparty(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([(debt['user'], debt['amount']) for debt in response.context['you_are_owed']],
+                         [(self.bob, Decimal('260.00'))])
+        self.assertEqual([(debt['user'], debt['amount']) for debt in response.context['you_owe']],
+                         [(self.carol, Decimal('10.00'))])
+        self.assertContains(response, reverse('balance_detail', args=[self.bob.id]))
+
+    def test_detail_pages_the_shares_behind_a_balance(self):
+        response = self.client.get(reverse('balance_detail', args=[self.bob.id]))
+        self.assertEqual(response.context['net'], Decimal('260.00'))
+        shares = response.context['shares']
+        self.assertEqual(len(shares), 50)
+        self.assertEqual((shares[0].expense.description, shares[0].net), ('Taxi', Decimal('-15.00')))
+
+        response = self.client.get(reverse('balance_detail', args=[self.bob.id]), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['shares']), 6)
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_settle_up_from_dashboard(self):
+        response = self.client.get(reverse('dashboard'))
+        # The key is filled in when the cached fragment is served
+        key = re.search(rf'name="idempotency_key" value="([0-9a-f]+-{self.bob.id})"', response.content.decode()).group(1)
+        again = self.client.get(reverse('dashboard')).content.decode()
+        self.assertNotIn(key, again)
+        response = self.client.post(reverse('settle_with_friend', args=[self.bob.id]),
+                                    {'idempotency_key': key, 'next': reverse('dashboard')})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(PairBalance.objects.get(user=self.alice, counterparty=self.bob).owed, Decimal('0'))
+
+
+class CalculateGroupSplitTests(SplitwiseTestCase):
+    def calculate(self, group):
+        self.client.post(reverse('calculate_group_split', args=[group.id]))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(jobs.run_pending(), 1)
+        return len(ctx.captured_queries)
+
+    def test_splits_settle_net_balances(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 300, alice=300)
+        self.add_group_expense(group, 90, bob=90)
+        self.calculate(group)
+
+        splits = {(s.from_user_id, s.to_user_id): s.amount for s in GroupSplit.objects.filter(group=group)}
+        self.assertEqual(splits, {
+            (self.carol.id, self.alice.id): Decimal('130.00'),
+            (self.bob.id, self.alice.id): Decimal('40.00'),
+        })
+
+    def test_query_count_independent_of_expense_count(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 30, alice=30)
+        small = self.calculate(group)
+
+        for _ in range(20):
+            self.add_group_expense(group, 30, bob=20, carol=10)
+        self.assertEqual(self.calculate(group), small)
+        self.assertTrue(GroupSplit.objects.filter(group=group).exists())
+
+
+class GroupBalanceTests(SplitwiseTestCase):
+    def nets(self, group):
+        return {uid: net for uid, net in group_balances.get_nets(group).items() if net}
+
+    def test_expenses_and_settlements_update_running_nets(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 300, alice=300)
+        self.assertEqual(self.nets(group), {
+            self.alice.id: Decimal('200.00'), self.bob.id: Decimal('-100.00'), self.carol.id: Decimal('-100.00'),
+        })
+
+        share = ExpenseShare.objects.get(user=self.carol)
+        self.client.post(reverse('settle_expense', args=[share.id]))
+        self.client.post(reverse('settle_expense', args=[share.id]))
+        self.assertEqual(self.nets(group), {self.alice.id: Decimal('100.00'), self.bob.id: Decimal('-100.00')})
+        self.assertEqual(group_balances.verify(), [])
+
+        # Only the unsettled debt is left to split, read from the running nets
+        self.client.post(reverse('calculate_group_split', args=[group.id]))
+        with CaptureQueriesContext(connection) as ctx:
+            jobs.run_pending()
+        self.assertFalse(any('core_expenseshare' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(
+            [(s.from_user_id, s.to_user_id, s.amount) for s in GroupSplit.objects.filter(group=group)],
+            [(self.bob.id, self.alice.id, Decimal('100.00'))],
+        )
+
+    def test_clearing_transactions_keeps_nets_consistent(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 90, alice=90)
+        self.add_group_expense(group, 60, bob=60)
+        self.client.post(reverse('clear_all_transactions'))
+        jobs.run_pending()
+        self.assertEqual(group_balances.verify(), [])
+
+    def test_rebuild_command_checks_group_balances(self):
+        group = self.make_group(self.alice, self.bob)
+        self.add_group_expense(group, 10, alice=10)
+        GroupBalance.objects.filter(user=self.bob).update(net=Decimal('3'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True, stdout=StringIO())
+
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(group_balances.verify(), [])
+        self.assertEqual(self.nets(group), {self.alice.id: Decimal('5.00'), self.bob.id: Decimal('-5.00')})
+
+
+class VectorizedTests(SplitwiseTestCase):
+    def test_report_agrees_with_group_balances(self):
+        seed.seed(users=40, groups=3, group_size=(10, 20), expenses=400, group_expense_ratio=1.0, seed=3)
+        for group in FriendGroup.objects.all():
+            report = vectorized.group_report(group, use_numpy=False)
+            nets = {uid: money.to_paise(net) for uid, net in group_balances.get_nets(group).items()}
+            self.assertEqual({m['user_id']: m['net'] for m in report['members'] if m['net']},
+                             {uid: net for uid, net in nets.items() if net})
+            if vectorized.np is not None:
+                self.assertEqual(vectorized.group_report(group, use_numpy=True), dict(report, engine='numpy'))
+
+    def test_debts_and_totals(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 90, alice=90)
+        share = ExpenseShare.objects.get(user=self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settle_expense', args=[share.id]))
+
+        for use_numpy in (False, True) if vectorized.np is not None else (False,):
+            report = vectorized.group_report(group, use_numpy=use_numpy)
+            self.assertEqual(report['debts'], [(self.carol.id, self.alice.id, 3000)])
+            self.assertEqual(report['members'], [
+                {'user_id': self.alice.id, 'net': 3000, 'shares': 1, 'lent': 6000, 'borrowed': 0, 'open': 6000},
+                {'user_id': self.bob.id, 'net': 0, 'shares': 1, 'lent': 0, 'borrowed': 3000, 'open': 0},
+                {'user_id': self.carol.id, 'net': -3000, 'shares': 1, 'lent': 0, 'borrowed': 3000, 'open': -3000},
+            ])
+
+
+class CompactionTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(self.group, 300, alice=300)
+        for share in ExpenseShare.objects.exclude(user=self.alice):
+            self.client.post(reverse('settle_expense', args=[share.id]))
+        self.add_group_expense(self.group, 60, bob=60)
+        jobs.run_pending()
+        long_ago = timezone.now() - timedelta(days=200)
+        Expense.objects.update(created_at=long_ago)
+        TransactionHistory.objects.update(created_at=long_ago)
+
+    def test_archives_only_fully_settled_expenses(self):
+        nets = group_balances.get_nets(self.group)
+        totals = {user.id: tuple(ledger.get_totals(user)) for user in (self.alice, self.bob, self.carol)}
+        history = TransactionHistory.objects.count()
+
+        counts = compaction.compact()
+        self.assertEqual(counts, {'expenses': 1, 'history': history})
+        self.assertEqual(list(Expense.objects.values_list('amount', flat=True)), [Decimal('60.00')])
+        self.assertEqual(ArchivedExpense.objects.get().shares.count(), 3)
+
+        # Balances are unchanged and still check out against checkpoints plus live shares
+        self.assertEqual(group_balances.get_nets(self.group), nets)
+        self.assertEqual({user.id: tuple(ledger.get_totals(user)) for user in (self.alice, self.bob, self.carol)}, totals)
+        self.assertEqual(group_balances.verify(), [])
+        self.assertEqual(ledger.verify(), [])
+        # A fully settled split nets to zero, so there is nothing to checkpoint
+        self.assertFalse(GroupCheckpoint.objects.exclude(net=0).exists())
+        self.assertEqual(compaction.settled_totals(self.alice), (Decimal('0.00'), Decimal('200.00')))
+        self.assertEqual(compaction.settled_totals(self.bob), (Decimal('100.00'), Decimal('0.00')))
+
+        # Rebuilding from checkpoints gives the same nets
+        group_balances.rebuild()
+        self.assertEqual(group_balances.get_nets(self.group), nets)
+        self.assertEqual(compaction.compact(), {'expenses': 0, 'history': 0})
+
+    def test_archived_history_is_still_listed(self):
+        expected = list(TransactionHistory.objects.filter(user=self.alice).order_by('-created_at', '-id').values_list('id', flat=True))
+        call_command('compact_history', older_than_days=90, stdout=StringIO())
+        self.assertFalse(TransactionHistory.objects.exists())
+        self.assertTrue(ArchivedTransactionHistory.objects.exists())
+
+        response = self.client.get(reverse('transaction_history'))
+        self.assertEqual([entry.id for entry in response.context['history']], expected)
+        response = self.client.get(reverse('export_transaction_history'), {'format': 'json'})
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), len(expected))
+
+        response = self.client.get(reverse('group_detail', args=[self.group.id]))
+        self.assertContains(response, '1 older settled expense archived')
+
+    def test_clearing_transactions_clears_the_archive(self):
+        compaction.compact()
+        self.assertTrue(ArchivedExpense.objects.filter(payer=self.alice).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('clear_all_transactions'))
+            jobs.run_pending()
+
+        self.assertFalse(ArchivedExpense.objects.filter(payer=self.alice).exists())
+        self.assertFalse(ArchivedExpenseShare.objects.filter(user=self.alice).exists())
+        self.assertEqual(compaction.settled_totals(self.alice), (Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(compaction.settled_totals(self.bob), (Decimal('0.00'), Decimal('0.00')))
+        self.assertFalse(GroupCheckpoint.objects.exclude(net=0).exists())
+        self.assertEqual(group_balances.verify(), [])
+        self.assertEqual(ledger.verify(), [])
+
+
+class SettlementTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        Friendship.objects.create(user1=self.alice, user2=self.bob)
+        Friendship.objects.create(user1=self.alice, user2=self.carol)
+
+    def add_expense(self, n=1, friends=None):
+        for i in range(n):
+            self.client.post(reverse('add_expense'), {'description': f'Dinner {i}', 'amount': '90',
+                                                      'friends': friends or [self.bob.id]})
+
+    def test_settles_everything_with_a_friend_in_a_fixed_number_of_queries(self):
+        self.add_expense(2)
+        with CaptureQueriesContext(connection) as few:
+            result = settlement.settle(self.alice, with_user=self.bob)
+        self.assertEqual(len(result['shares']), 2)
+        self.assertEqual(result['amount'], '90.00')
+
+        self.add_expense(6, friends=[self.bob.id, self.carol.id])
+        with CaptureQueriesContext(connection) as many:
+            result = settlement.settle(self.alice, with_user=self.bob)
+        self.assertEqual(len(result['shares']), 6)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+        self.assertEqual(ledger.get_totals(self.bob), (Decimal('0'), Decimal('0')))
+        self.assertEqual(ledger.get_totals(self.alice), (Decimal('0'), Decimal('180.00')))
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(TransactionHistory.objects.filter(transaction_type='settlement', user=self.bob).count(), 8)
+        self.assertEqual(settlement.settle(self.alice, with_user=self.bob)['shares'], [])
+
+    def test_idempotency_key_replays_the_first_result(self):
+        self.add_expense(2)
+        first = settlement.settle(self.bob, with_user=self.alice, idempotency_key='k1')
+        self.add_expense()
+        again = settlement.settle(self.bob, with_user=self.alice, idempotency_key='k1')
+        self.assertEqual(again, dict(first, replayed=True))
+        self.assertEqual(ExpenseShare.objects.filter(user=self.bob, settled=False).count(), 1)
+        self.assertEqual(TransactionHistory.objects.filter(transaction_type='settlement').count(), 4)
+
+    def test_group_settlement_updates_nets_and_schedules_splits(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 300, alice=300)
+        Job.objects.all().delete()
+        share = ExpenseShare.objects.get(user=self.carol)
+        result = settlement.settle(self.carol, share_ids=[share.id])
+        self.assertEqual(result['shares'], [share.id])
+        self.assertEqual(group_balances.verify(), [])
+        self.assertEqual(Job.objects.get().payload, {'group_id': group.id})
+
+    def test_only_parties_can_settle(self):
+        self.add_expense()
+        share = ExpenseShare.objects.get(user=self.bob)
+        self.assertEqual(settlement.settle(self.carol, share_ids=[share.id])['shares'], [])
+        self.assertFalse(ExpenseShare.objects.get(id=share.id).settled)
+
+    def test_settle_with_friend_view_survives_double_submit(self):
+        self.add_expense(3)
+        response = self.client.get(reverse('friends_list'))
+        key = f"{response.context['settle_key']}-{self.bob.id}"
+        for _ in range(2):
+            self.client.post(reverse('settle_with_friend', args=[self.bob.id]), {'idempotency_key': key})
+        self.assertFalse(ExpenseShare.objects.filter(user=self.bob, settled=False).exists())
+        self.assertEqual(TransactionHistory.objects.filter(transaction_type='settlement').count(), 6)
+
+
+class GroupDetailTests(SplitwiseTestCase):
+    def render_count(self, group):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('group_detail', args=[group.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_independent_of_group_contents(self):
+        small_group = self.make_group(self.alice, self.bob)
+        self.add_group_expense(small_group, 10, alice=10)
+        self.client.post(reverse('calculate_group_split', args=[small_group.id]))
+        jobs.run_pending()
+        small, _ = self.render_count(small_group)
+
+        others = [User.objects.create_user(username=f'member{i}') for i in range(15)]
+        big_group = self.make_group(self.alice, self.bob, self.carol, *others)
+        for i in range(10):
+            self.add_group_expense(big_group, 100 + i, alice=50, bob=50 + i)
+        self.client.post(reverse('calculate_group_split', args=[big_group.id]))
+        jobs.run_pending()
+        self.assertGreater(GroupSplit.objects.filter(group=big_group).count(), 5)
+
+        large, response = self.render_count(big_group)
+        self.assertEqual(small, large)
+        self.assertContains(response, '18 members')
+        self.assertEqual(len(response.context['splits']), GroupSplit.objects.filter(group=big_group).count())
+        # Everything alice is owed is rendered, who owes it and how much
+        owed_to_alice = GroupSplit.objects.filter(group=big_group, to_user=self.alice).select_related('from_user')
+        self.assertTrue(owed_to_alice)
+        html = ' '.join(response.content.decode().split())
+        for split in owed_to_alice:
+            self.assertIn(f'{split.from_user.username} → alice </div> <span class="badge bg-primary rounded-pill"> ₹{split.amount} </span>', html)
+
+    def test_non_member_is_redirected(self):
+        group = self.make_group(self.bob, self.carol)
+        response = self.client.get(reverse('group_detail', args=[group.id]))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+
+class FragmentCacheTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        fragment_cache.reset_stats()
+
+    def get(self, url):
+        # Version bumps run on commit, which TestCase otherwise never reaches
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(url)
+
+    def post(self, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data or {})
+            jobs.run_pending()
+        return response
+
+    def test_dashboard_served_from_cache_until_balances_change(self):
+        self.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get(reverse('dashboard'))
+        self.assertFalse(any('core_expenseshare' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(fragment_cache.stats()['hits'], 2)
+
+        self.post(reverse('add_expense'), {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        response = self.get(reverse('dashboard'))
+        self.assertContains(response, '45.00')
+        self.assertEqual(fragment_cache.stats()['misses'], 4)
+
+    def test_settle_form_gets_current_csrf_token(self):
+        self.post(reverse('add_expense'), {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        self.get(reverse('dashboard'))
+        response = self.get(reverse('dashboard'))
+        self.assertNotContains(response, fragment_cache.CSRF_PLACEHOLDER)
+        self.assertNotContains(response, '&lt;form')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_group_writes_invalidate_group_page(self):
+        group = self.make_group(self.alice, self.bob)
+        self.get(reverse('group_detail', args=[group.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_group_expense(group, 50, alice=50)
+        self.assertContains(self.get(reverse('group_detail', args=[group.id])), 'Paid by alice')
+
+        self.post(reverse('calculate_group_split', args=[group.id]))
+        self.assertContains(self.get(reverse('group_detail', args=[group.id])), 'bob → alice')
+
+        self.post(reverse('clear_group_splits', args=[group.id]))
+        self.assertNotContains(self.get(reverse('group_detail', args=[group.id])), 'bob → alice')
+
+    def test_other_users_versions_are_untouched(self):
+        self.get(reverse('dashboard'))
+        self.client.force_login(self.carol)
+        self.get(reverse('dashboard'))
+
+        self.client.force_login(self.alice)
+        self.post(reverse('add_expense'), {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        self.client.force_login(self.carol)
+        self.get(reverse('dashboard'))
+        self.assertEqual(fragment_cache.stats()['hits'], 2)
+
+    def test_stats_are_staff_only(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        User.objects.filter(id=self.alice.id).update(is_staff=True)
+        self.assertEqual(set(self.client.get(reverse('cache_stats')).json()), {'hits', 'misses', 'hit_ratio'})
+
+
+class MetricsTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def sample(self, line_prefix):
+        body = metrics.render()
+        return next(float(line.rsplit(' ', 1)[1]) for line in body.splitlines() if line.startswith(line_prefix))
+
+    def test_records_queries_and_time_per_view(self):
+        self.client.get(reverse('add_expense'))
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('friends_list'))
+
+        self.assertGreater(self.sample('splitwise_db_queries_sum{view="add_expense"}'), 0)
+        # Async views run their queries in worker threads; they are counted too
+        self.assertGreater(self.sample('splitwise_db_queries_sum{view="dashboard"}'), 0)
+        self.assertEqual(self.sample('splitwise_request_duration_seconds_count{view="dashboard"}'), 2)
+        self.assertEqual(self.sample('splitwise_db_queries_bucket{view="friends_list",le="+Inf"}'), 1)
+        self.assertGreater(self.sample('splitwise_template_duration_seconds_sum{view="dashboard"}'), 0)
+
+    def test_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+        User.objects.filter(id=self.alice.id).update(is_staff=True)
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE splitwise_db_queries histogram', response.content)
+        self.assertIn(b'splitwise_fragment_cache_hits_total', response.content)
+
+    def test_sampled_slow_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(METRICS_PROFILE_SAMPLE_RATE=1.0, METRICS_PROFILE_SLOW_MS=0, METRICS_PROFILE_DIR=directory):
+                self.client.get(reverse('friends_list'))
+            [name] = os.listdir(directory)
+            self.assertTrue(name.startswith('friends_list-'))
+            pstats.Stats(os.path.join(directory, name))
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaRoutingTests(SplitwiseTestCase):
+    # 'default' stands in for the replica; request.read_db shows where reads went
+
+    def test_read_only_views_use_a_replica(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.wsgi_request.read_db, 'default')
+        response = self.client.get(reverse('friends_list'))
+        self.assertEqual(response.wsgi_request.read_db, 'default')
+        response = self.client.get(reverse('add_expense'))
+        self.assertIsNone(response.wsgi_request.read_db)
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.client.post(reverse('add_expense'), {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        self.assertIn(db_router.STICKY_COOKIE, self.client.cookies)
+        response = self.client.get(reverse('dashboard'))
+        self.assertIsNone(response.wsgi_request.read_db)
+
+    def test_replica_fragments_are_cached_briefly(self):
+        with mock.patch.object(fragment_cache.cache, 'aset', wraps=fragment_cache.cache.aset) as aset:
+            self.client.get(reverse('dashboard'))
+        self.assertTrue(aset.call_args_list)
+        self.assertTrue(all(call.args[2] == settings.DATABASE_STICKY_SECONDS for call in aset.call_args_list
+                            if call.args[0].startswith('frag:')))
+
+
+class JobQueueTests(SplitwiseTestCase):
+    def test_expense_writes_debounce_one_recalculation(self):
+        group = self.make_group(self.alice, self.bob)
+        self.add_group_expense(group, 10, alice=10)
+        self.add_group_expense(group, 20, bob=20)
+
+        job = Job.objects.get()
+        self.assertEqual((job.kind, job.status, job.payload), (jobs.RECALCULATE_SPLITS, Job.PENDING, {'group_id': group.id}))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)
+
+        # A manual request merges into the queued job and makes it due now
+        self.client.post(reverse('calculate_group_split', args=[group.id]))
+        self.assertEqual(Job.objects.count(), 1)
+        # and alice, who asked for it, can follow it
+        self.assertEqual(Job.objects.get().requested_by, self.alice)
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).status_code, 200)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.DONE, {'transfers': 1}))
+        self.assertEqual(GroupSplit.objects.get(group=group).amount, Decimal('5.00'))
+
+    @override_settings(JOBS_DEBOUNCE_MAX=60)
+    def test_debounce_is_capped(self):
+        job = jobs.schedule_split_recalculation(1)
+        Job.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(seconds=59))
+        job = jobs.schedule_split_recalculation(1)
+        self.assertLessEqual(job.run_after, timezone.now() + timedelta(seconds=1))
+
+    def test_running_job_releases_its_key(self):
+        first = jobs.schedule_split_recalculation(1, delay=0)
+        self.assertEqual(jobs.claim().id, first.id)
+        second = jobs.schedule_split_recalculation(1, delay=0)
+        self.assertNotEqual(first.id, second.id)
+
+    def test_failures_and_stale_jobs(self):
+        jobs.enqueue('no_such_task')
+        with self.assertLogs('core.jobs', 'ERROR'):
+            failed = jobs.run(jobs.claim())
+        self.assertEqual(failed.status, Job.FAILED)
+        self.assertIn('LookupError', failed.error)
+
+        stale = jobs.enqueue(jobs.RECALCULATE_SPLITS, {'group_id': 0})
+        jobs.claim()
+        Job.objects.filter(id=stale.id).update(started_at=timezone.now() - timedelta(days=1),
+                                               heartbeat_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Job.objects.get(id=stale.id).status, Job.DONE)
+
+    def test_long_job_reporting_progress_is_not_requeued(self):
+        job = jobs.enqueue(jobs.RECALCULATE_SPLITS, {'group_id': 0})
+        job = jobs.claim()
+        Job.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(days=1),
+                                             heartbeat_at=timezone.now() - timedelta(days=1))
+        token = jobs._current.set(job)
+        try:
+            jobs.report_progress({'step': 'shares', 'after': 10, 'deleted': {}})
+        finally:
+            jobs._current.reset(token)
+        self.assertEqual(jobs.requeue_stale(), 0)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.RUNNING)
+
+    def test_delete_group_runs_in_background(self):
+        group = self.make_group(self.alice, self.bob)
+        self.add_group_expense(group, 10, alice=10)
+        self.client.get(reverse('delete_group', args=[group.id]))
+        self.assertFalse(FriendGroup.objects.filter(id=group.id).exists())
+        self.assertTrue(FriendGroup.all_objects.filter(id=group.id).exists())
+
+        job = Job.objects.get(kind=jobs.DELETE_GROUP)
+        call_command('run_workers', once=True, stdout=StringIO())
+        self.assertFalse(FriendGroup.all_objects.filter(id=group.id).exists())
+        self.assertEqual(ledger.get_totals(self.bob), (Decimal('0'), Decimal('0')))
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).json()['status'], Job.DONE)
+
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).status_code, 404)
+
+
+@override_settings(PURGE_CHUNK_SIZE=2)
+class PurgeTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = self.make_group(self.alice, self.bob, self.carol)
+        for amount in (30, 60, 90):
+            self.add_group_expense(self.group, amount, alice=amount)
+        self.client.post(reverse('add_expense'), {'description': 'Taxi', 'amount': '10', 'friends': [self.bob.id]})
+        jobs.run_pending()
+
+    def test_delete_group_in_chunks(self):
+        self.client.get(reverse('delete_group', args=[self.group.id]))
+        self.assertEqual(self.client.get(reverse('group_detail', args=[self.group.id])).status_code, 404)
+
+        job = Job.objects.get(kind=jobs.DELETE_GROUP)
+        with CaptureQueriesContext(connection) as ctx:
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.progress['deleted']['shares'], 9)
+        # Shares went two at a time, never through the collector's cascade
+        self.assertEqual(sum(q['sql'].startswith('DELETE FROM "core_expenseshare"') for q in ctx.captured_queries), 5)
+
+        self.assertFalse(FriendGroup.all_objects.filter(id=self.group.id).exists())
+        for model in (Expense, GroupSplit, GroupBalance, TransactionHistory):
+            self.assertFalse(model.objects.filter(group_id=self.group.id).exists())
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(group_balances.verify(), [])
+
+    def test_interrupted_purge_resumes(self):
+        saved = []
+
+        def report(progress):
+            saved.append(progress)
+            if len(saved) == 3:
+                raise RuntimeError("worker died")
+
+        with self.assertRaises(RuntimeError):
+            expenses.clear_user_transactions(self.alice, report=report)
+        # Every finished chunk stays deleted and out of the balances
+        self.assertEqual(ExpenseShare.objects.count(), 11 - 6)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(group_balances.verify(), [])
+
+        self.assertEqual(expenses.clear_user_transactions(self.alice, progress=saved[-1], report=saved.append), 4)
+        self.assertEqual(saved[-1]['deleted'], {'shares': 11, 'expense_friends': 1, 'expenses': 4})
+        self.assertFalse(ExpenseShare.objects.exists())
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(group_balances.verify(), [])
+
+    def test_resumed_purge_catches_rows_added_since(self):
+        saved = []
+
+        def report(progress):
+            saved.append(progress)
+            if progress['step'] == 'expenses':
+                raise RuntimeError("worker died")
+
+        with self.assertRaises(RuntimeError):
+            expenses.clear_user_transactions(self.alice, report=report)
+        # A new expense (and its shares) lands after the shares step has finished
+        with self.captureOnCommitCallbacks(execute=True):
+            expenses.create_personal_expense(self.alice, 'Cab', 2000, [self.bob.id])
+
+        expenses.clear_user_transactions(self.alice, progress=saved[-1])
+        connection.check_constraints()
+        self.assertFalse(Expense.objects.filter(payer=self.alice).exists())
+        self.assertFalse(ExpenseShare.objects.exists())
+        self.assertEqual(ledger.verify(), [])
+
+
+class AddGroupExpenseTests(SplitwiseTestCase):
+    def test_writes_shares_and_history(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 90, alice=60, bob=30)
+
+        shares = {s.user_id: s.amount for s in ExpenseShare.objects.filter(expense__group=group)}
+        self.assertEqual(shares, {self.alice.id: Decimal('30.00'), self.bob.id: Decimal('0.00'), self.carol.id: Decimal('-30.00')})
+        history = TransactionHistory.objects.filter(group=group)
+        self.assertEqual(history.count(), 3)
+        self.assertEqual(history.get(user=self.alice).amount, Decimal('90.00'))
+        self.assertEqual(history.get(user=self.carol).related_user, self.alice)
+
+    def test_query_count_independent_of_group_size(self):
+        def count_queries(group):
+            # Warm up so both runs update existing ledger rows
+            self.add_group_expense(group, 100, alice=100)
+            with CaptureQueriesContext(connection) as ctx:
+                self.add_group_expense(group, 100, alice=100)
+            return len(ctx.captured_queries)
+
+        small = count_queries(self.make_group(self.alice, self.bob))
+        others = [User.objects.create_user(username=f'member{i}') for i in range(40)]
+        large = count_queries(self.make_group(self.alice, self.bob, *others))
+        self.assertEqual(small, large)
+
+    def test_shares_add_up_exactly(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, 100, alice=100)
+        self.client.post(reverse('add_expense'), {
+            'description': 'Snacks', 'amount': '10', 'friends': [self.bob.id, self.carol.id],
+        })
+        for expense in Expense.objects.all():
+            self.assertEqual(expense.shares.aggregate(total=Sum('amount'))['total'], Decimal('0'))
+
+    def test_shares_add_up_exactly_in_paise(self):
+        # Summed in Python, so no database float arithmetic can hide a stray paisa
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.add_group_expense(group, '100.01', alice='100.01')
+        amounts = ExpenseShare.objects.values_list('amount', flat=True)
+        self.assertEqual(sum(money.to_paise(amount) for amount in amounts), 0)
+
+    def test_percentage_split(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        data = {'description': 'Rent', 'amount': '1000', 'split_type': 'percent',
+                f'paid_{self.alice.id}': '1000',
+                f'split_{self.alice.id}': '50', f'split_{self.bob.id}': '33.33', f'split_{self.carol.id}': '16.67'}
+        self.client.post(reverse('add_group_expense', args=[group.id]), data)
+        shares = dict(ExpenseShare.objects.values_list('user__username', 'amount'))
+        self.assertEqual(shares, {'alice': Decimal('500.00'), 'bob': Decimal('-333.30'), 'carol': Decimal('-166.70')})
+
+        data[f'split_{self.carol.id}'] = '10'
+        response = self.client.post(reverse('add_group_expense', args=[group.id]), data, follow=True)
+        self.assertContains(response, 'Percentages must add up to 100')
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_bad_amounts_are_reported_not_raised(self):
+        group = self.make_group(self.alice, self.bob)
+        for amount in ('Infinity', '1e400'):
+            response = self.client.post(reverse('add_group_expense', args=[group.id]),
+                                        {'description': 'Boat', 'amount': amount, f'paid_{self.alice.id}': amount})
+            self.assertRedirects(response, reverse('group_detail', args=[group.id]), fetch_redirect_response=False)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_leftover_paise_go_to_the_lowest_member_id(self):
+        group = self.make_group(self.carol, self.bob, self.alice)
+        self.add_group_expense(group, '0.10', alice='0.10')
+        shares = dict(ExpenseShare.objects.values_list('user_id', 'amount'))
+        self.assertEqual([shares[u.id] for u in (self.alice, self.bob, self.carol)],
+                         [Decimal('0.06'), Decimal('-0.03'), Decimal('-0.03')])
+
+
+class FriendGraphTests(SplitwiseTestCase):
+    def test_friend_ids_single_query_and_cached(self):
+        Friendship.objects.create(user1=self.alice, user2=self.bob)
+        Friendship.objects.create(user1=self.carol, user2=self.alice)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(friends.friend_ids(self.alice), {self.bob.id, self.carol.id})
+            self.assertEqual(friends.friend_ids(self.alice), {self.bob.id, self.carol.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(friends.friend_ids(User(id=self.alice.id)), {self.bob.id, self.carol.id})
+
+    def test_accepting_request_invalidates_cache(self):
+        self.assertEqual(friends.friend_ids(self.bob), frozenset())
+        friend_request = FriendRequest.objects.create(sender=self.bob, receiver=self.alice)
+        self.client.post(reverse('handle_friend_request', args=[friend_request.id, 'accept']))
+
+        bob = User.objects.get(id=self.bob.id)
+        self.assertEqual(friends.friend_ids(bob), {self.alice.id})
+        response = self.client.get(reverse('friends_list'))
+        self.assertEqual([u.username for u in response.context['friends']], ['bob'])
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([u.username for u in response.context['friends']], ['bob'])
+
+    def test_create_group_only_adds_friends(self):
+        Friendship.objects.create(user1=self.alice, user2=self.bob)
+        self.client.post(reverse('create_group'), {'name': 'Flat', 'friends': [self.bob.id, self.carol.id]})
+        group = FriendGroup.objects.get(name='Flat')
+        self.assertEqual(set(group.members.values_list('username', flat=True)), {'alice', 'bob'})
+
+
+class UserSearchTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='dave', first_name='Alan', last_name='Turing', email='turing@example.com')
+        for i in range(25):
+            User.objects.create_user(username=f'zed{i:02}')
+
+    def found(self, query, **kwargs):
+        users, total = search.search_users(query, **kwargs)
+        return [u.username for u in users], total
+
+    def test_prefix_search_across_fields(self):
+        usernames, total = self.found('al')
+        self.assertEqual((sorted(usernames), total), (['alice', 'dave'], 2))
+        self.assertEqual(self.found('turi'), (['dave'], 1))
+        # Email addresses are not searchable
+        self.assertEqual(self.found('turing@exa'), ([], 0))
+        self.assertEqual(self.found('alan tur'), (['dave'], 1))
+        self.assertEqual(self.found('"*)('), ([], 0))
+
+    def test_index_follows_user_changes(self):
+        self.bob.first_name = 'Roberto'
+        self.bob.save()
+        self.assertEqual(self.found('robert'), (['bob'], 1))
+        self.bob.delete()
+        self.assertEqual(self.found('robert'), ([], 0))
+
+    def test_paginated_view(self):
+        response = self.client.get(reverse('search_users'), {'q': 'zed', 'page': 2})
+        self.assertEqual(response.context['total'], 25)
+        self.assertEqual(len(response.context['users']), 5)
+        self.assertTrue(response.context['has_previous'])
+        self.assertFalse(response.context['has_next'])
+
+    def test_search_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('search_users'), {'q': 'Turing'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotContains(response, 'turing@example.com', status_code=302)
+
+    def test_emails_only_shown_for_friends_and_co_members(self):
+        for user, email in ((self.bob, 'bob@example.com'), (self.carol, 'carol@example.com')):
+            user.email = email
+            user.save()
+        dave = User.objects.get(username='dave')
+        Friendship.objects.create(user1=self.alice, user2=self.bob)
+        friends.invalidate(self.alice, self.bob)
+        group = self.make_group(self.alice, dave)
+
+        response = self.client.get(reverse('search_users'), {'q': 'turing'})
+        self.assertContains(response, 'turing@example.com')
+        response = self.client.get(reverse('search_users'), {'q': 'bob'})
+        self.assertContains(response, 'bob@example.com')
+        response = self.client.get(reverse('search_users'), {'q': 'carol'})
+        self.assertContains(response, 'carol')
+        self.assertNotContains(response, 'carol@example.com')
+
+        # A deleted group no longer makes its members contacts
+        FriendGroup.objects.filter(id=group.id).update(deleted_at=timezone.now())
+        response = self.client.get(reverse('search_users'), {'q': 'turing'})
+        self.assertNotContains(response, 'turing@example.com')
+
+    def test_typeahead_is_cached(self):
+        response = self.client.get(reverse('search_typeahead'), {'q': 'Turing'})
+        self.assertEqual(response.json()['results'], [{'id': User.objects.get(username='dave').id, 'username': 'dave', 'name': 'Alan Turing'}])
+        # Only the session and the signed-in user are read, not the search index
+        with self.assertNumQueries(2):
+            self.client.get(reverse('search_typeahead'), {'q': 'turing'})
+
+    def test_typeahead_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('search_typeahead'), {'q': 'Turing'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotContains(response, 'Turing', status_code=302)
+
+    def test_database_backend(self):
+        search.get_backend.cache_clear()
+        self.addCleanup(search.get_backend.cache_clear)
+        with self.settings(SEARCH_BACKEND='core.search.DatabaseSearchBackend'):
+            self.assertEqual(self.found('turi'), (['dave'], 1))
+            self.assertEqual(self.found('zed', page=3, page_size=10)[0], ['zed20', 'zed21', 'zed22', 'zed23', 'zed24'])
+
+
+class ImportExpensesTests(SplitwiseTestCase):
+    def test_import_csv_matches_views(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        data = (
+            "description,amount,payer,friends,group,paid\n"
+            "Dinner,90,alice,bob;carol,,\n"
+            f"Hotel,300,alice,,{group.id},alice:200;bob:100\n"
+            "Broken,abc,alice,bob,,\n"
+            "Ghost,10,nobody,bob,,\n"
+        )
+        result = importer.import_file(StringIO(data), 'csv', chunk_size=2)
+
+        self.assertEqual((result.rows, result.imported, result.error_count), (4, 2, 2))
+        self.assertEqual([line for line, _ in result.errors], [4, 5])
+        dinner = Expense.objects.get(description='Dinner')
+        self.assertEqual(set(dinner.friends.values_list('username', flat=True)), {'bob', 'carol'})
+        self.assertEqual(ExpenseShare.objects.get(expense=dinner, user=self.bob).amount, Decimal('-30.00'))
+        hotel = Expense.objects.get(description='Hotel')
+        self.assertEqual(hotel.payer, self.alice)
+        self.assertEqual(ExpenseShare.objects.get(expense=hotel, user=self.carol).amount, Decimal('-100.00'))
+        self.assertEqual(TransactionHistory.objects.filter(group=group).count(), 3)
+        self.assertEqual(ledger.verify(), [])
+
+    def test_import_command_reports_throughput(self):
+        lines = ['{"description": "Cab %d", "amount": "12.50", "payer": "bob", "friends": ["carol"]}' % i for i in range(25)]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write("\n".join(lines))
+        self.addCleanup(os.unlink, f.name)
+
+        out = StringIO()
+        call_command('import_expenses', f.name, chunk_size=10, stdout=out, stderr=StringIO())
+        self.assertIn('Imported 25 of 25 rows', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(ledger.get_totals(self.carol)[0], Decimal('156.25'))
+
+    def test_upload_only_imports_rows_of_uploader(self):
+        upload = SimpleUploadedFile('ledger.csv', (
+            "description,amount,payer,friends\n"
+            "Mine,20,alice,bob\n"
+            "Theirs,20,bob,carol\n"
+        ).encode())
+        response = self.client.post(reverse('import_expenses'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Expense.objects.values_list('description', flat=True)), ['Mine'])
+        self.assertEqual(response.context['errors'], [(3, 'You are not part of this expense')])
+
+    def test_non_utf8_upload_is_reported_not_raised(self):
+        upload = SimpleUploadedFile('ledger.csv', (
+            "description,amount,payer,friends\n"
+            "Caf\u00e9,20,alice,bob\n"
+        ).encode('latin-1'))
+        response = self.client.post(reverse('import_expenses'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(response.context['errors'], [(1, 'File is not valid UTF-8; nothing from this line on was imported')])
+
+    def test_decode_error_keeps_earlier_chunks(self):
+        rows = ((1, {'description': 'Lunch', 'amount': '20', 'payer': 'alice', 'friends': 'bob'}),
+                (2, {'description': 'Taxi', 'amount': '10', 'payer': 'alice', 'friends': 'bob'}))
+
+        def read():
+            yield from rows
+            raise UnicodeDecodeError('utf-8', b'\xe9', 0, 1, 'invalid continuation byte')
+
+        result = importer.Importer(chunk_size=1).run(read())
+        self.assertEqual((result.rows, result.imported), (2, 2))
+        self.assertEqual([line for line, _ in result.errors], [3])
+        self.assertEqual(ledger.verify(), [])
+
+
+class TransactionHistoryTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        group = self.make_group(self.alice, self.bob)
+        TransactionHistory.objects.bulk_create(
+            TransactionHistory(user=self.alice, transaction_type='expense', amount=Decimal(i), group=group,
+                               related_user=self.bob, description=f'Entry {i}')
+            for i in range(120)
+        )
+
+    def test_keyset_pages_cover_history_without_n_plus_one(self):
+        seen, cursor, page_queries = [], None, set()
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('transaction_history'), {'cursor': cursor} if cursor else {})
+            page_queries.add(len(ctx.captured_queries))
+            seen.extend(entry.id for entry in response.context['history'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+
+        expected = list(TransactionHistory.objects.filter(user=self.alice).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        # The last page also reads the archive once the live rows run out
+        self.assertLessEqual(max(page_queries) - min(page_queries), 1)
+
+    def test_streaming_exports(self):
+        response = self.client.get(reverse('export_transaction_history'), {'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'date,type,description,amount,group,with,settled_at')
+        self.assertEqual(len(lines), 121)
+
+        response = self.client.get(reverse('export_transaction_history'), {'format': 'json'})
+        records = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(records), 120)
+        self.assertEqual(records[0]['with'], 'bob')
+        self.assertEqual(records[0]['amount'], '119.00')
+
+
+class SeedTests(TestCase):
+    def test_seed_is_consistent(self):
+        user_ids, group_ids = seed.seed(users=20, groups=3, expenses=150, batch_size=40)
+        self.assertEqual(len(user_ids), 20)
+        self.assertEqual(Expense.objects.count(), 150)
+        # SQLite sums decimals as floats, so compare in whole paise
+        self.assertEqual(money.to_paise(ExpenseShare.objects.aggregate(total=Sum('amount'))['total']), 0)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(group_balances.verify(), [])
+
+    def test_power_law_friend_graph(self):
+        user_ids, _ = seed.seed(users=300, friends_per_user=6, groups=2, expenses=100,
+                                friend_graph=seed.POWER_LAW)
+        degree = dict.fromkeys(user_ids, 0)
+        for a, b in Friendship.objects.values_list('user1_id', 'user2_id'):
+            degree[a] += 1
+            degree[b] += 1
+        degrees = sorted(degree.values())
+        self.assertGreaterEqual(degrees[0], 3)
+        self.assertGreater(degrees[-1], 5 * degrees[len(degrees) // 2])
+
+        # Personal expenses are only shared between friends
+        pairs = set(Friendship.objects.values_list('user1_id', 'user2_id'))
+        for payer, user in ExpenseShare.objects.filter(expense__group=None).exclude(
+                user_id=F('expense__payer_id')).values_list('expense__payer_id', 'user_id'):
+            self.assertIn((min(payer, user), max(payer, user)), pairs)
+
+
+class BenchmarkTests(TestCase):
+    def test_measure_covers_views_and_algorithms(self):
+        seed.seed(users=30, groups=3, expenses=200, friend_graph=seed.POWER_LAW)
+        results = benchmark.measure(repeat=1)
+        self.assertLessEqual({'split_calculation', 'dashboard_balances', 'history_page', 'view_dashboard',
+                              'view_group_detail', 'view_transaction_history'}, set(results))
+        self.assertTrue(all(result['median_ms'] >= 0 for result in results.values()))
+
+    def test_compare_flags_only_real_regressions(self):
+        baseline = {'small': {'a': {'median_ms': 10.0}, 'b': {'median_ms': 0.2}, 'c': {'median_ms': 10.0}}}
+        results = {'small': {'a': {'median_ms': 14.0}, 'b': {'median_ms': 0.9}, 'c': {'median_ms': 11.0},
+                             'new': {'median_ms': 50.0}}}
+        self.assertEqual(benchmark.compare(results, baseline), [('small', 'a', 10.0, 14.0)])
+
+
+
+class BenchmarkIndexesTests(TransactionTestCase):
+    def test_suite_uses_a_private_cache(self):
+        self.assertEqual(settings.CACHES, settings.TEST_CACHES)
+
+    def test_command_measures_with_and_without_the_indexes(self):
+        # Run against the test database the runner already set up
+        path = 'core.management.commands.benchmark_indexes.'
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch(path + 'setup_test_environment'), mock.patch(path + 'teardown_test_environment'), \
+                mock.patch(path + 'setup_databases'), mock.patch(path + 'teardown_databases'):
+            output = os.path.join(tmp, 'report.json')
+            call_command('benchmark_indexes', users=20, groups=2, expenses=100, repeat=1, output=output,
+                         stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertIn('dashboard_pair_nets', report['queries'])
+        self.assertEqual(set(report['views']), {'dashboard', 'group_detail', 'transaction_history', 'friends_list'})
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, ExpenseShare._meta.db_table)
+        self.assertIn('share_user_open_idx', indexes)
+
+class MoneyTests(SimpleTestCase):
+    def test_conversion(self):
+        self.assertEqual(money.to_paise('12.34'), 1234)
+        self.assertEqual(money.to_paise(Decimal('-0.005')), -1)
+        self.assertEqual(money.from_paise(-1234), Decimal('-12.34'))
+        with self.assertRaises(money.SplitError):
+            money.to_paise('ten')
+
+    def test_remainder_distribution_is_exact_and_deterministic(self):
+        self.assertEqual(money.split(10000, money.EQUAL, n=3), [3334, 3333, 3333])
+        self.assertEqual(money.split(-100, money.EQUAL, n=3), [-34, -33, -33])
+        self.assertEqual(money.split(100, money.SHARES, [1, 1, 1]), [34, 33, 33])
+        self.assertEqual(money.split(1000, money.SHARES, [2, 1, 0]), [667, 333, 0])
+        self.assertEqual(money.split(999, money.PERCENT, ['50', '25', '25']), [499, 250, 250])
+        for total in range(1, 200):
+            self.assertEqual(sum(money.split(total, money.SHARES, [3, 5, 7])), total)
+
+    def test_exact_split_must_match(self):
+        self.assertEqual(money.split(1000, money.EXACT, ['2.50', '7.50']), [250, 750])
+        with self.assertRaises(money.SplitError):
+            money.split(1000, money.EXACT, ['2.50', '7.00'])
+        with self.assertRaises(money.SplitError):
+            money.split(1000, money.SHARES, [0, 0])
+
+    def test_rejects_non_finite_and_oversized_amounts(self):
+        for value in ('Infinity', '-inf', 'NaN', Decimal('Infinity'), '1e400', '100000000.00'):
+            with self.assertRaises(money.SplitError):
+                money.to_paise(value)
+        self.assertEqual(money.to_paise('99999999.99'), money.MAX_PAISE)
+        self.assertEqual(money.to_paise('100000000.00', limit=None), 10 ** 10)
+
+    def test_split_parts_cannot_be_negative(self):
+        with self.assertRaises(money.SplitError):
+            money.split(1000, money.EXACT, ['15.00', '-5.00'])
+        with self.assertRaises(money.SplitError):
+            money.split(1000, money.PERCENT, ['150', '-50'])
+
+
+class SimplifyEngineTests(SimpleTestCase):
+    balances = [10000, -300, -700, 500, -500, 1000, -10000]
+
+    def settle(self, balances, transfers):
+        result = list(balances)
+        for from_slot, to_slot, amount in transfers:
+            self.assertGreater(amount, 0)
+            result[from_slot] += amount
+            result[to_slot] -= amount
+        return result
+
+    def test_every_strategy_settles_exactly(self):
+        for strategy in simplify.STRATEGIES:
+            with self.subTest(strategy=strategy):
+                transfers = simplify.simplify(self.balances, strategy=strategy)
+                self.assertEqual(self.settle(self.balances, transfers), [0] * len(self.balances))
+
+    def test_optimal_uses_fewest_transfers(self):
+        balances = [1000, -300, -700, 500, -500]
+        self.assertEqual(len(simplify.simplify(balances, simplify.GREEDY)), 4)
+        self.assertEqual(len(simplify.simplify(balances, simplify.OPTIMAL)), 3)
+
+    def test_falls_back_to_greedy(self):
+        large = [100 + i for i in range(16)]
+        large.append(-sum(large))
+        self.assertEqual(simplify.simplify(large, simplify.OPTIMAL, time_budget=0), simplify.greedy(large))
+        self.assertEqual(simplify.simplify([1, 2, -2], simplify.OPTIMAL), simplify.greedy([1, 2, -2]))
+
+        many = [i + 1 for i in range(simplify.MAX_OPTIMAL_MEMBERS)] + [-1000 - i for i in range(4)]
+        many.append(-sum(many))
+        self.assertEqual(simplify.simplify(many, simplify.OPTIMAL), simplify.greedy(many))
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            simplify.simplify(self.balances, strategy='random')
+
+
+class ApiTests(SplitwiseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.api_client(self.alice)
+        Friendship.objects.create(user1=self.alice, user2=self.bob)
+
+    def api_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def post(self, url, data, **headers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post(url, data, format='json', **headers)
+
+    def test_requires_jwt(self):
+        self.assertEqual(APIClient().get('/api/balances/').status_code, 401)
+
+    def test_create_and_list_expenses(self):
+        response = self.post('/api/expenses/', {'description': 'Dinner', 'amount': '90.00', 'friends': [self.bob.id]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['amount'], '90.00')
+
+        response = self.api_client(self.bob).get('/api/expenses/?fields=description,amount')
+        self.assertEqual(response.json()['results'], [{'description': 'Dinner', 'amount': '90.00'}])
+
+        detail = self.api.get(f"/api/expenses/{Expense.objects.get().id}/").json()
+        self.assertEqual({share['username']: share['amount'] for share in detail['shares']},
+                         {'alice': '45.00', 'bob': '-45.00'})
+
+    def test_rejects_non_friends_and_unknown_fields(self):
+        response = self.post('/api/expenses/', {'description': 'Dinner', 'amount': '90', 'friends': [self.carol.id]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get('/api/expenses/?fields=secret').status_code, 400)
+
+    def test_etag_until_balances_change(self):
+        first = self.api.get('/api/balances/')
+        self.assertEqual(first.json()['net'], '0.00')
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.api.get('/api/balances/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertFalse(any('core_pairbalance' in q['sql'] for q in ctx.captured_queries))
+
+        self.post('/api/expenses/', {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        changed = self.api.get('/api/balances/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['counterparties'], [
+            {'counterparty_id': self.bob.id, 'counterparty_name': 'bob', 'owes': '0.00', 'owed': '45.00', 'net': '45.00'},
+        ])
+
+    def test_group_expense_split_and_settle(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        response = self.post(f'/api/groups/{group.id}/expenses/', {
+            'description': 'Hotel', 'amount': '90', 'paid': {str(self.alice.id): '90'},
+            'split_type': 'exact', 'split': {str(self.alice.id): '30', str(self.bob.id): '50', str(self.carol.id): '10'},
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExpenseShare.objects.get(user=self.bob).amount, Decimal('-50.00'))
+
+        self.client.post(reverse('calculate_group_split', args=[group.id]))
+        jobs.run_pending()
+        splits = self.api.get(f'/api/groups/{group.id}/splits/?fields=from_name,amount').json()['results']
+        self.assertEqual(sorted((s['from_name'], s['amount']) for s in splits), [('bob', '50.00'), ('carol', '10.00')])
+
+        share = ExpenseShare.objects.get(user=self.bob)
+        self.api = self.api_client(self.bob)
+        self.assertEqual(self.post('/api/settlements/', {'share': share.id}).status_code, 201)
+        self.assertEqual(self.post('/api/settlements/', {'share': share.id}).status_code, 200)
+        self.assertEqual(ledger.get_totals(self.bob), (Decimal('0'), Decimal('0')))
+        self.assertEqual(self.api.get('/api/settlements/?fields=amount').json()['results'], [{'amount': '-50.00'}])
+
+    def test_split_preview_matches_adding_the_expense(self):
+        group = self.make_group(self.alice, self.bob, self.carol)
+        self.post(f'/api/groups/{group.id}/expenses/', {
+            'description': 'Hotel', 'amount': '90', 'paid': {str(self.alice.id): '90'},
+        })
+        url = f'/api/groups/{group.id}/expenses/preview/'
+        what_if = {'amount': '60', 'paid': {str(self.bob.id): '60'}, 'members': [self.alice.id, self.bob.id]}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post(url, {'expenses': [what_if]})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) for q in ctx.captured_queries))
+        self.assertEqual(response.json(), {
+            'balances': [{'user_id': self.alice.id, 'net': '30.00'}, {'user_id': self.bob.id, 'net': '0.00'},
+                         {'user_id': self.carol.id, 'net': '-30.00'}],
+            'splits': [{'from_user_id': self.carol.id, 'to_user_id': self.alice.id, 'amount': '30.00'}],
+        })
+        self.assertEqual(Expense.objects.count(), 1)
+
+        self.post(f'/api/groups/{group.id}/expenses/', {
+            'description': 'Dinner', 'amount': '60', 'paid': {str(self.bob.id): '60'},
+            'split_type': 'exact', 'split': {str(self.alice.id): '30', str(self.bob.id): '30'},
+        })
+        expenses.recalculate_group_splits(group)
+        self.assertEqual(list(GroupSplit.objects.values_list('from_user_id', 'to_user_id', 'amount')),
+                         [(self.carol.id, self.alice.id, Decimal('30.00'))])
+
+        self.assertEqual(self.post(url, {'expenses': [dict(what_if, members=[0])]}).status_code, 400)
+        self.assertEqual(self.post(url, {'expenses': [dict(what_if, amount='61')]}).status_code, 400)
+
+    def test_group_report(self):
+        group = self.make_group(self.alice, self.bob)
+        self.post(f'/api/groups/{group.id}/expenses/', {
+            'description': 'Hotel', 'amount': '90', 'paid': {str(self.alice.id): '90'},
+        })
+        report = self.api.get(f'/api/groups/{group.id}/report/').json()
+        self.assertEqual(report['debts'], [{'from_user_id': self.bob.id, 'to_user_id': self.alice.id, 'amount': '45.00'}])
+        self.assertEqual([(m['user_id'], m['net']) for m in report['members']],
+                         [(self.alice.id, '45.00'), (self.bob.id, '-45.00')])
+        self.assertEqual(self.api_client(self.carol).get(f'/api/groups/{group.id}/report/').status_code, 404)
+
+    def test_batch_settlement_with_idempotency_key(self):
+        for _ in range(3):
+            self.post('/api/expenses/', {'description': 'Dinner', 'amount': '100', 'friends': [self.bob.id]})
+        share_ids = list(ExpenseShare.objects.filter(user=self.bob).values_list('id', flat=True))
+        response = self.post('/api/settlements/', {'shares': share_ids[:2]}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'shares': share_ids[:2], 'amount': '100.00', 'replayed': False})
+        response = self.post('/api/settlements/', {'shares': share_ids[:2]}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual((response.status_code, response.json()['replayed']), (200, True))
+
+        expense = Expense.objects.create(payer=self.carol, amount=10, description='Taxi')
+        carol_share = ExpenseShare.objects.create(expense=expense, user=self.bob, amount=Decimal('-10'))
+        self.assertEqual(self.post('/api/settlements/', {'shares': [carol_share.id]}).status_code, 403)
+        self.assertEqual(self.post('/api/settlements/', {'share': 1, 'with_user': 2}).status_code, 400)
+
+    def test_balance_drill_down(self):
+        self.post('/api/expenses/', {'description': 'Dinner', 'amount': '100', 'friends': [self.bob.id]})
+        self.post('/api/expenses/', {'description': 'Cab', 'amount': '30', 'friends': [self.bob.id]})
+        balances = self.api.get('/api/balances/?fields=counterparty_id,net').json()
+        self.assertEqual(balances['counterparties'], [{'counterparty_id': self.bob.id, 'net': '65.00'}])
+
+        page = self.api.get(f'/api/balances/{self.bob.id}/shares/?page_size=1&fields=description,net').json()
+        self.assertEqual(page['results'], [{'description': 'Cab', 'net': '15.00'}])
+        page = self.api.get(page['next']).json()
+        self.assertEqual(page['results'], [{'description': 'Dinner', 'net': '50.00'}])
+        self.assertEqual(self.api.get(f'/api/balances/{self.carol.id}/shares/').json()['results'], [])
+
+    def test_group_endpoints_are_members_only(self):
+        group = self.make_group(self.bob, self.carol)
+        self.assertEqual(self.api.get(f'/api/groups/{group.id}/expenses/').status_code, 404)
+
+    def test_cursor_pagination(self):
+        for i in range(5):
+            self.post('/api/expenses/', {'description': f'E{i}', 'amount': '10', 'friends': [self.bob.id]})
+        page = self.api.get('/api/expenses/?page_size=2&fields=description').json()
+        self.assertEqual([row['description'] for row in page['results']], ['E4', 'E3'])
+        page = self.api.get(page['next']).json()
+        self.assertEqual([row['description'] for row in page['results']], ['E2', 'E1'])
+
+    def test_payload_smaller_than_dashboard(self):
+        self.post('/api/expenses/', {'description': 'Dinner', 'amount': '90', 'friends': [self.bob.id]})
+        html = self.client.get(reverse('dashboard')).content
+        self.assertLess(len(self.api.get('/api/balances/').content) * 20, len(html))
+
+
+class AsyncViewTests(SplitwiseTestCase):
+    async def test_read_views_render_under_async_client(self):
+        group = await FriendGroup.objects.acreate(name='Trip')
+        await group.members.aadd(self.alice, self.bob)
+        await self.async_client.aforce_login(self.alice)
+        for url in (reverse('dashboard'), reverse('group_detail', args=[group.id]), reverse('transaction_history'),
+                    reverse('friends_list'), reverse('search_users') + '?q=bo'):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(response, 'bob')
+
+    async def test_anonymous_is_redirected_to_login(self):
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('login', response['Location'])
+
+
+class LoadTestTests(SimpleTestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(samples, 50), 51)
+        self.assertEqual(loadtest.percentile(samples, 99), 99)
+        self.assertIsNone(loadtest.percentile([], 99))
+
+    def test_run_against_local_server(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200 if self.path == '/ok' else 404)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            result = loadtest.run(f'http://127.0.0.1:{server.server_port}', ['/ok', '/missing'],
+                                  concurrency=2, duration=0.3)
+        finally:
+            server.shutdown()
+        self.assertGreater(result['requests'], 0)
+        self.assertGreater(result['errors'], 0)
+        self.assertIsNotNone(result['p99_ms'])
@@ -1,7 +1,18 @@
-from django.urls import path
-from .views import HomeView, LoginView, LogoutView, DashboardView, RegisterView, send_friend_request, handle_friend_request,list_friends, search_users,create_group, group_detail, delete_group, add_expense, add_group_expense, calculate_group_split, clear_all_transactions, clear_group_splits, settle_expense, transaction_history
+from django.urls import include, path
+from rest_framework.routers import SimpleRouter
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from . import api
+from .views import HomeView, LoginView, LogoutView, DashboardView, RegisterView, send_friend_request, handle_friend_request,list_friends, search_users,create_group, group_detail, delete_group, add_expense, add_group_expense, calculate_group_split, clear_all_transactions, clear_group_splits, settle_expense, settle_with_friend, balance_detail, transaction_history, export_transaction_history, import_expenses, search_typeahead, cache_stats, metrics_view, job_status
 from django.contrib.auth import views as auth_views
 
+router = SimpleRouter()
+router.register('expenses', api.ExpenseViewSet, basename='api-expense')
+router.register(r'groups/(?P<group_id>[0-9]+)/expenses', api.GroupExpenseViewSet, basename='api-group-expense')
+router.register(r'groups/(?P<group_id>[0-9]+)/splits', api.SplitViewSet, basename='api-split')
+router.register(r'groups/(?P<group_id>[0-9]+)/report', api.GroupReportViewSet, basename='api-group-report')
+router.register('balances', api.BalanceViewSet, basename='api-balance')
+router.register(r'balances/(?P<counterparty_id>[0-9]+)/shares', api.BalanceShareViewSet, basename='api-balance-share')
+router.register('settlements', api.SettlementViewSet, basename='api-settlement')
 
 
 urlpatterns = [
@@ -13,6 +24,7 @@ urlpatterns = [
     path('send_friend_request/<int:receiver_id>/', send_friend_request, name='send_friend_request'),
     path('handle_friend_request/<int:request_id>/<str:action>/', handle_friend_request, name='handle_friend_request'),
     path('search/', search_users, name='search_users'),
+    path('search/typeahead/', search_typeahead, name='search_typeahead'),
     path('friends/', list_friends, name='friends_list'),
     path("create-group/", create_group, name="create_group"),
     path('groups/<int:group_id>/add_expense/', add_group_expense, name='add_group_expense'),
@@ -24,6 +36,16 @@ urlpatterns = [
     path('clear-all-transactions/', clear_all_transactions, name='clear_all_transactions'),
     path('group/<int:group_id>/clear_splits/', clear_group_splits, name='clear_group_splits'),
     path('settle/<int:share_id>/', settle_expense, name='settle_expense'),
-    path('history/', transaction_history, name='transaction_history')
+    path('settle/friend/<int:user_id>/', settle_with_friend, name='settle_with_friend'),
+    path('balances/<int:user_id>/', balance_detail, name='balance_detail'),
+    path('history/', transaction_history, name='transaction_history'),
+    path('history/export/', export_transaction_history, name='export_transaction_history'),
+    path('import/', import_expenses, name='import_expenses'),
+    path('cache/stats/', cache_stats, name='cache_stats'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('jobs/<int:job_id>/', job_status, name='job_status'),
+    path('api/token/', TokenObtainPairView.as_view(), name='api_token'),
+    path('api/token/refresh/', TokenRefreshView.as_view(), name='api_token_refresh'),
+    path('api/', include(router.urls)),
 
 ]
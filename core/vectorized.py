@@ -0,0 +1,191 @@
+"""
+Vectorized balance math for very large groups and reports.
+
+The running balances (core/ledger.py, core/group_balances.py) answer the
+everyday questions with a few rows each. Reports that need the whole share
+history of a group instead load it once as parallel integer columns (user,
+payer, amount in paise, settled) through values_list().iterator(), then
+fold the columns into per-member nets, a member-by-member debt matrix and
+per-member totals.
+
+NumPy is optional. When it is installed the folds run as np.add.at and
+np.bincount over int64 arrays; without it the same functions run as plain
+loops over the same columns. Both paths work in integer paise only, so they
+return identical results; pass use_numpy=False to force the pure Python
+path.
+"""
+from . import money
+from .models import ExpenseShare, GroupCheckpoint
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 5000
+
+
+class ShareColumns:
+    """Share rows as parallel columns: user ids, payer ids, amounts in paise and settled flags (0/1)."""
+
+    def __init__(self, user_ids, payer_ids, amounts, settled):
+        self.user_ids = user_ids
+        self.payer_ids = payer_ids
+        self.amounts = amounts
+        self.settled = settled
+
+    @classmethod
+    def load(cls, queryset, chunk_size=CHUNK_SIZE):
+        user_ids, payer_ids, amounts, settled = [], [], [], []
+        rows = queryset.values_list('user_id', 'expense__payer_id', 'amount', 'settled').iterator(chunk_size=chunk_size)
+        for user_id, payer_id, amount, is_settled in rows:
+            user_ids.append(user_id)
+            payer_ids.append(payer_id)
+            amounts.append(money.to_paise(amount))
+            settled.append(int(is_settled))
+        return cls(user_ids, payer_ids, amounts, settled)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def arrays(self):
+        return tuple(np.asarray(column, dtype=np.int64)
+                     for column in (self.user_ids, self.payer_ids, self.amounts, self.settled))
+
+
+def _use_numpy(use_numpy):
+    return np is not None and use_numpy is not False
+
+
+def engine(use_numpy=None):
+    return 'numpy' if _use_numpy(use_numpy) else 'python'
+
+
+def _np_slots(member_ids, ids):
+    """Member slot of every id in ``ids``, and a mask of the ids that belong to a member."""
+    members = np.asarray(member_ids, dtype=np.int64)
+    order = np.argsort(members, kind='stable')
+    if not len(members):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(members[order], ids), len(members) - 1)
+    return order[pos], members[order][pos] == ids
+
+
+def member_nets(columns, member_ids, use_numpy=None):
+    """
+    Each member's net in paise, in ``member_ids`` order, as GroupBalance
+    counts it: an unsettled share counts for its member, a settled one for
+    the payer. Shares of non-members are left out.
+    """
+    n = len(member_ids)
+    if _use_numpy(use_numpy):
+        users, payers, amounts, settled = columns.arrays()
+        slots, found = _np_slots(member_ids, np.where(settled == 1, payers, users))
+        nets = np.zeros(n, dtype=np.int64)
+        np.add.at(nets, slots[found], amounts[found])
+        return nets.tolist()
+
+    slot_of = {member_id: slot for slot, member_id in enumerate(member_ids)}
+    nets = [0] * n
+    for user_id, payer_id, amount, settled in zip(columns.user_ids, columns.payer_ids, columns.amounts,
+                                                  columns.settled):
+        slot = slot_of.get(payer_id if settled else user_id)
+        if slot is not None:
+            nets[slot] += amount
+    return nets
+
+
+def debt_matrix(columns, member_ids, use_numpy=None):
+    """
+    matrix[i][j] is what member i owes member j in paise on unsettled
+    shares, classified as the ledger does (see ledger.share_entries).
+    """
+    n = len(member_ids)
+    if _use_numpy(use_numpy):
+        users, payers, amounts, settled = columns.arrays()
+        open_ = (settled == 0) & (users != payers) & (amounts != 0)
+        users, payers, amounts = users[open_], payers[open_], amounts[open_]
+        # A negative share is owed by its member to the payer, a positive one the other way round
+        owing = amounts < 0
+        debtors, debtor_found = _np_slots(member_ids, np.where(owing, users, payers))
+        creditors, creditor_found = _np_slots(member_ids, np.where(owing, payers, users))
+        found = debtor_found & creditor_found
+        matrix = np.zeros(n * n, dtype=np.int64)
+        np.add.at(matrix, debtors[found] * n + creditors[found], np.abs(amounts[found]))
+        return matrix.reshape(n, n).tolist()
+
+    slot_of = {member_id: slot for slot, member_id in enumerate(member_ids)}
+    matrix = [[0] * n for _ in range(n)]
+    for user_id, payer_id, amount, settled in zip(columns.user_ids, columns.payer_ids, columns.amounts,
+                                                  columns.settled):
+        if settled or user_id == payer_id or not amount:
+            continue
+        debtor, creditor = (user_id, payer_id) if amount < 0 else (payer_id, user_id)
+        if debtor in slot_of and creditor in slot_of:
+            matrix[slot_of[debtor]][slot_of[creditor]] += abs(amount)
+    return matrix
+
+
+def member_totals(columns, member_ids, use_numpy=None):
+    """
+    Per member, in ``member_ids`` order: how many shares they hold, the
+    paise they fronted for others (positive shares), the paise they were
+    covered for (negative shares) and the unsettled remainder of both.
+    """
+    n = len(member_ids)
+    if _use_numpy(use_numpy):
+        users, payers, amounts, settled = columns.arrays()
+        slots, found = _np_slots(member_ids, users)
+        slots, amounts, settled = slots[found], amounts[found], settled[found]
+        counts = np.bincount(slots, minlength=n)
+        lent, borrowed, open_ = (np.zeros(n, dtype=np.int64) for _ in range(3))
+        np.add.at(lent, slots, np.maximum(amounts, 0))
+        np.add.at(borrowed, slots, np.maximum(-amounts, 0))
+        np.add.at(open_, slots, np.where(settled == 0, amounts, 0))
+        return [
+            {'shares': c, 'lent': l, 'borrowed': b, 'open': o}
+            for c, l, b, o in zip(counts.tolist(), lent.tolist(), borrowed.tolist(), open_.tolist())
+        ]
+
+    slot_of = {member_id: slot for slot, member_id in enumerate(member_ids)}
+    totals = [{'shares': 0, 'lent': 0, 'borrowed': 0, 'open': 0} for _ in range(n)]
+    for user_id, amount, settled in zip(columns.user_ids, columns.amounts, columns.settled):
+        slot = slot_of.get(user_id)
+        if slot is None:
+            continue
+        entry = totals[slot]
+        entry['shares'] += 1
+        if amount > 0:
+            entry['lent'] += amount
+        else:
+            entry['borrowed'] -= amount
+        if not settled:
+            entry['open'] += amount
+    return totals
+
+
+def group_report(group, use_numpy=None):
+    """
+    Nets (archived checkpoints included), totals and open debts for every
+    member of ``group``, all in paise, from one pass over its shares.
+    """
+    member_ids = list(group.members.order_by('id').values_list('id', flat=True))
+    columns = ShareColumns.load(ExpenseShare.objects.filter(expense__group=group))
+
+    nets = member_nets(columns, member_ids, use_numpy)
+    slot_of = {member_id: slot for slot, member_id in enumerate(member_ids)}
+    for user_id, net in GroupCheckpoint.objects.filter(group=group).values_list('user_id', 'net'):
+        if user_id in slot_of:
+            nets[slot_of[user_id]] += money.to_paise(net, limit=None)
+
+    matrix = debt_matrix(columns, member_ids, use_numpy)
+    totals = member_totals(columns, member_ids, use_numpy)
+    return {
+        'engine': engine(use_numpy),
+        'members': [dict(user_id=member_id, net=net, **total)
+                    for member_id, net, total in zip(member_ids, nets, totals)],
+        'debts': [
+            (member_ids[i], member_ids[j], amount)
+            for i, row in enumerate(matrix) for j, amount in enumerate(row) if amount
+        ],
+    }
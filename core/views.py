@@ -1,17 +1,31 @@
+import csv
+import hashlib
+import itertools
+import json
+import uuid
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.decorators import login_required
-from .models import FriendRequest, Friendship, FriendGroup, Expense, ExpenseShare, GroupSplit, TransactionHistory
-from .forms import ExpenseForm
-from django.db.models import Sum
-from django.db import models
+from django.contrib.admin.views.decorators import staff_member_required
+from .models import (
+    ArchivedExpense, ArchivedTransactionHistory, FriendRequest, Friendship, FriendGroup, Expense, ExpenseShare, GroupSplit,
+    Job, TransactionHistory,
+)
+from . import expenses, fragment_cache, importer, jobs, ledger, metrics, money, pagination, search, settlement
+from . import friends as friend_graph
+from .db_router import replica_reads
+from django.db.models import Count, F, Prefetch
 from decimal import Decimal
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
 from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.conf import settings
 
 
 
@@ -78,76 +92,60 @@ def RegisterView(request):
     return render(request, 'register.html')
     
 
+async def dashboard_balances(user):
+    # One row per counterparty, netted in the database from the pairwise
+    # ledger; the shares behind each row are paged on its detail page
+    you_owe, you_are_owed = [], []
+    async for pair in ledger.pair_nets(user):
+        if pair.net < 0:
+            you_owe.append({'user': pair.counterparty, 'amount': -pair.net})
+        elif pair.net > 0:
+            you_are_owed.append({'user': pair.counterparty, 'amount': pair.net})
+    you_are_owed.reverse()
+
+    # Totals come from the materialized ledger instead of summing the lists
+    you_owe_total, you_are_owed_total = await ledger.aget_totals(user)
+    total_balance = you_are_owed_total - you_owe_total
+
+    return {
+        'you_owe_total': round(you_owe_total, 2),
+        'you_are_owed_total': round(you_are_owed_total, 2),
+        'total_balance': round(total_balance, 2),
+        'you_owe': you_owe,
+        'you_are_owed': you_are_owed,
+    }
+
+
+@replica_reads
 @login_required
-def DashboardView(request):
-    pending_requests = FriendRequest.objects.filter(receiver=request.user, status="pending")
+async def DashboardView(request):
+    request.user = user = await request.auser()
+    pending_requests = [
+        friend_request async for friend_request in
+        FriendRequest.objects.filter(receiver=user, status="pending").select_related('sender')
+    ]
 
-    sent = FriendRequest.objects.filter(sender=request.user, status="accepted").values_list('receiver', flat=True)
-    received = FriendRequest.objects.filter(receiver=request.user, status="accepted").values_list('sender', flat=True)
-    friends_id = list(sent) + list(received)
-    friends = User.objects.filter(id__in=friends_id)
+    friends = await friend_graph.aget_friends(user)
 
-    user_groups = FriendGroup.objects.filter(members=request.user)
+    user_groups = [group async for group in FriendGroup.objects.filter(members=user).annotate(member_count=Count('members'))]
 
-    # Get all shares where user is involved
-    shares = ExpenseShare.objects.filter(
-        models.Q(user=request.user) | models.Q(expense__payer=request.user),
-        settled=False
-    ).select_related('expense', 'user', 'expense__payer', 'expense__group')
+    # The balance cards and debt lists are cached per user version; the
+    # shares are only read when one of them has to be rendered again
+    balances = None
 
-    # Categorize debts correctly
-    you_owe = []
-    you_are_owed = []
-    
-    for share in shares:
-        # Skip shares where user is both payer and participant
-        if share.user == share.expense.payer:
-            continue
-
-        # User is part of the expense participants
-        if share.user == request.user:
-            if share.amount < 0:  # Negative balance means user owes
-                you_owe.append({
-                    'amount': abs(share.amount),
-                    'to_user': share.expense.payer,
-                    'expense': share.expense,
-                    'is_group': share.expense.group is not None,
-                    'share_id': share.id  
-                })
-            elif share.amount > 0:  # Positive balance means user is owed
-                you_are_owed.append({
-                    'amount': share.amount,
-                    'from_user': share.expense.payer,
-                    'expense': share.expense,
-                    'is_group': share.expense.group is not None,
-                    'share_id': share.id 
-                })
-        
-        # User is the payer and others owe them
-        elif share.expense.payer == request.user:
-            if share.amount < 0:  # Negative amount means others owe the payer
-                you_are_owed.append({
-                    'amount': abs(share.amount),
-                    'from_user': share.user,
-                    'expense': share.expense,
-                    'is_group': share.expense.group is not None,
-                    'share_id': share.id  
-                })
-
-    # Calculate totals (with default 0 if lists are empty)
-    you_owe_total = sum(item['amount'] for item in you_owe) if you_owe else 0
-    you_are_owed_total = sum(item['amount'] for item in you_are_owed) if you_are_owed else 0
-    total_balance = you_are_owed_total - you_owe_total
+    async def get_balances():
+        nonlocal balances
+        if balances is None:
+            balances = await dashboard_balances(user)
+        return balances
 
+    users = [user.id]
     return render(request, 'dashboard.html', {
         'pending_requests': pending_requests,
         'user_groups': user_groups,
         'friends': friends,
-        'you_owe_total': round(you_owe_total, 2),
-        'you_are_owed_total': round(you_are_owed_total, 2),
-        'total_balance': round(total_balance, 2),
-        'you_owe': you_owe,
-        'you_are_owed': you_are_owed
+        'summary_html': await fragment_cache.arender(request, 'dashboard_summary', 'dashboard_summary.html', get_balances, users=users),
+        'breakdown_html': await fragment_cache.arender(request, 'dashboard_breakdown', 'dashboard_breakdown.html', get_balances, users=users),
     })
 
     
@@ -177,6 +175,7 @@ def handle_friend_request(request, request_id, action):
         Friendship.objects.create(user1=friend_request.sender, user2=friend_request.receiver)
         friend_request.status = "accepted"
         friend_request.save()
+        friend_graph.invalidate(friend_request.sender, friend_request.receiver)
         messages.success(request, f"You are now friends with {friend_request.sender.username}")
     elif action == "reject":
         messages.info(request, f"You rejected {friend_request.sender.username}'s request.")
@@ -184,19 +183,64 @@ def handle_friend_request(request, request_id, action):
 
     return redirect('dashboard')
 
-def search_users(request):
+@replica_reads
+@login_required
+async def search_users(request):
+    request.user = await request.auser()
     query = request.GET.get('q', '')  # Get search query from URL
-    users = User.objects.filter(username__icontains=query) if query else []
-    
-    return render(request, 'search_results.html', {'users': users, 'query': query})
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    users, total = await search.asearch_users(query, page=page) if query else ([], 0)
+
+    # Email addresses are only shown for people the user already knows: friends and group co-members
+    contact_ids = {request.user.id} | (await friend_graph.afriend_ids(request.user) & {user.id for user in users})
+    contact_ids.update([
+        user_id async for user_id in User.objects.filter(
+            id__in=[user.id for user in users], friend_groups__members=request.user, friend_groups__deleted_at=None,
+        ).values_list('id', flat=True)
+    ])
+
+    return render(request, 'search_results.html', {
+        'users': users,
+        'contact_ids': contact_ids,
+        'query': query,
+        'page': page,
+        'total': total,
+        'has_previous': page > 1,
+        'has_next': page * search.PAGE_SIZE < total,
+    })
 
 
+@replica_reads
 @login_required
-def list_friends(request):
-    friends = Friendship.objects.filter(user1=request.user) | Friendship.objects.filter(user2=request.user)
-    friend_list = [friend.user1 if friend.user2 == request.user else friend.user2 for friend in friends]
-
-    return render(request, 'friends_list.html', {'friends': friend_list})
+def search_typeahead(request):
+    query = ' '.join(search.tokenize(request.GET.get('q', '')))
+    if not query:
+        return JsonResponse({'results': []})
+
+    # Only signed-in users get here; the key says so, so nothing cached for them can ever be served to anyone else
+    cache_key = f'typeahead:authenticated:{hashlib.md5(query.encode()).hexdigest()}'
+    results = cache.get(cache_key)
+    if results is None:
+        users, _ = search.search_users(query, page_size=settings.SEARCH_TYPEAHEAD_LIMIT)
+        results = [
+            {'id': user.id, 'username': user.username, 'name': user.get_full_name()}
+            for user in users
+        ]
+        cache.set(cache_key, results, settings.SEARCH_TYPEAHEAD_TIMEOUT)
+    return JsonResponse({'results': results})
+
+
+@replica_reads
+@login_required
+async def list_friends(request):
+    request.user = await request.auser()
+    return render(request, 'friends_list.html', {
+        'friends': await friend_graph.aget_friends(request.user),
+        'settle_key': uuid.uuid4().hex,
+    })
 
 
 def create_group(request):
@@ -209,52 +253,53 @@ def create_group(request):
             return redirect('dashboard')
         
         group = FriendGroup.objects.create(name=name)
-        group.members.add(request.user)
-        
-        for friend_id in selected_friends:
-            friend = User.objects.get(id=friend_id)
-            group.members.add(friend)
 
-        group.save()
+        # Only actual friends can be added; one INSERT for all members
+        friend_ids = friend_graph.friend_ids(request.user)
+        group.members.add(request.user, *{int(fid) for fid in selected_friends if fid.isdigit() and int(fid) in friend_ids})
+
         messages.success(request, "Group created successfully!")
         return redirect("dashboard")
 
-    friendships = Friendship.objects.filter(user1=request.user) | Friendship.objects.filter(user2=request.user)
-    friends = [f.user1 if f.user2 == request.user else f.user2 for f in friendships]
-
-    return render(request, "create_group.html", {"friends": friends})
+    return render(request, "create_group.html", {"friends": get_friends(request.user)})
 
 
 @login_required
-def group_detail(request, group_id):
-    group = get_object_or_404(FriendGroup, id=group_id)
-
-    if request.user not in group.members.all():
+async def group_detail(request, group_id):
+    request.user = await request.auser()
+
+    # The whole page is assembled in a fixed number of queries: the group with
+    # its members, the splits with both users, and the expenses with payer and
+    # shares (with their users) prefetched.
+    try:
+        group = await FriendGroup.objects.prefetch_related('members').aget(id=group_id)
+    except FriendGroup.DoesNotExist:
+        raise Http404("No FriendGroup matches the given query.")
+    members = list(group.members.all())
+
+    if request.user.id not in {member.id for member in members}:
         messages.error(request, "You are not a member of this group.")
         return redirect("dashboard")
 
-    # Get all group splits (both settled and unsettled)
-    # Change this line if you only want unsettled splits:
-    # splits = GroupSplit.objects.filter(group=group, settled=False)
-    splits = GroupSplit.objects.filter(group=group)
-    
-    # Debug information
-    print(f"Group: {group.name}, Split count: {splits.count()}")
-    
-    user_owes = splits.filter(from_user=request.user)
-    user_is_owed = splits.filter(to_user=request.user)
-    
-    print(f"User owes count: {user_owes.count()}")
-    print(f"User is owed count: {user_is_owed.count()}")
-    
-    group_expenses = Expense.objects.filter(group=group).prefetch_related('shares', 'payer')
+    # Expenses and splits are cached per group version and only queried
+    # when the fragment has to be rendered again
+    async def activity():
+        return {
+            'splits': [split async for split in GroupSplit.objects.filter(group=group).select_related('from_user', 'to_user')],
+            'group_expenses': [
+                expense async for expense in
+                Expense.objects.filter(group=group).select_related('payer').prefetch_related(
+                    Prefetch('shares', queryset=ExpenseShare.objects.select_related('user'))
+                )
+            ],
+            'archived_count': await ArchivedExpense.objects.filter(group=group).acount(),
+        }
 
     return render(request, 'group_detail.html', {
         'group': group,
-        'splits': splits,
-        'user_owes': user_owes, 
-        'user_is_owed': user_is_owed,
-        'group_expenses': group_expenses,
+        'members': members,
+        'activity_html': await fragment_cache.arender(request, 'group_activity', 'group_activity.html', activity,
+                                                      groups=[group.id]),
     })
 
     
@@ -264,66 +309,12 @@ def calculate_group_split(request, group_id):
     group = get_object_or_404(FriendGroup, id=group_id)
 
     if request.method == "POST":
-        members = list(group.members.all())
-        member_map = {member.id: member for member in members}
-        member_ids = list(member_map.keys())
-
-        paid = {uid: Decimal('0.00') for uid in member_ids}
-        total_group_expense = Decimal('0.00')
-
-        # Sum actual contributions from ExpenseShare
-        for expense in Expense.objects.filter(group=group):
-            total_group_expense += expense.amount
-            for share in ExpenseShare.objects.filter(expense=expense):
-                user_id = share.user.id
-                paid[user_id] += (share.amount + (expense.amount / len(members)))
-
-        if total_group_expense == 0 or not members:
-            messages.warning(request, "No expenses found for this group or no members in group.")
-            return redirect('group_detail', group_id=group.id)
-
-        equal_share = total_group_expense / len(members)
-
-        # Calculate net balances
-        net_balance = {
-            uid: (paid[uid] - equal_share).quantize(Decimal('0.01'))
-            for uid in member_ids
-        }
-
-        GroupSplit.objects.filter(group=group).delete()
-
-        owes = [(uid, -bal) for uid, bal in net_balance.items() if bal < 0]
-        gets = [(uid, bal) for uid, bal in net_balance.items() if bal > 0]
-
-        owes.sort(key=lambda x: x[1], reverse=True)
-        gets.sort(key=lambda x: x[1], reverse=True)
-
-        SMALL_AMT = Decimal('0.01')
-        i = j = 0
-
-        while i < len(owes) and j < len(gets):
-            owe_id, owe_amt = owes[i]
-            get_id, get_amt = gets[j]
-
-            transfer = min(owe_amt, get_amt)
-
-            if transfer >= SMALL_AMT:
-                GroupSplit.objects.create(
-                    group=group,
-                    from_user=member_map[owe_id],
-                    to_user=member_map[get_id],
-                    amount=transfer
-                )
-
-            owes[i] = (owe_id, (owe_amt - transfer).quantize(Decimal('0.01')))
-            gets[j] = (get_id, (get_amt - transfer).quantize(Decimal('0.01')))
-
-            if owes[i][1] <= SMALL_AMT:
-                i += 1
-            if gets[j][1] <= SMALL_AMT:
-                j += 1
-
-        messages.success(request, "Splits calculated successfully.")
+        # Merges with any recalculation already queued for this group and
+        # runs it straight away instead of after the debounce delay
+        job = jobs.schedule_split_recalculation(
+            group.id, user=request.user, strategy=request.POST.get('strategy'), delay=0
+        )
+        messages.success(request, f"Splits are being recalculated (job #{job.id}).")
         return redirect('group_detail', group_id=group.id)
 
     return redirect('group_detail', group_id=group.id)
@@ -334,68 +325,32 @@ def add_group_expense(request, group_id):
     if request.method == "POST":
         group = get_object_or_404(FriendGroup, id=group_id)
         description = request.POST.get("description")
-        total_amount = Decimal(request.POST.get("amount"))
-        
-        # Track actual payments from all members
-        contributions = {}
-        total_contributed = Decimal('0.00')
-        for member in group.members.all():
-            amount_paid = Decimal(request.POST.get(f"paid_{member.id}", '0.00'))
-            if amount_paid > 0:
-                contributions[member] = amount_paid
-                total_contributed += amount_paid
-
-        # Validate total contributions match expense amount
-        if abs(total_contributed - total_amount) > Decimal('0.01'):
-            messages.error(request, "Total contributions don't match expense amount")
+        split_type = request.POST.get("split_type") or money.EQUAL
+
+        # Fetch the member ids once and reuse them for every row below
+        member_ids = list(group.members.order_by('id').values_list('id', flat=True))
+
+        try:
+            total = money.to_paise(request.POST.get("amount"))
+
+            # Track actual payments from all members, in paise
+            contributions = {}
+            split_values = []
+            for member_id in member_ids:
+                amount_paid = money.to_paise(request.POST.get(f"paid_{member_id}") or '0')
+                if amount_paid > 0:
+                    contributions[member_id] = amount_paid
+                if split_type != money.EQUAL:
+                    split_values.append(request.POST.get(f"split_{member_id}") or '0')
+
+            # What each member owes; the member who paid the most becomes the payer.
+            # Shares and history rows are written in one INSERT each.
+            owed = money.split(total, split_type, split_values, n=len(member_ids))
+            expenses.create_group_expense(group, description, total, member_ids, contributions, owed)
+        except expenses.SplitError as e:
+            messages.error(request, str(e))
             return redirect('group_detail', group_id=group.id)
 
-        # Find main payer (who paid the most)
-        main_payer = max(contributions.items(), key=lambda x: x[1], default=(None, 0))[0]
-        
-        # Create expense with actual main payer
-        expense = Expense.objects.create(
-            group=group,
-            description=description,
-            amount=total_amount,
-            payer=main_payer
-        )
-
-        # Calculate equal share per member
-        num_members = group.members.count()
-        share_amount = total_amount / num_members
-
-        # Create main expense history record for the payer
-        TransactionHistory.objects.create(
-            user=main_payer,
-            transaction_type='expense',
-            amount=total_amount,
-            group=group,
-            description=description
-        )
-
-        # Create shares showing net balance for each member
-        for member in group.members.all():
-            paid = contributions.get(member, Decimal('0.00'))
-            net_balance = paid - share_amount
-            
-            ExpenseShare.objects.create(
-                expense=expense,
-                user=member,
-                amount=net_balance.quantize(Decimal('0.01'))
-            )
-            
-            # Create history record for each participant
-            if member != main_payer:
-                TransactionHistory.objects.create(
-                    user=member,
-                    transaction_type='expense',
-                    amount=-share_amount.quantize(Decimal('0.01')),
-                    group=group,
-                    description=f"Share of {description}",
-                    related_user=main_payer
-                )
-
         messages.success(request, "Expense added successfully!")
         return redirect('group_detail', group_id=group.id)
     
@@ -407,9 +362,13 @@ def add_group_expense(request, group_id):
 def delete_group(request, group_id):
     group = get_object_or_404(FriendGroup, id=group_id)
 
-    if request.user in group.members.all():
-        group.delete()
-        messages.success(request, "Group deleted successfully!")
+    if group.members.filter(id=request.user.id).exists():
+        # Hide it now; the rows are purged in the background
+        FriendGroup.objects.filter(id=group.id).update(deleted_at=timezone.now())
+        fragment_cache.invalidate(users=group.members.values_list('id', flat=True), groups=[group.id])
+        job = jobs.enqueue(jobs.DELETE_GROUP, {'group_id': group.id}, user=request.user,
+                           dedup_key=f'{jobs.DELETE_GROUP}:{group.id}')
+        messages.success(request, f"Group is being deleted (job #{job.id}).")
     else:
         messages.error(request, "You are not allowed to delete this group.")
 
@@ -417,70 +376,26 @@ def delete_group(request, group_id):
 
 
 def get_friends(user):
-    friendships = Friendship.objects.filter(models.Q(user1=user) | models.Q(user2=user))
-    friends = []
-    for friendship in friendships:
-        if friendship.user1 == user:
-            friends.append(friendship.user2)
-        else:
-            friends.append(friendship.user1)
-    return friends
+    return friend_graph.get_friends(user)
 
 
 @login_required
+@transaction.atomic
 def add_expense(request):
     if request.method == "POST":
         description = request.POST.get("description")
-        amount = float(request.POST.get("amount"))
+        try:
+            amount = money.from_paise(money.to_paise(request.POST.get("amount")))
+        except expenses.SplitError:
+            amount = Decimal('0.00')
         friend_ids = request.POST.getlist("friends")
 
         if amount <= 0 or not friend_ids:
             messages.error(request, "Invalid amount or no friends selected.")
             return redirect('add_expense')
 
-        payer = request.user
-        friends = User.objects.filter(id__in=friend_ids)
-        total_people = len(friends) + 1
-        share_per_person = amount / total_people
-
-        expense = Expense.objects.create(
-            description=description,
-            amount=amount,
-            payer=payer
-        )
-        expense.friends.set(friends)
-        
-        TransactionHistory.objects.create(
-            user=request.user,
-            amount=amount,
-            description=description,
-            group=expense.group
-        )
-        
-        for friend in friends:
-            TransactionHistory.objects.create(
-                user=friend,
-                amount=share_per_person,
-                description=f"Share of {description}",
-                group=expense.group,
-                related_user=payer
-            )
-
-        # Create shares with proper net balances
-        # Payer's share: total paid - their fair share
-        ExpenseShare.objects.create(
-            expense=expense,
-            user=payer,
-            amount=round(amount - share_per_person, 2)
-        )
-
-        # Friends' shares: 0 paid - their fair share
-        for friend in friends:
-            ExpenseShare.objects.create(
-                expense=expense,
-                user=friend,
-                amount=round(-share_per_person, 2)
-            )
+        friend_ids = list(User.objects.filter(id__in=friend_ids).values_list('id', flat=True))
+        expenses.create_personal_expense(request.user, description, money.to_paise(amount), friend_ids)
 
         messages.success(request, "Expense added and split successfully!")
         return redirect('dashboard')
@@ -500,15 +415,9 @@ def LogoutView(request):
 
 @login_required
 def clear_all_transactions(request):
-    user = request.user
-
-    # Delete expenses where user is payer
-    Expense.objects.filter(payer=user).delete()
-
-    # Delete shares where user was involved as a friend
-    ExpenseShare.objects.filter(user=user).delete()
-
-    messages.success(request, "All your transactions have been cleared.")
+    job = jobs.enqueue(jobs.CLEAR_TRANSACTIONS, {'user_id': request.user.id}, user=request.user,
+                       dedup_key=f'{jobs.CLEAR_TRANSACTIONS}:{request.user.id}')
+    messages.success(request, f"Your transactions are being cleared (job #{job.id}).")
     return redirect('dashboard')
 
 
@@ -517,65 +426,179 @@ def clear_group_splits(request, group_id):
 
     if request.method == 'POST':
         GroupSplit.objects.filter(group=group).delete()
+        fragment_cache.invalidate(groups=[group.id])
         messages.success(request, 'All transactions have been cleared!')
     
     return redirect('group_detail', group_id=group.id)
 
 
 @login_required
-@transaction.atomic
 def settle_expense(request, share_id):
-    share = get_object_or_404(ExpenseShare, id=share_id)
+    share = get_object_or_404(ExpenseShare.objects.select_related('expense'), id=share_id)
     
     # Validate user can settle this
-    if request.user != share.expense.payer and request.user != share.user:
+    if request.user.id != share.expense.payer_id and request.user.id != share.user_id:
         messages.error(request, "You can't settle this expense")
         return redirect('dashboard')
     
-    share.settled = True
-    share.save()
-
-    # Handle group settlements
-    if share.expense.group:
-        # Update GroupSplit
-        GroupSplit.objects.filter(
-            group=share.expense.group,
-            from_user=share.user,
-            to_user=share.expense.payer,
-            amount=abs(share.amount)
-        ).update(settled=True)
-
-    # Create/update TransactionHistory records
-    TransactionHistory.objects.update_or_create(
-        user=request.user,
-        description=f"Settled: {share.expense.description}",
-        defaults={
-            'transaction_type': 'settlement',
-            'amount': -abs(share.amount),
-            'group': share.expense.group,
-            'related_user': share.expense.payer,
-            'settled_at': timezone.now()
-        }
+    if settlement.settle(request.user, share_ids=[share.id])['shares']:
+        messages.success(request, f"Successfully settled ₹{abs(share.amount)}")
+    else:
+        messages.info(request, "This expense is already settled.")
+    return redirect('dashboard')
+
+
+@login_required
+def settle_with_friend(request, user_id):
+    if request.method != "POST":
+        return redirect('friends_list')
+    friend = get_object_or_404(User, id=user_id)
+    # The form carries a key so a double submit or a retry settles only once
+    result = settlement.settle(request.user, with_user=friend,
+                               idempotency_key=request.POST.get('idempotency_key') or None)
+    if result['shares'] and not result['replayed']:
+        messages.success(request, f"Settled {len(result['shares'])} expenses with {friend.username} (₹{result['amount']})")
+    else:
+        messages.info(request, f"Nothing left to settle with {friend.username}.")
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('friends_list')
+
+
+@replica_reads
+@login_required
+async def balance_detail(request, user_id):
+    request.user = await request.auser()
+    try:
+        counterparty = await User.objects.aget(id=user_id)
+    except User.DoesNotExist:
+        raise Http404("No User matches the given query.")
+
+    shares, next_cursor = await pagination.akeyset_page(
+        settlement.open_shares(request.user, with_user=counterparty).select_related(
+            'expense', 'expense__group', 'expense__payer'
+        ).annotate(created_at=F('expense__created_at')),
+        cursor=request.GET.get('cursor'),
     )
+    for share in shares:
+        # Positive when the counterparty owes the current user
+        share.net = share.amount if share.user_id == request.user.id else -share.amount
+    pair = await ledger.pair_nets(request.user).filter(counterparty=counterparty).afirst()
+
+    return render(request, 'balance_detail.html', {
+        'counterparty': counterparty,
+        'net': pair.net if pair else Decimal('0.00'),
+        'shares': shares,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'settle_key': uuid.uuid4().hex,
+    })
 
-    TransactionHistory.objects.update_or_create(
-        user=share.expense.payer,
-        description=f"Received settlement for {share.expense.description}",
-        defaults={
-            'transaction_type': 'settlement',
-            'amount': abs(share.amount),
-            'group': share.expense.group,
-            'related_user': request.user,
-            'settled_at': timezone.now()
-        }
+@login_required
+def import_expenses(request):
+    errors = []
+    if request.method == "POST" and request.FILES.get("file"):
+        try:
+            result = importer.import_upload(request.FILES["file"], actor=request.user)
+        except importer.ImportFormatError as e:
+            messages.error(request, str(e))
+            return redirect('import_expenses')
+
+        errors = result.errors
+        messages.success(
+            request,
+            f"Imported {result.imported} of {result.rows} rows ({result.rows_per_second:.0f} rows/s)."
+        )
+        if not result.error_count:
+            return redirect('dashboard')
+
+    return render(request, 'import_expenses.html', {'errors': errors})
+
+
+@replica_reads
+@login_required
+async def transaction_history(request):
+    request.user = await request.auser()
+    history, next_cursor = await pagination.akeyset_page(
+        TransactionHistory.objects.filter(user=request.user).select_related('group', 'related_user'),
+        cursor=request.GET.get('cursor'),
+        older=ArchivedTransactionHistory.objects.filter(user=request.user).select_related('group', 'related_user'),
     )
-    
-    messages.success(request, f"Successfully settled ₹{abs(share.amount)}")
-    return redirect('dashboard')
+    return render(request, 'transaction_history.html', {
+        'history': history,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+    })
+
 
+class Echo:
+    # Pseudo-buffer for csv.writer: hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+HISTORY_EXPORT_FIELDS = ('created_at', 'transaction_type', 'description', 'amount',
+                         'group__name', 'related_user__username', 'settled_at')
+
+
+@replica_reads
 @login_required
-def transaction_history(request):
-    history = TransactionHistory.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'transaction_history.html', {'history': history})
+def export_transaction_history(request):
+    export_format = request.GET.get('format', 'csv')
+    # Archived rows are all older than the live ones, so they simply follow
+    rows = itertools.chain.from_iterable(
+        model.objects.filter(user=request.user).order_by('-created_at', '-id').values_list(
+            *HISTORY_EXPORT_FIELDS
+        ).iterator(chunk_size=2000)
+        for model in (TransactionHistory, ArchivedTransactionHistory)
+    )
+    columns = ['date', 'type', 'description', 'amount', 'group', 'with', 'settled_at']
+
+    if export_format == 'json':
+        def stream():
+            yield '['
+            for i, row in enumerate(rows):
+                record = dict(zip(columns, row))
+                record['date'] = record['date'].isoformat()
+                record['amount'] = str(record['amount'])
+                if record['settled_at'] is not None:
+                    record['settled_at'] = record['settled_at'].isoformat()
+                yield (',' if i else '') + json.dumps(record)
+            yield ']'
+        response = StreamingHttpResponse(stream(), content_type='application/json')
+    else:
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse(
+            itertools.chain([writer.writerow(columns)], (writer.writerow(row) for row in rows)),
+            content_type='text/csv',
+        )
+        export_format = 'csv'
 
+    response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+    return response
 
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(fragment_cache.stats())
+
+
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def job_status(request, job_id):
+    job = get_object_or_404(Job, id=job_id, requested_by=request.user)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'result': job.result,
+        'progress': job.progress,
+        'error': job.error if job.status == Job.FAILED else None,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    })
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,10 +47,108 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_PERMISSION_CLASSES': (
+        'rest_framework.permissions.IsAuthenticated',
+    ),
+    # JSON only: the browsable API would render a template for every read
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+    ),
 }
 
 LOGIN_REDIRECT_URL = 'dashboard'
+
+# Debt simplification used by calculate_group_split: 'greedy', 'heap' or
+# 'optimal' (minimum number of transfers). Strategies that run past the time
+# budget (seconds) fall back to greedy.
+SPLIT_STRATEGY = 'optimal'
+SPLIT_TIME_BUDGET = 0.25
+
+# Seconds a user's friend list stays in the cache; accepting a friend
+# request invalidates it immediately.
+FRIENDS_CACHE_TIMEOUT = 600
+
+# User search. Leave SEARCH_BACKEND unset to use SQLite FTS5 when running on
+# SQLite and plain indexed prefix lookups elsewhere.
+# SEARCH_BACKEND = 'core.search.DatabaseSearchBackend'
+SEARCH_TYPEAHEAD_LIMIT = 8
+SEARCH_TYPEAHEAD_TIMEOUT = 30
+
+# Rendered dashboard and group fragments are keyed by per-user and per-group
+# version counters (core/fragment_cache.py), so they never go stale and the
+# timeout only bounds memory. The counters (and the friend lists) are bumped
+# by the background workers too, so the cache must be shared by every web and
+# worker process: a directory on local disk by default, or Redis when
+# REDIS_URL is set. The file backend is not an LRU: once MAX_ENTRIES is
+# reached it deletes 1/CULL_FREQUENCY of the files, picked at random, hot or
+# not, so size MAX_ENTRIES from the hit ratio reported at /cache/stats/ and
+# use Redis (with an allkeys-lru maxmemory-policy) where eviction order
+# matters.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'TIMEOUT': 300,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+            'TIMEOUT': 300,
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+                'CULL_FREQUENCY': 10,
+            },
+        },
+    }
+FRAGMENT_CACHE_TIMEOUT = 3600
+
+# The test suite (through TEST_RUNNER) and the benchmark commands use this
+# private in-process cache instead, so clearing it between tests never
+# wipes the cache the running servers share.
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+TEST_RUNNER = 'core.test_runner.SplitwiseTestRunner'
+
+# Background jobs (core/jobs.py), run by 'manage.py run_workers'. Group
+# splits are recalculated SPLIT_RECALC_DELAY seconds after the last expense
+# write, but at most JOBS_DEBOUNCE_MAX seconds after the first. Workers
+# invalidate cached fragments too, through the shared CACHES above.
+SPLIT_RECALC_DELAY = 5
+JOBS_DEBOUNCE_MAX = 60
+JOBS_POLL_INTERVAL = 1.0
+JOBS_STALE_AFTER = 600
+JOBS_MAX_ATTEMPTS = 3
+
+# Clearing an account and deleting a group delete this many rows per
+# transaction (see core/purge.py)
+PURGE_CHUNK_SIZE = 1000
+
+# Settled expenses and history older than this are moved to the archive
+# tables by 'manage.py compact_history' (see core/compaction.py)
+COMPACTION_AFTER_DAYS = 90
+
+# Per-view query/latency histograms served at /metrics/ (see core/metrics.py).
+# Profiling is off unless a sample rate is set; profiles of sampled requests
+# slower than METRICS_PROFILE_SLOW_MS are written to METRICS_PROFILE_DIR.
+METRICS_ENABLED = True
+METRICS_PROFILE_SAMPLE_RATE = 0.0
+METRICS_PROFILE_SLOW_MS = 500
+METRICS_PROFILE_DIR = BASE_DIR / 'profiles'
+
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,12 +182,61 @@ WSGI_APPLICATION = 'splitwise.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment. By default the local SQLite file, in WAL
+# mode so readers never block the writer, with writes taking the lock at the
+# start of each transaction and waiting up to 20s for it instead of failing
+# with "database is locked". With DB_ENGINE=postgres: DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST and DB_PORT, plus
+#   DB_POOL_MAX       use psycopg's connection pool (pip install "psycopg[pool]")
+#                     of up to this many connections per process
+#   DB_CONN_MAX_AGE   otherwise, seconds to keep persistent connections (60)
+#   DB_PGBOUNCER=1    behind PgBouncer in transaction mode
+#   DB_REPLICA_HOSTS  comma-separated read replicas (see core/db_router.py)
+DATABASE_REPLICAS = []
+if os.environ.get('DB_ENGINE') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'splitwise'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_HEALTH_CHECKS': True,
+            # Server-side cursors (used by .iterator()) do not survive transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_PGBOUNCER') == '1',
+        },
     }
-}
+    if os.environ.get('DB_POOL_MAX'):
+        # Django requires CONN_MAX_AGE = 0 (the default) with its pool
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {'min_size': int(os.environ.get('DB_POOL_MIN', 2)), 'max_size': int(os.environ['DB_POOL_MAX'])},
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+    for i, host in enumerate(h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()):
+        DATABASES[f'replica_{i}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+        DATABASE_REPLICAS.append(f'replica_{i}')
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA cache_size=-32000; '
+                    'PRAGMA temp_store=MEMORY; PRAGMA mmap_size=268435456;'
+                ),
+            },
+        },
+    }
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+# Seconds a browser keeps reading from the primary after a write; keep it
+# above the replicas' usual lag
+DATABASE_STICKY_SECONDS = 10
 
 
 # Password validation